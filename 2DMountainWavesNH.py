@@ -11,7 +11,7 @@ analytical function or equally spaced discrete (FFT interpolation)
 
 COMPUTES: Map of T(z) and h(x) from input to computational domain. Linear LHS operator
 matrix, boundary forcing vector and RHS residual. Solves steady problem with UMFPACK and
-ALSQR Multigrid. Solves transient problem with Ketchenson SSPRK93 low storage method.
+GMRES with a spectral p-multigrid preconditioner. Solves transient problem with Ketchenson SSPRK93 low storage method.
 
 @author: Jorge E. Guerra
 """
@@ -23,26 +23,24 @@ import math as mt
 import bottleneck as bn
 import scipy.sparse as sps
 import scipy.sparse.linalg as spl
-import scipy.linalg as dsl
 from matplotlib import cm
 import matplotlib.pyplot as plt
 # Import from the local library of routines
-from computeGrid import computeGrid
-from computeAdjust4CBC import computeAdjust4CBC
-from computeColumnInterp import computeColumnInterp
-import computePartialDerivativesXZ as devop
-from computeTopographyOnGrid import computeTopographyOnGrid
-import computeGuellrichDomain2D as coords
-from computeTemperatureProfileOnGrid import computeTemperatureProfileOnGrid
-from computeThermoMassFields import computeThermoMassFields
-from computeShearProfileOnGrid import computeShearProfileOnGrid
-from computeRayleighEquations import computeRayleighEquations
+from computeOperatorCache import OperatorCache
+from computeModelSetup import computeModelSetup
 from computeInterpolatedFields import computeInterpolatedFields
 
 # Numerical stuff
-import computeDerivativeMatrix as derv
 import computeEulerEquationsLogPLogT as eqs
 import computeTimeIntegration as tint
+import computeJacobianAssembly as jasm
+import computeSchurComplement as schur
+import computeColumnPreconditioner as cpc
+import computeIterativeSolveNL as nks
+import computeMixedPrecision as mpr
+import computeFourierModeSolve as fms
+import computeFastDiagonalization as fdg
+import computeSpectralMultigrid as smg
 
 import faulthandler; faulthandler.enable()
 
@@ -53,6 +51,8 @@ localDir = '/home/jeg/scratch/' # Home super desktop
 #localDir = '/home/jeguerra/scratch/'
 restart_file = localDir + 'restartDB'
 schurName = localDir + 'SchurOps'
+schurDir = localDir + 'schur/'
+opcacheDir = localDir + 'opcache/'
 
 def makeTemperatureBackgroundPlots(Z_in, T_in, ZTL, TZ, DTDZ):
        
@@ -188,6 +188,8 @@ def makeFieldPlots(TOPT, thisTime, XL, ZTL, fields, rhs, NX, NZ, numVar):
        return
 
 def displayResiduals(message, RHS, thisTime, udex, wdex, pdex, tdex):
+       # Residual norms always in double precision
+       RHS = np.asarray(RHS, dtype=np.float64)
        err = np.linalg.norm(RHS)
        err1 = np.linalg.norm(RHS[udex])
        err2 = np.linalg.norm(RHS[wdex])
@@ -200,12 +202,39 @@ def displayResiduals(message, RHS, thisTime, udex, wdex, pdex, tdex):
        
        return err
 
-def getFromRestart(name, TOPT, NX, NZ, StaticSolve):
-       rdb = shelve.open(restart_file, flag='r')
+# Transient operators and background derivatives in the working precision
+# (the hydrostatic background REFS[9] stays in double precision)
+def castTransientData(REFS, REFG, dtype):
+       castOps = {}
+       def castOp(OP):
+              if isinstance(OP, tuple):
+                     return tuple([castOp(op) for op in OP])
+              elif not hasattr(OP, 'astype'):
+                     return OP
+              # Operators shared between REFS entries are cast once
+              if id(OP) not in castOps:
+                     castOps[id(OP)] = OP.astype(dtype)
+              return castOps[id(OP)]
+       
+       REFS = list(REFS)
+       REFG = list(REFG)
+       # Derivative operators and terrain slope
+       for ii in [10, 11, 12, 13, 15]:
+              REFS[ii] = castOp(REFS[ii])
+       # Background derivatives and Rayleigh operator
+       for ii in [2, 4, 6]:
+              REFG[ii] = castOp(REFG[ii])
+       
+       return REFS, REFG
+
+# Restart data from another resolution is interpolated to the grid GRID
+# (DIMS, REFS, HF_TRANS, CH_TRANS, HermCheb, sysDex) when it is given
+def getFromRestart(name, TOPT, NX, NZ, StaticSolve, GRID=None, opCache=None):
+       rdb = shelve.open(name, flag='r')
        
        NX_in = rdb['NX']
        NZ_in = rdb['NZ']
-       if NX_in != NX or NZ_in != NZ:
+       if (NX_in != NX or NZ_in != NZ) and GRID is None:
               print('ERROR: RESTART DATA IS INVALID')
               print(NX, NX_in)
               print(NZ, NZ_in)
@@ -218,90 +247,123 @@ def getFromRestart(name, TOPT, NX, NZ, StaticSolve):
        if TOPT[4] <= IT and not StaticSolve:
               print('ERROR: END TIME LEQ INITIAL TIME ON RESTART')
               sys.exit(2)
+       
+       if NX_in != NX or NZ_in != NZ:
+              print('Interpolating restart data from NX = %d, NZ = %d' % (NX_in, NZ_in))
+              GRID_in = smg.computeGridTransforms(tuple(rdb['DIMS']), GRID['HermCheb'], opCache)
+              SOLT, LMS = smg.transferSolution(np.array(SOLT), LMS, GRID_in, GRID)
+              # Diffusion coefficients start over on the new grid
+              OPS = GRID['DIMS'][5]
+              DCF = (np.zeros((OPS, 1)), np.zeros((OPS, 1)))
               
        rdb.close()
        
        return np.array(SOLT), LMS, DCF, NX_in, NZ_in, IT
 
-# Store a matrix to disk in column wise chucks
-def storeColumnChunks(MM, Mname, dbName):
-       # Set up storage and store full array
-       mdb = shelve.open(dbName, flag='n')
-       # Get the number of cpus
-       import multiprocessing as mtp
-       NCPU = mtp.cpu_count()
-       # Partition CS into NCPU column wise chuncks
-       NC = MM.shape[1] # Number of columns in MM
-       RC = NC % NCPU # Remainder of columns when dividing by NCPU
-       SC = int((NC - RC) / NCPU) # Number of columns in each chunk
+def storeRestart(name, SOLT, LMS, DCF, DSOL, NX, NZ, ET, PHYS, DIMS, REFS=None):
+       rdb = shelve.open(name, flag='n')
+       rdb['DSOL'] = DSOL
+       rdb['SOLT'] = SOLT
+       rdb['LMS'] = LMS
+       rdb['DCF'] = DCF
+       rdb['NX'] = NX
+       rdb['NZ'] = NZ
+       rdb['ET'] = ET
+       rdb['PHYS'] = PHYS
+       rdb['DIMS'] = DIMS
+       if REFS is not None:
+              rdb['REFS'] = REFS
+       rdb.close()
        
-       # Loop over NCPU column chunks and store
-       cranges = []
-       for cc in range(NCPU):
-              cbegin  = cc * SC
-              if cc < NCPU - 1:
-                     crange = range(cbegin,cbegin + SC)
-              elif cc == NCPU - 1:
-                     crange = range(cbegin,cbegin + SC + RC)
-              
-              cranges.append(crange)
-              mdb[Mname + str(cc)] = MM[:,crange]
-              
-       mdb.close()
-              
-       return NCPU, cranges
+       return
 
+# Get a block of the Schur partition from disk
 def computeSchurBlock(dbName, blockName):
        # Open the blocks database
        bdb = shelve.open(dbName, flag='r')
        
-       if blockName == 'AS':
-              SB = sps.bmat([[bdb['LDIA'], bdb['LNA'], bdb['LOA']], \
-                             [bdb['LDA'], bdb['A'], bdb['B']], \
-                             [bdb['LHA'], bdb['E'], bdb['F']]], format='csr')
-       elif blockName == 'BS':
-              SB = sps.bmat([[bdb['LPA'], bdb['LQAR']], \
-                             [bdb['C'], bdb['D']], \
-                             [bdb['G'], bdb['H']]], format='csr')
-       elif blockName == 'CS':
-              SB = sps.bmat([[bdb['LMA'], bdb['I'], bdb['J']], \
-                             [bdb['LQAC'], bdb['N'], bdb['O']]], format='csr')
-       elif blockName == 'DS':
-              SB = sps.bmat([[bdb['K'], bdb['M']], \
-                             [bdb['P'], bdb['Q']]], format='csr')
+       # Blocks are stored as partitions of the global operator
+       if blockName in ['AS', 'BS', 'CS', 'DS']:
+              SB = bdb[blockName]
        else:
               print('INVALID SCHUR BLOCK NAME!')
               
        bdb.close()
 
-       return SB.toarray()
+       return SB
 
-def runModel(TestName):
+# Static solutions take up to newtonIters Newton steps in process (stopping at
+# newtonTol residual relative to the background state) with restart checkpoints
+# every newtonCheckpoint
+# gridUpdate: (NX, NZ) replacing the grid of the test case
+def runModel(TestName, solTypeUpdate=None, newtonIters=1, newtonTol=1.0E-8, newtonCheckpoint=0, \
+             gridUpdate=None):
        import TestCase
        
        thisTest = TestCase.TestCase(TestName)
+       # Override solution type switches of the test case
+       if solTypeUpdate is not None:
+              thisTest.solType.update(solTypeUpdate)
+       # Override the grid size of the test case
+       if gridUpdate is not None:
+              L1, L2, ZH = thisTest.DIMS[0:3]
+              thisTest.DIMS = (L1, L2, ZH, gridUpdate[0], gridUpdate[1], (gridUpdate[0] + 1) * gridUpdate[1])
        
        # Set the solution type (MUTUALLY EXCLUSIVE)
        StaticSolve = thisTest.solType['StaticSolve']
        NonLinSolve = thisTest.solType['NLTranSolve']
        NewtonLin = thisTest.solType['NewtonLin']
        ExactBC = thisTest.solType['ExactBC']
+       # Single precision state and operators for the transient solver
+       SinglePrec = thisTest.solType['SinglePrec']
        
        # Switch to use the PyRSB multithreading module (CPU multithreaded SpMV)
+       # or the matrix free tensor product derivative operators (batched GEMM)
        if StaticSolve:
               RSBops = False
+              TensorOps = False
+              ChebTransOps = False
               ApplyGML = False
        else:
               RSBops = True # Turn off PyRSB SpMV
+              TensorOps = False # Turn on tensor product operators (opt-in, replaces RSBops)
+              # Vertical spectral derivative by DCT (beats SpMV for NZ >= 128 and
+              # batched GEMM only at large NZ), tensor product operators only
+              ChebTransOps = False
               ApplyGML = True
        
+       # Switch to reuse grids and operators from the on-disk cache
+       CacheOps = False
+       
+       # Relative tolerance of the HODLR compressed factors of DS in the Schur solve (None for dense LU,
+       # the Schur complement DS_SC keeps a dense LU either way)
+       SchurTolHODLR = None
+       
+       # Full SuperLU or dense Schur LU factored in single precision and refined to
+       # double precision by 'ir' (iterative refinement) or 'gmres' (GMRES-IR), None for float64
+       StaticLowPrec = None
+       
+       # Krylov method ('gmres' or 'bicgstab') and relative tolerance for SolveKrylov
+       KrylovMethod = 'gmres'
+       KrylovTol = 1.0E-8
+       # SolveKrylov preconditioner: 'fastdiag' (fast diagonalization), 'multigrid'
+       # (spectral p-multigrid V-cycle) or 'column' blocks ('column' does NOT converge on
+       # the static problems: the horizontal coupling is lumped, GMRES stalls near 1E-2)
+       # 'multigrid' takes fewer products than 'fastdiag' but more time (each V-cycle
+       # applies the fast diagonalization 4 times on the fine level): ClassicalScharIter
+       # 86 vs 180 products, 1.0 vs 0.6 s at 31x24 and 221 vs 501, 20 vs 10 s at 63x48
+       # A solve that misses KrylovTol raises cpc.ConvergenceError (no Newton step)
+       KrylovPC = 'fastdiag'
+       
+       # Newton-Krylov preconditioner factored once: initial 'newton' Jacobian,
+       # 'classical' linearization, 'column' blocks, 'fastdiag' or 'multigrid'
+       NewtonKrylovPC = 'newton'
+       
+       # Residual reduction rate above which chord Newton refactors the Jacobian
+       ChordRate = nks.CHORD_RATE
+       
        # Set the grid type
        HermCheb = thisTest.solType['HermChebGrid']
-       # Use the uniform grid fourier solution if not Hermite Functions
-       if not HermCheb:
-              FourCheb = True
-       else:
-              FourCheb = False
               
        # Set residual diffusion switch
        ResDiff = thisTest.solType['DynSGS']
@@ -313,36 +375,44 @@ def runModel(TestName):
        # Set direct solution method (MUTUALLY EXCLUSIVE)
        SolveFull = thisTest.solType['SolveFull']
        SolveSchur = thisTest.solType['SolveSchur']
+       # Preconditioned Krylov solution (replaces the direct methods)
+       SolveKrylov = thisTest.solType['SolveKrylov']
+       # Full nonlinear solution by inexact Newton-Krylov (replaces the linear solves)
+       NewtonKrylov = thisTest.solType['NewtonKrylov']
+       # Full nonlinear solution by chord Newton (one LU reused across iterations)
+       ChordNewton = thisTest.solType['ChordNewton']
+       if ChordNewton:
+              NewtonKrylov = False
+       if NewtonKrylov or ChordNewton:
+              SolveKrylov = False
+       # Classical linear solution mode by mode on the Fourier grid (flat terrain linearization,
+       # one linear step: repeated steps diverge since the modes are not the Newton Jacobian)
+       SolveFourier = thisTest.solType['SolveFourier']
+       if SolveFourier:
+              SolveKrylov = False
+              NewtonKrylov = False
+              ChordNewton = False
+              if HermCheb:
+                     print('ERROR: FOURIER MODE SOLUTION REQUIRES THE FOURIER GRID')
+                     sys.exit(2)
+       if SolveKrylov or NewtonKrylov or ChordNewton or SolveFourier:
+              SolveFull = False
+              SolveSchur = False
+       # The nonlinear solvers iterate internally (one outer step)
+       if NewtonKrylov or ChordNewton:
+              newtonIters = 1
        
        # Set Newton solve initial and restarting parameters
        toRestart = thisTest.solType['ToRestart'] # Saves resulting state to restart database
        isRestart = thisTest.solType['IsRestart'] # Initializes from a restart database
        makePlots = thisTest.solType['MakePlots'] # Switch for diagnostic plotting
        
-       # Various background options
-       smooth3Layer = thisTest.solType['Smooth3Layer']
-       uniformStrat = thisTest.solType['UnifStrat']
-       uniformWind = thisTest.solType['UnifWind']
-       linearShear = thisTest.solType['LinShear']
-       
        PHYS = thisTest.PHYS # Physical constants
-       varDex = thisTest.varDex # Indeces
        DIMS = thisTest.DIMS # Grid dimensions
-       JETOPS = thisTest.JETOPS # Shear jet options
        RLOPT = thisTest.RLOPT # Sponge layer options
        HOPT = thisTest.HOPT # Terrain profile options
        TOPT = thisTest.TOPT # Time integration options
        
-       if RLOPT[5] == 'uwpt_static':
-              bcType = 1
-              print('BC profile: ' + RLOPT[5])
-       elif RLOPT[5] == 'uwpt_transient':
-              bcType = 2
-              print('BC profile: ' + RLOPT[5])
-       else:
-              bcType = 1
-              print('DEFAULT BC profile: ' + RLOPT[5])
-       
        # Make the equation index vectors for all DOF
        numVar = 4
        NX = DIMS[3]
@@ -353,209 +423,31 @@ def runModel(TestName):
        pdex = np.add(wdex, OPS)
        tdex = np.add(pdex, OPS)
        
-       Z_in = thisTest.Z_in
-       T_in = thisTest.T_in
-       
-       #%% SET UP THE GRID AND INDEX VECTORS
-       #% Define the computational and physical grids+
-       verticalChebGrid = True
-       REFS = computeGrid(DIMS, HermCheb, FourCheb, verticalChebGrid)
-      
-       # Compute the raw derivative matrix operators in alpha-xi computational space
-       if HermCheb and not FourCheb:
-              DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
-       elif FourCheb and not HermCheb:
-              DDX_1D, HF_TRANS = derv.computeFourierDerivativeMatrix(DIMS)
+       #%% SET UP THE GRID, BACKGROUND STATE AND OPERATORS
+       if CacheOps:
+              opCache = OperatorCache(opcacheDir)
        else:
-              DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
-              
-       DDZ_1D, CH_TRANS = derv.computeChebyshevDerivativeMatrix(DIMS)
-         
-       # Turn on compact finite difference...
-       DDX_D4 = derv.computeCompactFiniteDiffDerivativeMatrix1(DIMS, REFS[0])
-       DDZ_D4 = derv.computeCompactFiniteDiffDerivativeMatrix1(DIMS, REFS[1])
-       # Turn on cubic spline derivatives...
-       DDX_CS, DDX2_CS = derv.computeCubicSplineDerivativeMatrix(DIMS, REFS[0], True)
-       DDZ_CS, DDX2_CS = derv.computeCubicSplineDerivativeMatrix(DIMS, REFS[1], True)
-       
-       # Update the REFS collection
-       REFS.append(DDX_1D)
-       REFS.append(DDZ_1D)
-       
-       #% Read in topography profile or compute from analytical function
-       HofX, dHdX = computeTopographyOnGrid(REFS, HOPT, DDX_1D)
-       
-       # Compute DX and DZ grid length scales
-       DX_min = 1.0 * np.min(np.abs(np.diff(REFS[0])))
-       DZ_min = 1.0 * np.min(np.abs(np.diff(REFS[1])))
-       print('Minimum grid lengths:',DX_min,DZ_min)
-       DX_avg = 1.0 * np.mean(np.abs(np.diff(REFS[0])))
-       DZ_avg = 1.0 * np.mean(np.abs(np.diff(REFS[1])))
-       print('Average grid lengths:',DX_avg,DZ_avg)
-       DX_max = 1.0 * np.max(np.abs(np.diff(REFS[0])))
-       DZ_max = 1.0 * np.max(np.abs(np.diff(REFS[1])))
-       print('Maximum grid lengths:',DX_max,DZ_max)
-       DX_wav = 1.0 * abs(DIMS[1] - DIMS[0]) / (NX+1)
-       DZ_wav = 1.0 * abs(DIMS[2]) / (NZ)
-       print('Wavelength grid lengths:',DX_wav,DZ_wav)
+              opCache = None
               
-       # Make the 2D physical domains from reference grids and topography
-       zRay = DIMS[2] - RLOPT[0]
-       # USE THE GUELLRICH TERRAIN DECAY
-       XL, ZTL, DZT, sigma, ZRL, DXM, DZM = \
-              coords.computeGuellrichDomain2D(DIMS, REFS, zRay, HofX, dHdX, StaticSolve)
-       # USE UNIFORM STRETCHING
-       #XL, ZTL, DZT, sigma, ZRL = coords.computeStretchedDomain2D(DIMS, REFS, zRay, HofX, dHdX)
-       
-       # Update the REFS collection
-       REFS.append(XL)
-       REFS.append(ZTL)
-       REFS.append(dHdX)
-       REFS.append(sigma)
+       SETUP = computeModelSetup(thisTest, DIMS, StaticSolve, opCache, \
+                                 TensorOps, ChebTransOps, RSBops, ApplyGML)
+       bcType, gridKey = SETUP['bcType'], SETUP['gridKey']
+       REFS, REFG, ROPS = SETUP['REFS'], SETUP['REFG'], SETUP['ROPS']
+       HF_TRANS, CH_TRANS = SETUP['HF_TRANS'], SETUP['CH_TRANS']
+       dHdX, XL, ZTL, DZT = SETUP['dHdX'], SETUP['XL'], SETUP['ZTL'], SETUP['DZT']
+       DX_avg, DZ_avg = SETUP['DX_avg'], SETUP['DZ_avg']
+       uldex, ubdex, wbdex = SETUP['uldex'], SETUP['ubdex'], SETUP['wbdex']
+       ubcDex, wbcDex, pbcDex, tbcDex = SETUP['ubcDex'], SETUP['wbcDex'], SETUP['pbcDex'], SETUP['tbcDex']
+       zeroDex, sysDex, ebcDex = SETUP['zeroDex'], SETUP['sysDex'], SETUP['ebcDex']
+       U, UZ, LOGP, LOGT = SETUP['U'], SETUP['UZ'], SETUP['LOGP'], SETUP['LOGT']
+       DDXMS, DDZMS = REFS[10], REFS[11]
+       del(SETUP)
        
-       #% Compute the BC index vector
-       uldex, urdex, ubdex, utdex, wbdex, \
-       ubcDex, wbcDex, pbcDex, tbcDex, \
-       zeroDex, sysDex, ebcDex = \
-              computeAdjust4CBC(DIMS, numVar, varDex, bcType)
-              
        # Index to interior of terrain boundary
        hdex = range(0,NX+1)
        # Index to the entire bottom boundary on U
        uBotDex = np.array(range(0, OPS, NZ))
        
-       #%% MAKE THE INITIAL/BACKGROUND STATE
-       # Map the sounding to the computational vertical 2D grid [0 H]
-       TZ, DTDZ, D2TDZ2 = \
-              computeTemperatureProfileOnGrid(PHYS, REFS, Z_in, T_in, smooth3Layer, uniformStrat)
-
-       # Compute background fields on the reference column
-       dlnPdz, LPZ, PZ, dlnPTdz, LPT, PT, RHO = \
-              computeThermoMassFields(PHYS, DIMS, REFS, TZ[:,0], DTDZ[:,0], 'sensible', uniformStrat)
-       
-       # Read in or compute background horizontal wind profile
-       U, dUdz = computeShearProfileOnGrid(REFS, JETOPS, PHYS[1], PZ, dlnPdz, uniformWind, linearShear)
-       
-       if verticalChebGrid:
-              interpolationType = '1DtoTerrainFollowingCheb'
-       else:
-              interpolationType = '1DtoTerrainFollowingCheb2Lin'
-       
-       #% Compute the background gradients in physical 2D space
-       dUdz = np.expand_dims(dUdz, axis=1)
-       DUDZ = np.tile(dUdz, NX+1)
-       DUDZ = computeColumnInterp(DIMS, REFS[1], dUdz, 0, ZTL, DUDZ, CH_TRANS, interpolationType)
-       # Compute thermodynamic gradients (no interpolation!)
-       PORZ = PHYS[3] * TZ
-       DLPDZ = -PHYS[0] / PHYS[3] * np.reciprocal(TZ)
-       DLTDZ = np.reciprocal(TZ) * DTDZ
-       DLPTDZ = DLTDZ - PHYS[4] * DLPDZ
-       # Compute 2nd derivatives
-       D2LPDZ2 = - DLTDZ * DLPDZ
-       D2LPTDZ2 = np.reciprocal(TZ) * D2TDZ2 - DLTDZ * DLPTDZ
-       
-       # Get the static vertical gradients and store
-       DUDZ = np.reshape(DUDZ, (OPS,1), order='F')
-       DLTDZ = np.reshape(DLTDZ, (OPS,1), order='F')
-       DLPDZ = np.reshape(DLPDZ, (OPS,1), order='F')
-       DLPTDZ = np.reshape(DLPTDZ, (OPS,1), order='F')
-       DQDZ = np.hstack((DUDZ, np.zeros((OPS,1)), DLPDZ, DLPTDZ))
-       
-       # Compute the background (initial) fields
-       U = np.expand_dims(U, axis=1)
-       UZ = np.tile(U, NX+1)
-       UZ = computeColumnInterp(DIMS, REFS[1], U, 0, ZTL, UZ, CH_TRANS, interpolationType)
-       LPZ = np.expand_dims(LPZ, axis=1)
-       LOGP = np.tile(LPZ, NX+1)
-       LOGP = computeColumnInterp(DIMS, REFS[1], LPZ, 0, ZTL, LOGP, CH_TRANS, interpolationType)
-       LPT = np.expand_dims(LPT, axis=1)
-       LOGT = np.tile(LPT, NX+1)
-       LOGT = computeColumnInterp(DIMS, REFS[1], LPT, 0, ZTL, LOGT, CH_TRANS, interpolationType)       
-       PBAR = np.exp(LOGP) # Hydrostatic pressure
-       
-       #%% RAYLEIGH AND GML WEIGHT OPERATORS
-       ROPS, RLM, GML, SBR = computeRayleighEquations(DIMS, REFS, ZRL, RLOPT, ubdex, utdex)
-       if ApplyGML:
-              GMLOP = sps.diags(np.reshape(GML[0], (OPS,), order='F'), offsets=0, format='csr')
-              GMLOX = sps.diags(np.reshape(GML[1], (OPS,), order='F'), offsets=0, format='csr')
-              GMLOZ = sps.diags(np.reshape(GML[2], (OPS,), order='F'), offsets=0, format='csr')
-       else:
-              GMLOP = sps.identity(OPS, format='csr')
-              GMLOX = sps.identity(OPS, format='csr')
-              GMLOZ = sps.identity(OPS, format='csr')
-       
-       SBROP = sps.diags(np.reshape(SBR, (OPS,), order='F'), offsets=0, format='csr')
-       # Make a collection for background field derivatives
-       REFG = [(GMLOP, GMLOX, GMLOZ), DLTDZ, DQDZ, RLOPT[4], RLM, SBROP]
-       
-       # Update the REFS collection
-       REFS.append(np.reshape(UZ, (OPS,), order='F'))
-       REFS.append((np.reshape(PORZ, (OPS,), order='F'), np.reshape(PBAR, (OPS,), order='F')))
-       
-       # Get some memory back here
-       del(PORZ)
-       del(DUDZ)
-       del(DLTDZ)
-       del(DLPDZ)
-       del(DLPTDZ)
-       del(GML)
-       
-       #%% DIFFERENTIATION OPERATORS
-       
-       # Quality control on derivative matrices
-       #DDX_1D[np.isclose(DDX_1D, 0.0, atol=1.0E-15)] = 0.0
-       #DDZ_1D[np.isclose(DDZ_1D, 0.0, atol=1.0E-15)] = 0.0
-       
-       DDXMS, DDZMS = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_1D, DDZ_1D)
-       # 4th order compact finite difference (Gamet, 1999)
-       DDXM_D4, DDZM_D4 = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_D4, DDZ_D4)
-       # Cubic Spline first derivative matrix
-       DDXM_CS, DDZM_CS = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_CS, DDZ_CS)
-       # Cubic Spline second derivative matrix
-       #DDXM2_CS, DDZM2_CS = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_CS, DDZ_CS)
-       #DDXZM2_CS = DDZM_CS.dot(DDXM_CS)
-       
-       #DDXMA = 0.5 * (DDXMS + DDXM_CS)
-       #DDZMA = 0.5 * (DDZMS + DDZM_CS)
-       '''
-       DDXM = sps.bmat([[DDXMS, None, None, None], \
-                     [None, DDXMS, None, None], \
-                     [None, None, DDXMS, None], \
-                     [None, None, None, DDXMS]], format='csr')
-              
-       DDZM = sps.bmat([[DDZMS, None, None, None], \
-                     [None, DDZMS, None, None], \
-                     [None, None, DDZMS, None], \
-                     [None, None, None, DDZMS]], format='csr')
-       '''
-       REFS.append(DDXMS) # index 10
-       REFS.append(DDZMS) # index 11
-       
-       if not StaticSolve and RSBops:
-              from rsb import rsb_matrix
-              # Multithreaded enabled for transient solution
-              REFS.append((rsb_matrix(DDXMS), rsb_matrix(DDZMS)))
-              REFS.append((rsb_matrix(DDXM_CS), rsb_matrix(DDZM_CS)))
-       elif not StaticSolve and not RSBops:
-              # Native sparsr
-              REFS.append((DDXMS, DDZMS))
-              REFS.append((DDXM_CS, DDZM_CS))
-       else: 
-              # Matrix operators for Jacobian assembly
-              REFS.append(DDXM_CS)
-              REFS.append(DDZM_CS)
-              
-       # Store the terrain profile
-       REFS.append(DZT)
-       DZDX = np.reshape(DZT, (OPS,1), order='F')
-       REFS.append(DZDX)
-       
-       # Compute and store the 2nd derivatives of background quantities
-       D2QDZ2 = DDZM_CS.dot(DQDZ)
-       D2QDZ2[:,2] = np.reshape(D2LPDZ2, (OPS,), order='F')
-       D2QDZ2[:,3] = np.reshape(D2LPTDZ2, (OPS,), order='F')
-       REFG.append(D2QDZ2)
-       
        if not StaticSolve:
               # Time stepping grid lengths
               '''
@@ -567,9 +459,16 @@ def runModel(TestName):
               '''
               #'''
               print('Computing spectral radii of derivative operators...')
-              PPXMS = DDXMS - sps.diags(np.reshape(DZT, (OPS,), order='F'), offsets=0, format='csr') * DDZMS
-              DX_spr = 1.0 / np.abs(spl.eigs(PPXMS[np.ix_(ubdex,ubdex)], k=1, which='LM', return_eigenvectors=False))
-              DZ_spr = 1.0 / np.abs(spl.eigs(DDZMS[np.ix_(uldex[1:],uldex[1:])], k=1, which='LM', return_eigenvectors=False))
+              if TensorOps:
+                     DZT_bot = np.expand_dims(DZT[0,:], axis=1)
+                     PPXMS = DDXMS.submatrix(ubdex,ubdex) - DZT_bot * DDZMS.submatrix(ubdex,ubdex)
+                     DDZMS_lft = DDZMS.submatrix(uldex[1:],uldex[1:])
+              else:
+                     PPXMS = DDXMS - sps.diags(np.reshape(DZT, (OPS,), order='F'), offsets=0, format='csr') * DDZMS
+                     PPXMS = PPXMS[np.ix_(ubdex,ubdex)]
+                     DDZMS_lft = DDZMS[np.ix_(uldex[1:],uldex[1:])]
+              DX_spr = 1.0 / np.abs(spl.eigs(PPXMS, k=1, which='LM', return_eigenvectors=False))
+              DZ_spr = 1.0 / np.abs(spl.eigs(DDZMS_lft, k=1, which='LM', return_eigenvectors=False))
               print('Spectral radii of 1st derivative matrices: ', DX_spr, DZ_spr)
               DX = 1.0 * DX_spr[0]
               DZ = 1.0 * DZ_spr[0]
@@ -583,10 +482,8 @@ def runModel(TestName):
               DLS = min(DX, DZ)
               #'''
               
-       del(DDXMS); del(DDXM_D4); del(DDXM_CS)
-       del(DDZMS); del(DDZM_D4); del(DDZM_CS)
-       del(DZDX)
-       del(GMLOP)
+       del(DDXMS)
+       del(DDZMS)
        
        #%% SOLUTION INITIALIZATION
        physDOF = numVar * OPS
@@ -613,7 +510,11 @@ def runModel(TestName):
        
        if isRestart:
               print('Restarting from previous solution...')
-              SOLT, LMS, DCF, NX_in, NZ_in, IT = getFromRestart(restart_file, TOPT, NX, NZ, StaticSolve)
+              GRID = {'DIMS' : DIMS, 'REFS' : REFS, 'HF_TRANS' : HF_TRANS, 'CH_TRANS' : CH_TRANS, \
+                      'HermCheb' : HermCheb, 'sysDex' : sysDex}
+              SOLT, LMS, DCF, NX_in, NZ_in, IT = getFromRestart(restart_file, TOPT, NX, NZ, StaticSolve, \
+                                                                GRID, opCache if CacheOps else None)
+              del(GRID)
               
               # Updates nolinear boundary condition to next Newton iteration
               dWBC = SOLT[wbdex,0] - dHdX[hdex] * (INIT[ubdex] + SOLT[ubdex,0])  
@@ -629,291 +530,251 @@ def runModel(TestName):
        fields, U, W = \
               eqs.computePrepareFields(REFS, currentState, INIT, udex, wdex, pdex, tdex)
               
-       #% Compute the global LHS operator and RHS
+       #%% Solve the system - Static or Transient Solution
+       start = time.time()
        if StaticSolve:
-              if NewtonLin:
-                     # Full Newton linearization with TF terms
-                     DOPS_NL = eqs.computeJacobianMatrixLogPLogT(PHYS, REFS, REFG, \
-                                   np.array(fields), U, ubdex, utdex)
-              else:
-                     # Classic linearization without TF terms
-                     DOPS_NL = eqs.computeEulerEquationsLogPLogT_Classical(DIMS, PHYS, REFS, REFG)
-
-              print('Compute Jacobian operator blocks: DONE!')
-              
-              # Convert blocks to 'lil' format for efficient indexing
-              DOPS = []
-              for dd in range(len(DOPS_NL)):
-                     if (DOPS_NL[dd]) is not None:
-                            DOPS.append(DOPS_NL[dd].tolil())
-                     else:
-                            DOPS.append(DOPS_NL[dd])
-              del(DOPS_NL)
-              
-              #'''
-              # Compute the RHS for this iteration
-              DqDx, DqDz = \
-                     eqs.computeFieldDerivatives(fields, REFS[10], REFS[11])
-              rhs = eqs.computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, \
-                                                         REFS[15], REFS[9][0], fields, U, W, ebcDex, zeroDex)
-              rhs += eqs.computeRayleighTendency(REFG, fields, zeroDex)
+              print('Starting Linear to Nonlinear Static Solver...')
               
-              RHS = np.reshape(rhs, (physDOF,), order='F')
-              err = displayResiduals('Current function evaluation residual: ', RHS, 0.0, udex, wdex, pdex, tdex)
-              del(U); del(fields); del(rhs)
+              # Global BC reduced operator assembly (pattern set up once and reused)
+              if CacheOps:
+                     jacKey = opCache.makeKey('jacobian', gridKey, HOPT, RLOPT[0], bcType)
+                     JAC = jasm.getJacobianAssembler(REFS[10], REFS[11], sysDex, ubdex, jacKey, opCache)
+              else:
+                     JAC = jasm.getJacobianAssembler(REFS[10], REFS[11], sysDex, ubdex)
               
-              #%% Compute Lagrange Multiplier column augmentation matrices (terrain equation)
-              C1 = -1.0 * sps.diags(dHdX[hdex], offsets=0, format='csr')
-              C2 = +1.0 * sps.eye(len(ubdex), format='csr')
-       
-              colShape = (OPS,len(ubdex))
-              LD = sps.lil_matrix(colShape)
+              # Lagrange Multiplier coefficients (terrain equation)
               if ExactBC:
-                     LD[ubdex,:] = C1
-              LH = sps.lil_matrix(colShape)
-              LH[ubdex,:] = C2
-              LM = sps.lil_matrix(colShape)
-              LQ = sps.lil_matrix(colShape)
-              
-              #%% Apply BC adjustments and indexing block-wise (Lagrange blocks)
-              LDA = LD[ubcDex,:]
-              LHA = LH[wbcDex,:]
-              LMA = LM[pbcDex,:]
-              LQAC = LQ[tbcDex,:]
-              
-              # Apply transpose for row augmentation (Lagrange blocks)
-              LNA = LDA.T
-              LOA = LHA.T
-              LPA = LMA.T
-              LQAR = LQAC.T
-              LDIA = sps.lil_matrix((lmsDOF,lmsDOF))
-              
-              # Apply BC adjustments and indexing block-wise (LHS operator)
-              A = DOPS[0][np.ix_(ubcDex,ubcDex)]              
-              B = DOPS[1][np.ix_(ubcDex,wbcDex)]
-              C = DOPS[2][np.ix_(ubcDex,pbcDex)]
-              D = DOPS[3][np.ix_(ubcDex,tbcDex)]
-              
-              E = DOPS[4][np.ix_(wbcDex,ubcDex)]
-              F = DOPS[5][np.ix_(wbcDex,wbcDex)] 
-              G = DOPS[6][np.ix_(wbcDex,pbcDex)]
-              H = DOPS[7][np.ix_(wbcDex,tbcDex)]
+                     LCU = -1.0 * dHdX[hdex]
+              else:
+                     LCU = np.zeros(lmsDOF)
               
-              I = DOPS[8][np.ix_(pbcDex,ubcDex)]
-              J = DOPS[9][np.ix_(pbcDex,wbcDex)]
-              K = DOPS[10][np.ix_(pbcDex,pbcDex)]
-              M = DOPS[11] # Block of None
+              # Newton convergence is relative to the residual of the background state (the
+              # cold start) so restarts (also from another resolution) have the same target
+              fields0, U0, W0 = \
+                     eqs.computePrepareFields(REFS, np.zeros(physDOF), INIT, udex, wdex, pdex, tdex)
+              RHS0 = eqs.computeStaticResidualLogPLogT(PHYS, REFS, REFG, fields0, U0, W0, ebcDex, zeroDex)
+              err0 = np.sqrt(np.linalg.norm(RHS0)**2 + np.linalg.norm(dHdX[hdex] * INIT[ubdex])**2)
+              del(fields0); del(U0); del(W0); del(RHS0)
               
-              N = DOPS[12][np.ix_(tbcDex,ubcDex)]
-              O = DOPS[13][np.ix_(tbcDex,wbcDex)]
-              P = DOPS[14] # Block of None
-              Q = DOPS[15][np.ix_(tbcDex,tbcDex)]
+              # Fast diagonalization preconditioner (background only, same for all iterations)
+              if (SolveKrylov and KrylovPC == 'fastdiag') or (NewtonKrylov and NewtonKrylovPC == 'fastdiag'):
+                     if CacheOps:
+                            eigKey = opCache.makeKey('eigen1D', gridKey)
+                            EIGX = fdg.computeEigenDecomposition1D(REFS[2], eigKey, opCache)
+                     else:
+                            EIGX = fdg.computeEigenDecomposition1D(REFS[2])
+                     # Column mean damping stands in for the lateral layers
+                     COEFS = fms.computeFourierModeCoefficients(DIMS, REFS, REFG, ROPS, layerMean=True)
+                     PCFD = fdg.FastDiagPreconditioner(EIGX, COEFS, REFS[3], PHYS, sysDex, ubdex, OPS)
+                     del(EIGX); del(COEFS)
+                     print('Fast diagonalization preconditioner... DONE!')
               
-              # The Rayleigh operators are block diagonal
-              R1 = (ROPS[0].tolil())[np.ix_(ubcDex,ubcDex)]
-              R2 = (ROPS[1].tolil())[np.ix_(wbcDex,wbcDex)]
-              R3 = (ROPS[2].tolil())[np.ix_(pbcDex,pbcDex)]
-              R4 = (ROPS[3].tolil())[np.ix_(tbcDex,tbcDex)]
-               
-              del(DOPS)
+              # Fine level of the spectral multigrid preconditioner
+              if (SolveKrylov and KrylovPC == 'multigrid') or (NewtonKrylov and NewtonKrylovPC == 'multigrid'):
+                     LEVMG = {'DIMS' : DIMS, 'PHYS' : PHYS, 'REFS' : REFS, 'REFG' : REFG, 'ROPS' : ROPS, \
+                              'HF_TRANS' : HF_TRANS, 'CH_TRANS' : CH_TRANS, 'sysDex' : sysDex, 'ubdex' : ubdex}
               
-              # Set up Schur blocks or full operator...
-              if (StaticSolve and SolveSchur):
-                     # Add Rayleigh damping terms
-                     A += R1
-                     F += R2
-                     K += R3
-                     Q += R4
-                     
-                     # Store the operators...
-                     opdb = shelve.open(schurName, flag='n')
-                     opdb['A'] = A; opdb['B'] = B; opdb['C'] = C; opdb['D'] = D
-                     opdb['E'] = E; opdb['F'] = F; opdb['G'] = G; opdb['H'] = H
-                     opdb['I'] = I; opdb['J'] = J; opdb['K'] = K; opdb['M'] = M
-                     opdb['N'] = N; opdb['O'] = O; opdb['P'] = P; opdb['Q'] = Q
-                     opdb['LDA'] = LDA; opdb['LHA'] = LHA; opdb['LMA'] = LMA; opdb['LQAC'] = LQAC
-                     opdb['LNA'] = LNA; opdb['LOA'] = LOA; opdb['LPA'] = LPA; opdb['LQAR'] = LQAR
-                     opdb['LDIA'] = LDIA
-                     opdb.close()
-                      
-                     # Compute the partitions for Schur Complement solution
-                     fu = RHS[udex]
-                     fw = RHS[wdex]
-                     f1 = np.concatenate((-dWBC, fu[ubcDex], fw[wbcDex]))
-                     fp = RHS[pdex]
-                     ft = RHS[tdex]
-                     f2 = np.concatenate((fp[pbcDex], ft[tbcDex]))
+              # Newton iterations in process (grids, operators and the assembly pattern
+              # are set up once, restart data is only written at checkpoints and the end)
+              for nn in range(newtonIters):
+                     itStart = time.time()
+                     #% Compute the global LHS operator and RHS
+                     if SolveFourier:
+                            # Column systems are built per Fourier mode
+                            GOP = None
+                     elif NewtonLin:
+                            # Full Newton linearization with TF terms (matrix free and pointwise coefficients)
+                            JOP = eqs.JacobianOperatorLogPLogT(PHYS, REFS, REFG, ROPS, np.array(fields), U, \
+                                                               sysDex, ubdex, dHdX[hdex], ExactBC)
+                            print('Compute Jacobian operator blocks: DONE!')
                      
-              if (StaticSolve and SolveFull):
-                     # Add Rayleigh damping terms
-                     A += R1
-                     F += R2
-                     K += R3
-                     Q += R4
+                            # Refresh the global operator data on the fixed pattern
+                            GOP = JAC.assembleNewton(JOP.JCF, JOP.RDG, PHYS[6], LCU)
+                     else:
+                            # Classic linearization without TF terms
+                            DOPS_NL = eqs.computeEulerEquationsLogPLogT_Classical(DIMS, PHYS, REFS, REFG)
+                            print('Compute Jacobian operator blocks: DONE!')
                      
-                     # Compute the global linear operator
-                     AN = sps.bmat([[A, B, C, D, LDA], \
-                              [E, F, G, H, LHA], \
-                              [I, J, K, M, LMA], \
-                              [N, O, P, Q, LQAC], \
-                              [LNA, LOA, LPA, LQAR, LDIA]], format='csc')
-              
-                     # Compute the global linear force vector
-                     bN = np.concatenate((RHS[sysDex], -dWBC))
+                            GOP = JAC.assembleBlocks(DOPS_NL, ROPS, LCU)
+                            del(DOPS_NL)
               
-              # Get memory back
-              del(A); del(B); del(C); del(D)
-              del(E); del(F); del(G); del(H)
-              del(I); del(J); del(K); del(M)
-              del(N); del(O); del(P); del(Q)
-              print('Set up global linear operators: DONE!')
-       
-       #%% Solve the system - Static or Transient Solution
-       start = time.time()
-       if StaticSolve:
-              print('Starting Linear to Nonlinear Static Solver...')
+                     #'''
+                     # Compute the RHS for this iteration
+                     RHS = eqs.computeStaticResidualLogPLogT(PHYS, REFS, REFG, fields, U, W, ebcDex, zeroDex)
+                     err = displayResiduals('Current function evaluation residual: ', RHS, 0.0, udex, wdex, pdex, tdex)
+                     del(U); del(fields)
               
-              if SolveFull and not SolveSchur:
-                     print('Solving linear system by full operator SuperLU...')
-                     # Direct solution over the entire operator (better for testing BC's)
-                     opts = dict(Equil=True, IterRefine='DOUBLE')
-                     factor = spl.splu(AN, permc_spec='MMD_ATA', options=opts)
-                     del(AN)
-                     dsol = factor.solve(bN)
-                     del(bN)
-                     del(factor)
-              if SolveSchur and not SolveFull:
-                     print('Solving linear system by Schur Complement...')
-                     # Factor DS and compute the Schur Complement of DS
-                     DS = computeSchurBlock(schurName,'DS')
-                     factorDS = dsl.lu_factor(DS, overwrite_a=True, check_finite=False)
-                     del(DS)
-                     print('Factor D... DONE!')
-                     
-                     # Store factor_DS for a little bit...
-                     FDS = shelve.open(localDir + 'factorDS', flag='n', protocol=4)
-                     FDS['factorDS'] = factorDS
-                     FDS.close()
-                     print('Store LU factor of D... DONE!')
+                     # Set up Schur blocks or full operator...
+                     if (StaticSolve and SolveSchur):
+                            # Partition [LMS, u, w] and [ln_p, ln_theta] by contiguous slices
+                            nA = JAC.getSchurSplit()
                      
-                     # Compute f2_hat = DS^-1 * f2 and f1_hat
-                     BS = computeSchurBlock(schurName,'BS')
-                     f2_hat = dsl.lu_solve(factorDS, f2)
-                     f1_hat = f1 - BS.dot(f2_hat)
-                     del(f1)
-                     del(BS) 
-                     del(f2_hat)
-                     print('Compute modified force vectors... DONE!')
+                            # Store the operators...
+                            opdb = shelve.open(schurName, flag='n')
+                            opdb['AS'] = GOP[0:nA,0:nA]; opdb['BS'] = GOP[0:nA,nA:]
+                            opdb['CS'] = GOP[nA:,0:nA]; opdb['DS'] = GOP[nA:,nA:]
+                            opdb.close()
+                      
+                            # Compute the partitions for Schur Complement solution
+                            fu = RHS[udex]
+                            fw = RHS[wdex]
+                            f1 = np.concatenate((-dWBC, fu[ubcDex], fw[wbcDex]))
+                            fp = RHS[pdex]
+                            ft = RHS[tdex]
+                            f2 = np.concatenate((fp[pbcDex], ft[tbcDex]))
                      
-                     # Get CS block and store in column chunks
-                     CS = computeSchurBlock(schurName, 'CS')
-                     fileCS = localDir + 'CS'
-                     NCPU, CS_cranges = storeColumnChunks(CS, 'CS', fileCS)
-                     print('Partition block C into chunks and store... DONE!')
-                     del(CS)
+                     if (StaticSolve and SolveFull):
+                            # Compute the global linear operator
+                            AN = GOP.tocsc()
+              
+                            # Compute the global linear force vector (same ordering as the Schur solution)
+                            bN = np.concatenate((-dWBC, RHS[sysDex]))
                      
-                     # Get AS block and store in column chunks
-                     AS = computeSchurBlock(schurName, 'AS')
-                     fileAS = localDir + 'AS'
-                     NCPU, AS_cranges = storeColumnChunks(AS, 'AS', fileAS)
-                     print('Partition block A into chunks and store... DONE!')
-                     del(AS)
+                     if (StaticSolve and SolveKrylov):
+                            # Global operator for products and the column block preconditioner
+                            AN = GOP.tocsr()
+                            bN = np.concatenate((-dWBC, RHS[sysDex]))
                      
-                     # Loop over the chunks from disk
-                     #AS = computeSchurBlock(schurName, 'AS')
-                     BS = computeSchurBlock(schurName, 'BS')
-                     ASmdb = shelve.open(fileAS)
-                     CSmdb = shelve.open(fileCS, flag='r')
-                     print('Computing DS^-1 * CS in chunks: ', NCPU)
-                     for cc in range(NCPU):
-                            # Get CS chunk
-                            #CS_crange = CS_cranges[cc] 
-                            CS_chunk = CSmdb['CS' + str(cc)]
-                            
-                            DS_chunk = dsl.lu_solve(factorDS, CS_chunk, overwrite_b=True, check_finite=False) # LONG EXECUTION
-                            del(CS_chunk)
-                            
-                            # Get AS chunk
-                            #AS_crange = AS_cranges[cc] 
-                            AS_chunk = ASmdb['AS' + str(cc)]
-                            #AS[:,crange] -= BS.dot(DS_chunk) # LONG EXECUTION
-                            ASmdb['AS' + str(cc)] = AS_chunk - BS.dot(DS_chunk)
-                            del(AS_chunk)
-                            del(DS_chunk)
-                            print('Computed chunk: ', cc+1)
-                            
-                     CSmdb.close()
-                     del(BS)
-                     del(factorDS)
+                     if (StaticSolve and NewtonKrylov):
+                            # Fixed preconditioner for all the Newton iterations
+                            if NewtonKrylovPC == 'classical':
+                                   DOPS_CL = eqs.computeEulerEquationsLogPLogT_Classical(DIMS, PHYS, REFS, REFG)
+                                   PCOP = nks.computeFactoredPreconditioner(JAC.assembleBlocks(DOPS_CL, ROPS, LCU))
+                                   del(DOPS_CL)
+                            elif NewtonKrylovPC == 'newton':
+                                   PCOP = nks.computeFactoredPreconditioner(GOP)
+                            elif NewtonKrylovPC == 'fastdiag':
+                                   PCOP = PCFD
+                            elif NewtonKrylovPC == 'multigrid':
+                                   PCOP = smg.SpectralMultigridPreconditioner(thisTest, LEVMG, GOP, np.array(SOLT[:,0]), \
+                                                                              opCache if CacheOps else None)
+                            else:
+                                   PCOP = cpc.ColumnBlockPreconditioner(GOP, cpc.computeColumnIndex(sysDex, ubdex, OPS, NZ))
+              
+                     # Get memory back
+                     del(GOP)
+                     print('Set up global linear operators: DONE!')
                      
-                     # Reassemble Schur complement of DS from AS chunk storage
-                     print('Computing Schur Complement of D from chunks.')
-                     DS_SC = ASmdb['AS0']
-                     for cc in range(1,NCPU):
-                            DS_SC = np.hstack((DS_SC, ASmdb['AS' + str(cc)]))
-                     ASmdb.close()
-                     print('Solve DS^-1 * CS... DONE!')
-                     print('Compute Schur Complement of D... DONE!')
-                     #'''
-                     # Apply Schur C. solver on block partitioned DS_SC
-                     factorDS_SC = dsl.lu_factor(DS_SC, overwrite_a=True)
-                     del(DS_SC)
-                     print('Factor Schur Complement of D... DONE!')
-                     #'''
-                     sol1 = dsl.lu_solve(factorDS_SC, f1_hat, overwrite_b=True, check_finite=False)
-                     del(factorDS_SC)
-                     #sol1, icode = spl.bicgstab(AS, f1_hat)
-                     del(f1_hat)
-                     print('Solve for u and w... DONE!')
+                     if SolveFull and not SolveSchur:
+                            print('Solving linear system by full operator SuperLU...')
+                            # Direct solution over the entire operator (better for testing BC's)
+                            if StaticLowPrec is not None:
+                                   # Single precision factors refined with the float64 operator
+                                   lowSolve = mpr.computeLowPrecisionFactor(AN)
+                                   dsol = mpr.solveRefined(AN, bN, lowSolve, method=StaticLowPrec)
+                                   del(lowSolve)
+                            else:
+                                   opts = dict(Equil=True, IterRefine='DOUBLE')
+                                   factor = spl.splu(AN, permc_spec='MMD_ATA', options=opts)
+                                   dsol = factor.solve(bN)
+                                   del(factor)
+                            del(AN)
+                            del(bN)
+                     if SolveSchur and not SolveFull:
+                            print('Solving linear system by Schur Complement...')
+                            # Out of core and parallel Schur complement of DS (resumable)
+                            AS = computeSchurBlock(schurName, 'AS')
+                            BS = computeSchurBlock(schurName, 'BS')
+                            CS = computeSchurBlock(schurName, 'CS')
+                            DS = computeSchurBlock(schurName, 'DS')
+                            # Vertical level of each unknown (HODLR blocks keep levels whole)
+                            levelDex = np.concatenate((ubdex, np.asarray(sysDex) % OPS)) % NZ
+                            dsol = schur.solveSchurComplement(AS, BS, CS, DS, f1, f2, schurDir, \
+                                                              hodlrTol=SchurTolHODLR, hodlrGroups=levelDex, \
+                                                              lowPrec=StaticLowPrec)
                      
-                     CS = computeSchurBlock(schurName, 'CS')
-                     f2_hat = f2 - CS.dot(sol1)
-                     del(f2)
-                     del(CS)
-                     FDS = shelve.open(localDir + 'factorDS', flag='r', protocol=4)
-                     factorDS = FDS['factorDS']
-                     FDS.close()
-                     sol2 = dsl.lu_solve(factorDS, f2_hat, overwrite_b=True, check_finite=False)
-                     del(f2_hat)
-                     del(factorDS)
-                     print('Solve for ln(p) and ln(theta)... DONE!')
-                     dsol = np.concatenate((sol1, sol2))
+                            # Get memory back
+                            del(AS); del(BS); del(CS); del(DS)
+                            del(f1); del(f2)
                      
-                     # Get memory back
-                     del(sol1); del(sol2)
+                            if NewtonLin:
+                                   # Check the linear solution with the matrix free Jacobian
+                                   fN = np.concatenate((-dWBC, RHS[sysDex]))
+                                   linRes = np.linalg.norm(JOP.matvec(dsol) - fN) / np.linalg.norm(fN)
+                                   print('Relative residual of the linear solution: %10.4E' % linRes)
+                                   del(fN)
+                     if SolveKrylov:
+                            if KrylovPC == 'fastdiag':
+                                   print('Solving linear system by Krylov with fast diagonalization preconditioner...')
+                                   PCOL = PCFD
+                            elif KrylovPC == 'multigrid':
+                                   print('Solving linear system by Krylov with spectral multigrid preconditioner...')
+                                   # Coarse levels linearized as the fine operator
+                                   PCOL = smg.SpectralMultigridPreconditioner(thisTest, LEVMG, AN, \
+                                                                              np.array(SOLT[:,0]) if NewtonLin else None, \
+                                                                              opCache if CacheOps else None)
+                            else:
+                                   print('Solving linear system by Krylov with column block preconditioner...')
+                                   # Batched inverses of the vertical column blocks (memory linear in NX)
+                                   colDex = cpc.computeColumnIndex(sysDex, ubdex, OPS, NZ)
+                                   PCOL = cpc.ColumnBlockPreconditioner(AN, colDex)
+                                   print('Factor column blocks... DONE!')
                      
-              #%% Update the interior and boundary solution
-              # Store the Lagrange Multipliers
-              LMS += dsol[0:lmsDOF]
-              dsolQ = dsol[lmsDOF:]
+                            dsol = cpc.solveKrylov(AN, bN, M=PCOL, method=KrylovMethod, tol=KrylovTol)
+                            del(AN); del(bN); del(PCOL)
+                     if NewtonKrylov:
+                            print('Solving nonlinear system by Newton-Krylov...')
+                            NLR = nks.StaticResidualLogPLogT(PHYS, REFS, REFG, ROPS, INIT, dHdX[hdex], \
+                                                             udex, wdex, pdex, tdex, ubdex, wbdex, sysDex, \
+                                                             ebcDex, zeroDex, ExactBC)
+                            dsol = nks.computeIterativeSolveNL(NLR, SOLT, LMS, PCOP, tol=KrylovTol)
+                            del(PCOP); del(NLR)
+                     if ChordNewton:
+                            print('Solving nonlinear system by chord Newton...')
+                            NLR = nks.StaticResidualLogPLogT(PHYS, REFS, REFG, ROPS, INIT, dHdX[hdex], \
+                                                             udex, wdex, pdex, tdex, ubdex, wbdex, sysDex, \
+                                                             ebcDex, zeroDex, ExactBC)
+                            dsol = nks.computeChordSolveNL(NLR, SOLT, LMS, JAC, LCU, tol=KrylovTol, rateMax=ChordRate)
+                            del(NLR)
+                     if SolveFourier:
+                            print('Solving linear system by Fourier modes...')
+                            # Terrain forcing through the lower boundary condition on w
+                            DQ = fms.computeFourierModeSolve(DIMS, PHYS, REFS, REFG, ROPS, RHS, -dWBC)
+                            dsol = np.concatenate((np.zeros(lmsDOF), DQ[sysDex]))
+                            del(DQ)
+                            
+                     #%% Update the interior and boundary solution
+                     # Store the Lagrange Multipliers
+                     LMS += dsol[0:lmsDOF]
+                     dsolQ = dsol[lmsDOF:]
               
-              SOLT[sysDex,0] += dsolQ
+                     SOLT[sysDex,0] += dsolQ
 
-              # Store solution change to instance 1
-              SOLT[sysDex,1] = dsolQ
+                     # Store solution change to instance 1
+                     SOLT[sysDex,1] = dsolQ
               
-              print('Recover full linear solution vector... DONE!')
+                     print('Recover full linear solution vector... DONE!')
               
-              # Prepare the fields
-              fields, U, W = \
-                     eqs.computePrepareFields(REFS, np.array(SOLT[:,0]), INIT, udex, wdex, pdex, tdex)
+                     # Prepare the fields
+                     fields, U, W = \
+                            eqs.computePrepareFields(REFS, np.array(SOLT[:,0]), INIT, udex, wdex, pdex, tdex)
               
-              #%% Set the output residual and check
-              message = 'Residual 2-norm BEFORE Newton step:'
-              err = displayResiduals(message, RHS, 0.0, udex, wdex, pdex, tdex)
-              DqDx, DqDz = \
-                     eqs.computeFieldDerivatives(fields, REFS[10], REFS[11])
-              rhs = eqs.computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, \
-                                                         REFS[15], REFS[9][0], fields, U, W, ebcDex, zeroDex)
-              rhs += eqs.computeRayleighTendency(REFG, fields, zeroDex)
-              RHS = np.reshape(rhs, (physDOF,), order='F')
-              message = 'Residual 2-norm AFTER Newton step:'
-              err = displayResiduals(message, RHS, 0.0, udex, wdex, pdex, tdex)
-              del(rhs)
+                     #%% Set the output residual and check
+                     message = 'Residual 2-norm BEFORE Newton step:'
+                     err = displayResiduals(message, RHS, 0.0, udex, wdex, pdex, tdex)
+                     RHS = eqs.computeStaticResidualLogPLogT(PHYS, REFS, REFG, fields, U, W, ebcDex, zeroDex)
+                     message = 'Residual 2-norm AFTER Newton step:'
+                     err = displayResiduals(message, RHS, 0.0, udex, wdex, pdex, tdex)
               
-              # Check the change in the solution
-              DSOL = np.array(SOLT[:,1])
-              print('Norm of change in solution: ', np.linalg.norm(DSOL))
+                     # Check the change in the solution
+                     DSOL = np.array(SOLT[:,1])
+                     print('Norm of change in solution: ', np.linalg.norm(DSOL))
+                     
+                     # Updates nonlinear boundary condition to the next Newton iteration
+                     dWBC = SOLT[wbdex,0] - dHdX[hdex] * (INIT[ubdex] + SOLT[ubdex,0])
+                     
+                     # Nonlinear convergence (equations and terrain constraint) relative to the start
+                     errNL = np.sqrt(err**2 + np.linalg.norm(dWBC)**2)
+                     newtonRes = errNL / err0
+                     print('Newton iteration: %d, relative residual: %10.4E, time: %.2f s' % \
+                           (nn+1, newtonRes, time.time() - itStart))
+                     if newtonRes <= newtonTol or nn+1 == newtonIters:
+                            break
+                     
+                     # Checkpoint the state (no operators) for restarts
+                     if toRestart and newtonCheckpoint > 0 and (nn+1) % newtonCheckpoint == 0:
+                            storeRestart(restart_file, SOLT, LMS, DCF, DSOL, NX, NZ, TOPT[4], PHYS, DIMS)
+                            print('Restart checkpoint at Newton iteration: %d' % (nn+1))
        #%% Transient solutions       
        elif NonLinSolve:
               print('Starting Nonlinear Transient Solver...')
@@ -921,8 +782,17 @@ def runModel(TestName):
               # Reshape main solution vectors and initialize
               hydroState = np.reshape(INIT, (OPS, numVar), order='F')
               
+              # Set the working precision of the transient state and operators
+              if SinglePrec:
+                     print('Transient solver in single precision.')
+                     fdtype = np.float32
+                     REFS, REFG = castTransientData(REFS, REFG, fdtype)
+              else:
+                     fdtype = np.float64
+              fields = fields.astype(fdtype)
+              
               # Initialize damping coefficients
-              DCF = (np.zeros((OPS,1)), np.zeros((OPS,1)))
+              DCF = (np.zeros((OPS,1), dtype=fdtype), np.zeros((OPS,1), dtype=fdtype))
               
               # Initialize vertical velocity
               fields[ubdex,1] = -dWBC
@@ -955,6 +825,8 @@ def runModel(TestName):
               
               # Rename output file to the current time for subsequent storage
               fname = 'transientNL' + str(int(thisTime)) + '.nc'
+              if SinglePrec:
+                     fname = fname.replace('.nc', '_f32.nc')
               try:
                      m_fid = Dataset(fname, 'w', format="NETCDF4")
               except PermissionError:
@@ -1020,7 +892,7 @@ def runModel(TestName):
                             rhsVec = eqs.computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, REFS[15], REFS[9][0], \
                                                                           fields, UD, WD, ebcDex, zeroDex)
                             rhsVec += eqs.computeRayleighTendency(REFG, fields, zeroDex)
-                            error = [np.linalg.norm(rhsVec)]
+                            error = [np.linalg.norm(rhsVec.astype(np.float64))]
                             
                             prevFields = np.array(fields)
                             prevRhsVec = np.array(rhsVec)
@@ -1091,9 +963,10 @@ def runModel(TestName):
                             # Compute DynSGS or Flow Dependent diffusion coefficients
                             QM = bn.nanmax(np.abs(fields - bn.nanmean(fields)), axis=0)
                             DCF = rescf.computeResidualViscCoeffs(resVec, QM, VFLW, DX, DZ, DXD, DZD, DX2, DZ2)
+                            DCF = tuple([dcf.astype(fdtype, copy=False) for dcf in DCF])
                             
                             # Compute sound speed
-                            T_ratio = np.expm1(PHYS[4] * fields[:,2] + fields[:,3])
+                            T_ratio = np.expm1(PHYS[4] * fields[:,2].astype(np.float64) + fields[:,3])
                             RdT = REFS[9][0] * (1.0 + T_ratio)
                             VSND = np.sqrt(PHYS[6] * RdT)
                             
@@ -1129,21 +1002,12 @@ def runModel(TestName):
        print('Solve the system: DONE!')
        print('Elapsed time: ', endt - start)
        
-       #% Make a database for restart
+       #% Make a database for restart (operators only with the final static state)
        if toRestart:
-              rdb = shelve.open(restart_file, flag='n')
-              rdb['DSOL'] = DSOL
-              rdb['SOLT'] = SOLT
-              rdb['LMS'] = LMS
-              rdb['DCF'] = DCF
-              rdb['NX'] = NX
-              rdb['NZ'] = NZ
-              rdb['ET'] = TOPT[4]
-              rdb['PHYS'] = PHYS
-              rdb['DIMS'] = DIMS
               if StaticSolve:
-                     rdb['REFS'] = REFS
-              rdb.close()
+                     storeRestart(restart_file, SOLT, LMS, DCF, DSOL, NX, NZ, TOPT[4], PHYS, DIMS, REFS=REFS)
+              else:
+                     storeRestart(restart_file, SOLT, LMS, DCF, DSOL, NX, NZ, TOPT[4], PHYS, DIMS)
        
        #%% Recover the solution (or check the residual)
        uxz = np.reshape(SOLT[udex,0], (NZ,NX+1), order='F') 
@@ -1249,6 +1113,6 @@ if __name__ == '__main__':
        #TestName = 'DiscreteStratScharIter'
        TestName = 'CustomTest'
        
-       # Run the model in a loop if needed...
+       # Run the model in a loop if needed (static Newton steps iterate in process)...
        for ii in range(1):
-              diagOutput = runModel(TestName)
\ No newline at end of file
+              diagOutput = runModel(TestName, newtonIters=1)
\ No newline at end of file
@@ -13,70 +13,81 @@ import math as mt
 from scipy.special import roots_hermite
 from scipy.special import roots_chebyt
 
+# Largest magnitude kept in the Hermite function recursion before rescaling
+HF_RESCALE = 1.0E+150
+
 def hefunclb(NX):
-       #'''
        # Compute off-diagonals of 7.84 in Spectral Methods, Springer
-       b = range(1,NX+1)
-       bd = 0.5 * np.array(b)
+       bd = 0.5 * np.arange(1,NX+1)
        
-       # Assemble the matrix
-       m1 = np.diag(np.sqrt(bd), k=+1)
-       m2 = np.diag(np.sqrt(bd), k=-1)
-       mm = np.add(m1,m2)
+       # Symmetric tridiagonal eigenvalues (zeros Hermite polys) in ascending order
+       xi = las.eigh_tridiagonal(np.zeros(NX+1), np.sqrt(bd), eigvals_only=True)
        
-       # Compute the eigenvalues of this matrix (zeros Hermite polys)
-       ew = las.eigvals(mm)
-       # Sort the eigenvalues in ascending order and store nodes
-       xi = np.sort(np.real(ew))
+       # Newton polish of the nodes on the zeros of the NX+1 function
+       for kk in range(2):
+              polyN, polyN1, lscale = hefuncscaled(NX+1, xi)
+              dpoly = mt.sqrt(2.0 * (NX+1)) * polyN - xi * polyN1
+              xi -= polyN1 / dpoly
        
        # Compute the Hermite function weights
        hf = hefuncm(NX, xi, False)
        w = 1.0 / (NX+1) * np.power(hf, -2.0)
-       #'''
-       '''
-       xi, w = roots_hermite(NX+1)
        
-       # Compute the Hermite function weights
-       hf = hefuncm(NX, xi, False)
-       w = 1.0 / (NX+1) * np.power(hf, -2.0)
-       '''     
        return xi, w
-       
-def hefuncm(NX, xi, fullMat):
+
+def hefuncscaled(NX, xi, HFM=None):
        # Initialize constant
        cst = 1.0 / mt.pi**4;
        ND = len(xi)
        
-       # Initialize the output matrix if needed
-       if fullMat:
-              HFM = np.zeros((NX+1,ND))
-              
+       # Gaussian factor is carried in log form with the recursion scaling
+       # since exp(-x^2/2) alone underflows on wide grids
+       lwfun = -0.5 * np.power(xi, 2.0)
+       lscale = np.zeros(ND)
+       
        # Compute the first two modes of the recursion
-       wfun = np.exp(-0.5 * np.power(xi, 2.0))
-       poly0 = cst * wfun;
-       poly1 = cst * mt.sqrt(2.0) * (xi * wfun);
+       poly0 = cst * np.ones(ND)
+       poly1 = cst * mt.sqrt(2.0) * xi
        
-       # Put the first two functions in the matrix or return low order functions
-       if fullMat:
-              HFM[0,:] = poly0
-              HFM[1,:] = poly1
-       elif NX == 0:
-              return poly0
-       elif NX == 1:
-              return poly1
+       if HFM is not None:
+              HFM[0,:] = poly0 * np.exp(lwfun)
+              if NX > 0:
+                     HFM[1,:] = poly1 * np.exp(lwfun)
        
        for nn in range(1,NX):
               polyn = mt.sqrt(2.0 / (nn+1)) * (xi * poly1)
               polyn -= mt.sqrt(nn / (nn+1)) * poly0
-              poly0 = poly1; 
-              poly1 = polyn;
+              poly0 = poly1
+              poly1 = polyn
+              
+              # Rescale both terms of the recursion where they grow large
+              scale = np.where(np.abs(poly1) > HF_RESCALE, 1.0 / HF_RESCALE, 1.0)
+              poly0 *= scale
+              poly1 *= scale
+              lscale -= np.log(scale)
+              
               # Put the new function in its matrix place
-              if fullMat:
-                     HFM[nn+1,:] = polyn
-              else:
-                     HFM = polyn
+              if HFM is not None:
+                     HFM[nn+1,:] = poly1 * np.exp(lwfun + lscale)
+       
+       return poly0, poly1, lwfun + lscale
+
+def hefuncm(NX, xi, fullMat):
+       ND = len(xi)
+       
+       # Initialize the output matrix if needed
+       if fullMat:
+              HFM = np.zeros((NX+1,ND))
+              hefuncscaled(NX, xi, HFM)
+              
+              return HFM.T
        
-       return HFM.T
+       # Return the highest order function only
+       poly0, poly1, lscale = hefuncscaled(NX, xi)
+       if NX == 0:
+              return poly0 * np.exp(lscale)
+       else:
+              return poly1 * np.exp(lscale)
 
 def cheblb(NZ):
        # Compute Chebyshev CGL nodes and weights
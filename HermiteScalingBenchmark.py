@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:02:51 2026
+
+Scaling of Hermite function nodes, weights and derivative matrix setup:
+tridiagonal eigensolver + rescaled recursion against the legacy dense version.
+
+@author: TempestGuerra
+"""
+
+import time
+import numpy as np
+import math as mt
+from scipy import linalg as las
+from scipy.special import roots_hermite
+from HerfunChebNodesWeights import hefunclb
+import computeDerivativeMatrix as derv
+
+#%% Legacy implementation (dense eigenvalues, diagonal weight matrices)
+def hefuncm_legacy(NX, xi, fullMat):
+       cst = 1.0 / mt.pi**4;
+       ND = len(xi)
+
+       if fullMat:
+              HFM = np.zeros((NX+1,ND))
+
+       wfun = np.exp(-0.5 * np.power(xi, 2.0))
+       poly0 = cst * wfun;
+       poly1 = cst * mt.sqrt(2.0) * (xi * wfun);
+
+       if fullMat:
+              HFM[0,:] = poly0
+              HFM[1,:] = poly1
+
+       for nn in range(1,NX):
+              polyn = mt.sqrt(2.0 / (nn+1)) * (xi * poly1)
+              polyn -= mt.sqrt(nn / (nn+1)) * poly0
+              poly0 = poly1;
+              poly1 = polyn;
+              if fullMat:
+                     HFM[nn+1,:] = polyn
+              else:
+                     HFM = polyn
+
+       return HFM.T
+
+def hefunclb_legacy(NX):
+       b = range(1,NX+1)
+       bd = 0.5 * np.array(b)
+
+       m1 = np.diag(np.sqrt(bd), k=+1)
+       m2 = np.diag(np.sqrt(bd), k=-1)
+       mm = np.add(m1,m2)
+
+       ew = las.eigvals(mm)
+       xi = np.sort(np.real(ew))
+
+       hf = hefuncm_legacy(NX, xi, False)
+       w = 1.0 / (NX+1) * np.power(hf, -2.0)
+
+       return xi, w
+
+def computeHermiteFunctionDerivativeMatrix_legacy(DIMS):
+       L1 = DIMS[0]
+       L2 = DIMS[1]
+       NX = DIMS[3]
+
+       alpha, whf = hefunclb_legacy(NX)
+       HT = hefuncm_legacy(NX, alpha, True)
+       HTD = hefuncm_legacy(NX+1, alpha, True)
+
+       b = (np.amax(alpha) - np.min(alpha)) / abs(L2 - L1)
+       W = np.diag(whf, k=0)
+
+       SDIFF = np.zeros((NX+2,NX+1));
+       SDIFF[0,1] = mt.sqrt(0.5)
+       SDIFF[NX,NX-1] = -mt.sqrt(NX * 0.5);
+       SDIFF[NX+1,NX] = -mt.sqrt((NX + 1) * 0.5);
+
+       for rr in range(1,NX):
+              SDIFF[rr,rr+1] = mt.sqrt((rr + 1) * 0.5);
+              SDIFF[rr,rr-1] = -mt.sqrt(rr * 0.5);
+
+       STR_H = (HT.T).dot(W)
+       temp = (HTD).dot(SDIFF)
+       temp = temp.dot(STR_H)
+       DDM = b * temp
+
+       return DDM, STR_H
+
+#%% Timings over grid sizes
+L2 = 1.0E4 * 3.0 * mt.pi
+L1 = -L2
+ZH = 36000.0
+NZ = 32
+NX = [127, 255, 511, 1023, 2047, 4095]
+# Legacy setup is only timed up to this size (dense O(N^3) and underflow)
+NX_legacy = 1023
+
+print('    NX   nodes/weights (s)   derivative (s)   legacy nodes (s)   legacy derivative (s)   node error   finite weights')
+for ii in range(len(NX)):
+       DIMS = [L1, L2, ZH, NX[ii], NZ]
+
+       start = time.time()
+       xi, whf = hefunclb(NX[ii])
+       tnodes = time.time() - start
+
+       start = time.time()
+       DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
+       tderv = time.time() - start
+
+       # Reference nodes
+       xr, wr = roots_hermite(NX[ii]+1)
+       nodeErr = np.amax(np.abs(xi - xr))
+
+       if NX[ii] <= NX_legacy:
+              start = time.time()
+              xl, wl = hefunclb_legacy(NX[ii])
+              tnodesL = time.time() - start
+
+              start = time.time()
+              DDX_1DL, HF_TRANSL = computeHermiteFunctionDerivativeMatrix_legacy(DIMS)
+              tdervL = time.time() - start
+       else:
+              tnodesL = np.nan
+              tdervL = np.nan
+
+       print('%6d %19.4f %16.4f %18.4f %23.4f %12.4E %16s' % \
+             (NX[ii], tnodes, tderv, tnodesL, tdervL, nodeErr, np.all(np.isfinite(whf))))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:20:37 2026
+
+Validation of the single precision transient solver: runs the transient test
+in double and single precision and reports the relative differences of the
+stored fields and tendencies at each output time.
+
+USAGE: python PrecisionValidation.py [TestName] [--compare]
+       --compare only compares the NC files from previous runs
+
+@author: TempestGuerra
+"""
+
+import sys
+import time
+import importlib
+import numpy as np
+from netCDF4 import Dataset
+
+TestName = 'CustomTest'
+runSolves = True
+for arg in sys.argv[1:]:
+       if arg == '--compare':
+              runSolves = False
+       else:
+              TestName = arg
+
+# Relative difference (max norm) accepted for the single precision state
+TOL_FIELDS = 1.0E-3
+
+fname64 = 'transientNL0.nc'
+fname32 = 'transientNL0_f32.nc'
+fieldNames = ['u', 'w', 'ln_p', 'ln_t']
+tendNames = ['DuDt', 'DwDt', 'Dln_pDt', 'Dln_tDt']
+
+#%% Run the transient solver in each precision
+if runSolves:
+       mdl = importlib.import_module('2DMountainWavesNH')
+
+       elapsed = []
+       for single in [False, True]:
+              start = time.time()
+              mdl.runModel(TestName, {'SinglePrec': single, 'MakePlots': False, \
+                                      'ToRestart': False, 'IsRestart': False})
+              elapsed.append(time.time() - start)
+
+       print('Run time double: %.2f (sec), single: %.2f (sec), speed up: %.2f' % \
+             (elapsed[0], elapsed[1], elapsed[0] / elapsed[1]))
+
+#%% Compare the stored output
+m_fid64 = Dataset(fname64, 'r', format="NETCDF4")
+m_fid32 = Dataset(fname32, 'r', format="NETCDF4")
+
+NT = min(len(m_fid64.variables['t']), len(m_fid32.variables['t']))
+tm64 = np.array(m_fid64.variables['t'][0:NT])
+tm32 = np.array(m_fid32.variables['t'][0:NT])
+print('Output times compared: %d, max time difference: %.4E (sec)' % \
+      (NT, np.amax(np.abs(tm64 - tm32))))
+
+isValid = True
+print('Relative differences (max norm) single to double precision:')
+print('%10s' % 'time' + ''.join(['%12s' % vv for vv in fieldNames + tendNames]))
+for tt in range(NT):
+       errs = []
+       for vv in fieldNames + tendNames:
+              q64 = np.array(m_fid64.variables[vv][tt,:,:], dtype=np.float64)
+              q32 = np.array(m_fid32.variables[vv][tt,:,:], dtype=np.float64)
+              qmax = np.amax(np.abs(q64))
+              if qmax > 0.0:
+                     errs.append(np.amax(np.abs(q32 - q64)) / qmax)
+              else:
+                     errs.append(np.amax(np.abs(q32 - q64)))
+
+       # Only the state is checked against the tolerance
+       if np.amax(errs[0:len(fieldNames)]) > TOL_FIELDS:
+              isValid = False
+
+       print('%10.2f' % tm64[tt] + ''.join(['%12.4E' % ee for ee in errs]))
+
+m_fid64.close()
+m_fid32.close()
+
+if isValid:
+       print('Single precision transient solution VALID to relative tolerance: ', TOL_FIELDS)
+else:
+       print('Single precision transient solution EXCEEDS relative tolerance: ', TOL_FIELDS)
+       sys.exit(1)
@@ -33,7 +33,9 @@ class TestCase:
                                 'DynSGS': False, 'SolveFull': False, 'SolveSchur': True, \
                                 'ToRestart': True, 'IsRestart': False, 'NewtonLin': True, \
                                 'Smooth3Layer': False, 'UnifStrat': True, 'ExactBC': False, \
-                                'UnifWind': True, 'LinShear': False, 'MakePlots': True}
+                                'UnifWind': True, 'LinShear': False, 'MakePlots': True, 'SinglePrec': False, \
+                                'SolveKrylov': False, 'NewtonKrylov': False, \
+                                'ChordNewton': False, 'SolveFourier': False}
                             
                      self.setUserData(191, 86, 70.0, 22.0, 280.0, 
                                       7000.0, 10000.0, 1.0, \
@@ -45,7 +47,9 @@ class TestCase:
                                 'DynSGS': False, 'SolveFull': False, 'SolveSchur': True, \
                                 'ToRestart': True, 'IsRestart': False, 'NewtonLin': True, \
                                 'Smooth3Layer': False, 'UnifStrat': True, 'ExactBC': True, \
-                                'UnifWind': True, 'LinShear': False, 'MakePlots': True}
+                                'UnifWind': True, 'LinShear': False, 'MakePlots': True, 'SinglePrec': False, \
+                                'SolveKrylov': False, 'NewtonKrylov': False, \
+                                'ChordNewton': False, 'SolveFourier': False}
                             
                      self.setUserData(191, 86, 70.0, 22.0, 280.0, \
                                       7000.0, 10000.0, 1.0, \
@@ -57,7 +61,9 @@ class TestCase:
                                 'DynSGS': False, 'SolveFull': False, 'SolveSchur': True, \
                                 'ToRestart': True, 'IsRestart': False, 'NewtonLin': True,\
                                 'Smooth3Layer': True, 'UnifStrat': False, 'ExactBC': True, \
-                                'UnifWind': False, 'LinShear': False, 'MakePlots': True}
+                                'UnifWind': False, 'LinShear': False, 'MakePlots': True, 'SinglePrec': False, \
+                                'SolveKrylov': False, 'NewtonKrylov': False, \
+                                'ChordNewton': False, 'SolveFourier': False}
                             
                      self.setUserData(191, 86, 75.0, 32.0, 300.0, \
                                       6000.0, 10000.0, 1.0, \
@@ -69,7 +75,9 @@ class TestCase:
                                 'DynSGS': False, 'SolveFull': False, 'SolveSchur': True, \
                                 'ToRestart': True, 'IsRestart': True, 'NewtonLin': True, \
                                 'Smooth3Layer': False, 'UnifStrat': False, 'ExactBC': True, \
-                                'UnifWind': False, 'LinShear': False, 'MakePlots': True}
+                                'UnifWind': False, 'LinShear': False, 'MakePlots': True, 'SinglePrec': False, \
+                                'SolveKrylov': False, 'NewtonKrylov': False, \
+                                'ChordNewton': False, 'SolveFourier': False}
                             
                      self.setUserData(191, 148, 75.0, 32.0, 300.0, \
                                       7000.0, 15000.0, 1.0, \
@@ -81,7 +89,9 @@ class TestCase:
                                 'DynSGS': True, 'SolveFull': False, 'SolveSchur': True, \
                                 'ToRestart': True, 'IsRestart': False, 'NewtonLin': True, \
                                 'Smooth3Layer': True, 'UnifStrat': False, 'ExactBC': True, \
-                                'UnifWind': False, 'LinShear': False, 'MakePlots': True}
+                                'UnifWind': False, 'LinShear': False, 'MakePlots': True, 'SinglePrec': False, \
+                                'SolveKrylov': False, 'NewtonKrylov': False, \
+                                'ChordNewton': False, 'SolveFourier': False}
                             
                      # STRATIFICATION BY TEMPERATURE SOUNDING
                      self.setUserData(583, 100, 150, 42.0, 300.0, \
@@ -6,67 +6,111 @@ Created on Mon Jul 22 15:10:56 2019
 @author: -
 """
 
+import hashlib
 import numpy as np
 #import scipy.interpolate as spint
 import HerfunChebNodesWeights as hcnw
 
-def computeColumnInterp(DIMS, zdata, fdata, NZI, ZTL, FLD, CH_TRANS, TypeInt):
-       NX = DIMS[3] + 1
-       NZ = DIMS[4]
-       
-       # Interpolate the nominal column profile to TF Chebyshev grid
+# Interpolation engines kept between calls (setup and output snapshots)
+interpCache = {}
+interpCacheSize = 8
+
+# Column interpolation as precomputed evaluation matrices (transform included)
+class ColumnInterpolator:
+
+       def __init__(self, DIMS, zdata, NZI, ZTL, CH_TRANS, TypeInt):
+              NX = DIMS[3] + 1
+              NZ = DIMS[4]
+              self.NX = NX
+              self.NZ = NZ
+              self.TypeInt = TypeInt
+
+              # Interpolate the nominal column profile to TF Chebyshev grid
+              if TypeInt == '1DtoTerrainFollowingCheb':
+                     # Compute the total height of nominal column
+                     zpan = np.amax(zdata) - np.min(zdata)
+                     # Convert to the reference grid at all columns at once
+                     xi = 1.0 * ((2.0 / zpan * ZTL.T) - 1.0)
+
+                     # Chebyshev matrices of all columns (NX, NZ, NZ)
+                     CTM = hcnw.chebpolym(NZ-1, -np.ravel(xi))
+                     CTM = np.reshape(CTM, (NX, NZ, NZ))
+
+                     # Fold in the forward transform on the nominal column
+                     self.EVM = np.matmul(CTM, CH_TRANS)
+                     self.NZI = NZ
+
+              # Interpolate solution on TF Chebyshev grid to TF linear grid
+              elif TypeInt == 'TerrainFollowingCheb2Lin':
+                     # Check
+                     if NZI <= 0:
+                            print('ERROR: Invalid number of points in new grid! ', NZI)
+                            print('Defaulting to vertical number: ', NZ)
+                            NZI = NZ
+
+                     # Compute the new column reference grid (linear space)
+                     xi = np.linspace(-1.0, 1.0, num=NZI, endpoint=True)
+
+                     # Same Chebyshev matrix and transform for every column
+                     CTM = hcnw.chebpolym(NZ-1, -xi)
+                     self.EVM = CTM.dot(CH_TRANS)
+                     self.NZI = NZI
+              else:
+                     print('ERROR: Invalid column interpolation type! ', TypeInt)
+                     self.EVM = None
+
+       # Interpolate a list of fields in one batched product
+       # 1D to TF: column profiles (NZ,) or (NZ,1), TF to linear: (NZ, NX) grids
+       def interpolate(self, fields):
+              NF = len(fields)
+
+              if self.TypeInt == '1DtoTerrainFollowingCheb':
+                     FDATA = np.hstack([np.reshape(ff, (self.NZ,1)) for ff in fields])
+                     # (NX, NZ, NZ) x (NZ, NF) -> (NX, NZ, NF)
+                     FLDI = np.matmul(self.EVM, FDATA)
+                     FLDI = np.transpose(FLDI, (1,0,2))
+              elif self.TypeInt == 'TerrainFollowingCheb2Lin':
+                     FDATA = np.stack(fields, axis=2)
+                     # (NZI, NZ) x (NZ, NX * NF) -> (NZI, NX, NF)
+                     FLDI = self.EVM.dot(np.reshape(FDATA, (self.NZ, self.NX * NF)))
+                     FLDI = np.reshape(FLDI, (self.NZI, self.NX, NF))
+              else:
+                     return fields
+
+              return [np.ascontiguousarray(FLDI[:,:,ff]) for ff in range(NF)]
+
+def hashArray(AA):
+       return hashlib.sha1(np.ascontiguousarray(AA).tobytes()).hexdigest()
+
+# Get the engine for this (ZTL, target grid) from the cache or make it
+def getColumnInterpolator(DIMS, zdata, NZI, ZTL, CH_TRANS, TypeInt):
        if TypeInt == '1DtoTerrainFollowingCheb':
               # Check that data is good for self interpolation
-              if (zdata.all() == None) or (fdata.all() == None):
+              if zdata is None:
                      print('ERROR: No reference data for interpolation given!')
-                     return FLD
-              
-              # Interpolated field is of the same size as the original
-              FLDI = np.zeros((NZ, NX))
-              # Compute the total height of nominal column
-              zpan = np.amax(zdata) - np.min(zdata)
-              # Apply forward transform on the nominal column
-              fcoeffs = CH_TRANS.dot(fdata)
-              
-              # Loop over each column
-              for cc in range(NX):
-                     # Convert to the reference grid at this column
-                     thisZ = ZTL[:,cc]
-                     xi = 1.0 * ((2.0 / zpan * thisZ) - 1.0)
-                     
-                     # Get the Chebyshev matrix for this column
-                     CTM = hcnw.chebpolym(NZ-1, -xi)
-                     
-                     # Apply the interpolation
-                     temp = (CTM).dot(fcoeffs)
-                     FLDI[:,cc] = np.ravel(temp)
-                     
-              return FLDI
-                     
-       # Interpolate solution on TF Chebyshev grid to TF linear grid
-       elif TypeInt == 'TerrainFollowingCheb2Lin':
-              # Check
-              if NZI <= 0:
-                     print('ERROR: Invalid number of points in new grid! ', NZI)
-                     print('Defaulting to vertical number: ', NZ)
-                     NZI = NZ
-              
-              # Interpolated field has a new size
-              FLDI = np.zeros((NZI, NX))
-              # Compute the new column reference grid (linear space)
-              xi = np.linspace(-1.0, 1.0, num=NZI, endpoint=True)
-              
-              # Loop over each column
-              for cc in range(NX):
-                     # Apply the forward transform at this column
-                     fcoeffs = CH_TRANS.dot(FLD[:,cc])
-                     
-                     # Get the Chebyshev matrix for this column
-                     CTM = hcnw.chebpolym(NZ-1, -xi)
-                     
-                     # Apply the interpolation
-                     temp = (CTM).dot(fcoeffs)
-                     FLDI[:,cc] = np.ravel(temp)
-              
-              return FLDI
-              
\ No newline at end of file
+                     return None
+              zkey = (np.amax(zdata), np.min(zdata), hashArray(ZTL))
+       else:
+              zkey = None
+
+       key = (TypeInt, DIMS[3], DIMS[4], NZI, zkey, hashArray(CH_TRANS))
+       if key not in interpCache:
+              if len(interpCache) >= interpCacheSize:
+                     # Drop the oldest engine
+                     interpCache.pop(next(iter(interpCache)))
+              interpCache[key] = ColumnInterpolator(DIMS, zdata, NZI, ZTL, CH_TRANS, TypeInt)
+
+       return interpCache[key]
+
+def computeColumnInterp(DIMS, zdata, fdata, NZI, ZTL, FLD, CH_TRANS, TypeInt):
+
+       CINT = getColumnInterpolator(DIMS, zdata, NZI, ZTL, CH_TRANS, TypeInt)
+       if CINT is None:
+              return FLD
+
+       if TypeInt == '1DtoTerrainFollowingCheb':
+              FLDI = CINT.interpolate([fdata])
+       else:
+              FLDI = CINT.interpolate([FLD])
+
+       return FLDI[0]
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:02:41 2026
+
+Column block (line) preconditioner for Krylov solution of the BC reduced
+static system. The unknowns of each vertical grid column (all variables and
+the Lagrange multiplier at its terrain point) form one dense block of the
+global Jacobian. The blocks are padded to a common size, inverted as one
+batch and applied as a batched matrix product, so storage is linear in NX.
+
+Without the horizontal derivatives a column block can be singular (u rows
+of uniform wind cases), so the lumped off column coupling (absolute row sum)
+is added to the block diagonal, scaled by COLUMN_SHIFT.
+
+The column blocks do NOT make GMRES converge on the static mountain wave
+problems. Half of the Jacobian entries are off column (the spectral
+horizontal derivatives of the advection and pressure gradient terms) and
+the blocks only see them lumped, so the preconditioned spectrum keeps the
+small horizontal modes. ClassicalScharIter at 31x24 stalls near 5.8E-3
+(4000 operator products). Block Gauss-Seidel sweeps along x and horizontal
+line blocks stall as well. The fast diagonalization preconditioner
+(computeFastDiagonalization) treats the horizontal derivatives exactly.
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.sparse as sps
+import scipy.sparse.linalg as spl
+
+# Scaling of the lumped off column coupling added to the block diagonals
+COLUMN_SHIFT = 0.1
+# Columns inverted per batch (bounds the temporary memory)
+COLUMN_BATCH = 64
+
+# Krylov (or refinement) solution that missed its tolerance
+class ConvergenceError(RuntimeError):
+       pass
+
+# Grid column of each unknown in the reduced ordering [LMS, sysDex]
+def computeColumnIndex(sysDex, ubdex, OPS, NZ):
+       gridDex = np.concatenate((ubdex, np.asarray(sysDex) % OPS))
+
+       # Grid fields are (NZ, NX+1) in Fortran order
+       return gridDex // NZ
+
+class ColumnBlockPreconditioner(spl.LinearOperator):
+
+       def __init__(self, GOP, colDex, shift=COLUMN_SHIFT):
+              GOP = sps.coo_matrix(GOP)
+              colDex = np.asarray(colDex)
+              N = GOP.shape[0]
+
+              # Local position of each unknown in its column block
+              perm = np.argsort(colDex, kind='stable')
+              counts = np.bincount(colDex)
+              starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+              self.colOf = colDex
+              self.locOf = np.empty(N, dtype=np.int64)
+              self.locOf[perm] = np.arange(N) - np.repeat(starts, counts)
+              NC = len(counts)
+              MB = np.amax(counts)
+
+              # Column blocks (identity on the padding) and lumped off column coupling
+              inBlock = colDex[GOP.row] == colDex[GOP.col]
+              DOFF = np.bincount(GOP.row[~inBlock], weights=np.abs(GOP.data[~inBlock]), minlength=N)
+              blocks = np.zeros((NC, MB, MB))
+              blocks[:, np.arange(MB), np.arange(MB)] = 1.0
+              for cc in range(NC):
+                     blocks[cc, 0:counts[cc], 0:counts[cc]] = 0.0
+              np.add.at(blocks, (colDex[GOP.row[inBlock]], self.locOf[GOP.row[inBlock]], \
+                                 self.locOf[GOP.col[inBlock]]), GOP.data[inBlock])
+              blocks[colDex, self.locOf, self.locOf] += shift * DOFF
+
+              # Batched inverses of the column blocks
+              for cb in range(0, NC, COLUMN_BATCH):
+                     try:
+                            blocks[cb:cb+COLUMN_BATCH] = np.linalg.inv(blocks[cb:cb+COLUMN_BATCH])
+                     except np.linalg.LinAlgError:
+                            print('Singular column block: using pseudo inverse.')
+                            blocks[cb:cb+COLUMN_BATCH] = np.linalg.pinv(blocks[cb:cb+COLUMN_BATCH])
+              self.IBLK = blocks
+
+              super().__init__(dtype=np.dtype(np.float64), shape=(N, N))
+
+       def _matvec(self, r):
+              RB = np.zeros(self.IBLK.shape[0:2])
+              RB[self.colOf, self.locOf] = np.ravel(r)
+
+              # Batched products over all columns
+              ZB = np.matmul(self.IBLK, RB[:,:,np.newaxis])[:,:,0]
+
+              return ZB[self.colOf, self.locOf]
+
+# Right preconditioned Krylov solution (reports operator products and the true residual)
+# strict: raise ConvergenceError when the tolerance is not reached (False for inner
+# solves checked by the caller)
+def solveKrylov(AOP, b, M=None, method='gmres', tol=1.0E-8, restart=200, maxiter=20, strict=True):
+       if method not in ('gmres', 'bicgstab'):
+              raise ValueError('INVALID KRYLOV METHOD: ' + str(method))
+
+       # Solve A * M * y = b and recover x = M * y (the Krylov residual is the true residual)
+       if M is None:
+              ROP = spl.aslinearoperator(AOP)
+       else:
+              ROP = spl.LinearOperator(AOP.shape, matvec=lambda y: AOP.dot(M.dot(y)), dtype=AOP.dtype)
+       
+       # Work of all the methods is counted in operator products (GMRES callbacks
+       # are per inner iteration or per restart cycle)
+       its = [0]
+       def matvecCount(y):
+              its[0] += 1
+              return ROP.matvec(y)
+       AMOP = spl.LinearOperator(AOP.shape, matvec=matvecCount, dtype=AOP.dtype)
+
+       if method == 'gmres':
+              sol, info = spl.gmres(AMOP, b, rtol=tol, atol=0.0, restart=restart, maxiter=maxiter)
+       else:
+              sol, info = spl.bicgstab(AMOP, b, rtol=tol, atol=0.0, maxiter=restart * maxiter)
+
+       if M is not None:
+              sol = M.dot(sol)
+
+       res = np.linalg.norm(AOP.dot(sol) - b) / np.linalg.norm(b)
+       if info == 0:
+              print('Krylov (' + method + ') converged in %d operator products, relative residual: %10.4E' % (its[0], res))
+       else:
+              print('Krylov (' + method + ') NOT converged after %d operator products, relative residual: %10.4E' % (its[0], res))
+              if strict:
+                     raise ConvergenceError('Krylov (' + method + ') NOT converged, relative residual: %10.4E' % res)
+
+       return sol
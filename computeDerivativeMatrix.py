@@ -6,8 +6,12 @@ Created on Fri Nov  1 08:59:22 2019
 @author: TempestGuerra
 """
 
+import copy
 import numpy as np
 import math as mt
+import scipy.fft as sfft
+import scipy.linalg as dsl
+import scipy.sparse as sps
 from HerfunChebNodesWeights import hefuncm, hefunclb
 from HerfunChebNodesWeights import chebpolym, cheblb
 
@@ -32,102 +36,174 @@ def computeAdjustedOperatorNBC(D2A, DOG, DD, tdex):
        
        return DOP
 
-# Computes Cubic Spline 1st derivative matrix
-def computeCubicSplineDerivativeMatrix(DIMS, dom, isClamped):
-       # Initialize matrix blocks
-       N = len(dom)
-       A = np.zeros((N,N)) # coefficients to 2nd derivatives
-       B = np.zeros((N,N)) # coefficients to RHS of 2nd derivatives
-       C = np.zeros((N,N)) # coefficients to 1st derivatives
-       D = np.zeros((N,N)) # coefficients to additive part of 1st derivatives
-       
-       # Loop over each interior point in the irregular grid
-       for ii in range(1,N-1):
-              hp = dom[ii+1] - dom[ii]
-              hm = dom[ii] - dom[ii-1]
-              hc = dom[ii+1] - dom[ii-1]
-              
-              A[ii,ii-1] = -1.0 / 6.0 * hm
-              A[ii,ii] = 1.0 / 6.0 * (hp + hm) - 0.5 * hc
-              A[ii,ii+1] = -1.0 / 6.0 * hp
-              
-              B[ii,ii-1] = -1.0 / hm
-              B[ii,ii] = (1.0 / hm + 1.0 / hp)
-              B[ii,ii+1] = -1.0 / hp
-              
-       for ii in range(0,N-1):
-              hp = dom[ii+1] - dom[ii]
-              C[ii,ii] = -1.0 / 3.0 * hp
-              C[ii,ii+1] = -1.0 / 6.0 * hp
+# Implicit derivative operator DDM = C * inv(A) * B + D with A tridiagonal
+# A is kept in (1,1) banded storage, B, C and D are sparse. Applied to all
+# columns of a block at once with one banded solve, explicit matrix on demand.
+class BandedDerivativeOperator:
+       
+       def __init__(self, AB, B, C=None, D=None):
+              self.N = AB.shape[1]
+              self.shape = (self.N, self.N)
+              self.AB = AB
+              self.B = sps.csr_matrix(B)
+              self.C = sps.csr_matrix(C) if C is not None else None
+              self.D = sps.csr_matrix(D) if D is not None else None
               
-              D[ii,ii] = -1.0 / hp
-              D[ii,ii+1] = 1.0 / hp
+       # Apply along axis 0 (columns of Y are independent grid lines)
+       def dot(self, Y, axis=0):
+              if axis != 0:
+                     return np.moveaxis(self.dot(np.moveaxis(Y, axis, 0)), 0, axis)
+              if Y.ndim > 2:
+                     return np.reshape(self.dot(np.reshape(Y, (self.N, -1))), Y.shape)
               
+              DY = dsl.solve_banded((1,1), self.AB, self.B.dot(Y), \
+                                    overwrite_b=True, check_finite=False)
+              if self.C is not None:
+                     DY = self.C.dot(DY)
+              if self.D is not None:
+                     DY += self.D.dot(Y)
+                     
+              return DY
+       
+       # inv(A) * B as a dense matrix
+       def solveRHS(self):
+              return dsl.solve_banded((1,1), self.AB, self.B.toarray(), \
+                                      overwrite_b=True, check_finite=False)
+       
+       def toarray(self):
+              return self.dot(np.eye(self.N))
+       
+       # Copy with factors stored in another precision
+       def astype(self, dtype):
+              return BandedDerivativeOperator(self.AB.astype(dtype), self.B.astype(dtype), \
+                                              self.C.astype(dtype) if self.C is not None else None, \
+                                              self.D.astype(dtype) if self.D is not None else None)
+       
+       def nnz(self):
+              nnz = self.AB.size + self.B.nnz
+              for MM in (self.C, self.D):
+                     if MM is not None:
+                            nnz += MM.nnz
+                     
+              return nnz
+
+# (1,1) banded storage from row wise sub, main and super diagonal coefficients
+def computeTridiagonalBands(lower, diag, upper):
+       AB = np.zeros((3, len(diag)))
+       AB[0,1:] = upper[:-1]
+       AB[1,:] = diag
+       AB[2,:-1] = lower[1:]
+       
+       return AB
+
+# Sparse tridiagonal from row wise coefficients (same convention as above)
+def computeTridiagonalSparse(lower, diag, upper):
+       return sps.diags([lower[1:], diag, upper[:-1]], offsets=[-1, 0, 1], format='lil')
+
+# Zero out entries below round off (vectorized clean up)
+def computeCleanNumericalZeros(DDM, tol=1.0E-15):
+       DDM[np.abs(DDM) <= tol] = 0.0
+       
+       return DDM
+
+# Cubic Spline 1st derivative operator (implicit tridiagonal form)
+def computeCubicSplineDerivativeOperator(DIMS, dom, isClamped):
+       N = len(dom)
+       h = np.diff(dom)
+       hp = h[1:]
+       hm = h[:-1]
+       hc = dom[2:] - dom[:-2]
+       
+       # Interior rows of the 2nd derivative system A * M = B * f
+       AL = np.zeros(N); AC = np.ones(N); AU = np.zeros(N)
+       BL = np.zeros(N); BC = np.zeros(N); BU = np.zeros(N)
+       AL[1:N-1] = -1.0 / 6.0 * hm
+       AC[1:N-1] = 1.0 / 6.0 * (hp + hm) - 0.5 * hc
+       AU[1:N-1] = -1.0 / 6.0 * hp
+       BL[1:N-1] = -1.0 / hm
+       BC[1:N-1] = (1.0 / hm + 1.0 / hp)
+       BU[1:N-1] = -1.0 / hp
+       
+       # 1st derivatives from 2nd derivatives f' = C * M + D * f
+       CC = np.zeros(N); CU = np.zeros(N); CL = np.zeros(N)
+       DC = np.zeros(N); DU = np.zeros(N); DL = np.zeros(N)
+       CC[0:N-1] = -1.0 / 3.0 * h
+       CU[0:N-1] = -1.0 / 6.0 * h
+       DC[0:N-1] = -1.0 / h
+       DU[0:N-1] = 1.0 / h
+       
        # Adjust the right end of the 1st derivative matrix
        hn = dom[N-1] - dom[N-2]
-       C[N-1,N-2] = hn / 6.0
-       C[N-1,N-1] = hn / 3.0
-       D[N-1,N-2] = -1.0 / hn
-       D[N-1,N-1] = 1.0 / hn
-              
+       CL[N-1] = hn / 6.0
+       CC[N-1] = hn / 3.0
+       DL[N-1] = -1.0 / hn
+       DC[N-1] = 1.0 / hn
+       
+       C = computeTridiagonalSparse(CL, CC, CU)
+       D = computeTridiagonalSparse(DL, DC, DU)
+       
        if isClamped:
-              DDM_CFD = computeCompactFiniteDiffDerivativeMatrix1(DIMS, dom)
-              A[0,0] = C[0,0]
-              A[0,1] = C[0,1]
-              B[0,:] = DDM_CFD[0,:]
-              B[0,0] -= D[0,0]
-              B[0,1] -= D[0,1]
-              hn = dom[N-1] - dom[N-2]
-              A[N-1,N-2] = hn / 6.0
-              A[N-1,N-1] = hn / 3.0
-              B[N-1,:] = DDM_CFD[N-1,:]
+              # End rows from the compact FD boundary stencils
+              RDM_CFD = computeCompactFiniteDiffDerivativeOperator1(DIMS, dom).B.tolil()
+              AC[0] = CC[0]
+              AU[0] = CU[0]
+              AL[N-1] = hn / 6.0
+              AC[N-1] = hn / 3.0
+              B = computeTridiagonalSparse(BL, BC, BU)
+              B[0,:] = RDM_CFD[0,:]
+              B[0,0] -= DC[0]
+              B[0,1] -= DU[0]
+              B[N-1,:] = RDM_CFD[N-1,:]
               B[N-1,N-2] += 1.0 / hn
               B[N-1,N-1] += -1.0 / hn
-              
-       if isClamped:
-              AIB = np.linalg.solve(A, B)
        else:
-              AIB = np.zeros((N,N))
-              AIB[1:N-1,1:N-1] = np.linalg.solve(A[1:N-1,1:N-1], B[1:N-1,1:N-1])
+              # Natural ends: interior system only (end rows of A are identity)
+              BL[1] = 0.0
+              BU[N-2] = 0.0
+              B = computeTridiagonalSparse(BL, BC, BU)
               
-       DDM = C.dot(AIB) + D
+       AB = computeTridiagonalBands(AL, AC, AU)
+       
+       return BandedDerivativeOperator(AB, B, C, D)
+
+# Computes Cubic Spline 1st derivative matrix
+def computeCubicSplineDerivativeMatrix(DIMS, dom, isClamped):
+       DOP = computeCubicSplineDerivativeOperator(DIMS, dom, isClamped)
+       
+       AIB = DOP.solveRHS()
+       DDM = DOP.C.dot(AIB) + DOP.D.toarray()
        
        return DDM, AIB
 
-# Computes standard 4th order compact finite difference 1st derivative matrix
-def computeCompactFiniteDiffDerivativeMatrix1(DIMS, dom):
-       # Initialize the left and right derivative matrices
+# Standard 4th order compact finite difference 1st derivative (implicit form)
+def computeCompactFiniteDiffDerivativeOperator1(DIMS, dom):
        N = len(dom)
-       LDM = np.zeros((N,N)) # tridiagonal
-       RDM = np.zeros((N,N)) # centered difference
-       
-       # Loop over each interior point in the irregular grid
-       for ii in range(1,N-1):
-              # Set compact finite difference
-              # Get the metric weights
-              hp = dom[ii+1] - dom[ii]
-              hm = dom[ii] - dom[ii-1]
-              
-              # Compute the stencil coefficients
-              hr = (hm / hp)
-              d = -0.25
-              c = d * hr**4
-              b = -1.0 / 8.0 * (5.0 + hr) 
-              a = 1.0 / 8.0 * (hr**2 + hr**3) + 0.5 * hr**4
-              
-              # Write the right equation
-              RDM[ii,ii-1] = -b
-              RDM[ii,ii] = (a + b)
-              RDM[ii,ii+1] = -a
-              # Write the left equation
-              LDM[ii,ii-1] = d * hm
-              LDM[ii,ii] = -(hp * (a + c) + hm * (d - b))
-              LDM[ii,ii+1] = c * hp
-              
-       # Handle the left and right boundaries
-       LDM[0,0] = 1.0
-       LDM[N-1,N-1] = 1.0
+       LL = np.zeros(N); LC = np.ones(N); LU = np.zeros(N)
+       RL = np.zeros(N); RC = np.zeros(N); RU = np.zeros(N)
        
+       # Set compact finite difference on each interior point
+       # Get the metric weights
+       hp = dom[2:] - dom[1:-1]
+       hm = dom[1:-1] - dom[:-2]
+       
+       # Compute the stencil coefficients
+       hr = (hm / hp)
+       d = -0.25
+       c = d * hr**4
+       b = -1.0 / 8.0 * (5.0 + hr) 
+       a = 1.0 / 8.0 * (hr**2 + hr**3) + 0.5 * hr**4
+       
+       # Write the right equation
+       RL[1:N-1] = -b
+       RC[1:N-1] = (a + b)
+       RU[1:N-1] = -a
+       # Write the left equation
+       LL[1:N-1] = d * hm
+       LC[1:N-1] = -(hp * (a + c) + hm * (d - b))
+       LU[1:N-1] = c * hp
+       
+       RDM = computeTridiagonalSparse(RL, RC, RU)
+              
        # Left end (forward)
        hp = dom[1] - dom[0]
        hpp = hp + (dom[2] - dom[1])
@@ -143,52 +219,50 @@ def computeCompactFiniteDiffDerivativeMatrix1(DIMS, dom):
        RDM[N-1,N-1] = -(1.0 / rc) * (1.0 - (hm / hmm)**2)
        RDM[N-1,N-2] = (1.0 / rc)
        RDM[N-1,N-3] = -(1.0 / rc) * (hm / hmm)**2
+       
+       LDM = computeTridiagonalBands(LL, LC, LU)
+       
+       return BandedDerivativeOperator(LDM, RDM)
 
+# Computes standard 4th order compact finite difference 1st derivative matrix
+def computeCompactFiniteDiffDerivativeMatrix1(DIMS, dom):
        # Get the derivative matrix
-       DDM1 = np.linalg.solve(LDM, RDM)
+       DDM1 = computeCompactFiniteDiffDerivativeOperator1(DIMS, dom).toarray()
        
        # Clean up numerical zeros
-       for ii in range(N):
-              for jj in range(N):
-                     if abs(DDM1[ii,jj]) <= 1.0E-15:
-                            DDM1[ii,jj] = 0.0
+       DDM1 = computeCleanNumericalZeros(DDM1)
        
        return DDM1
 
-# Computes standard 4th order compact finite difference 2nd derivative matrix
-def computeCompactFiniteDiffDerivativeMatrix2(DIMS, dom):
-       # Initialize the left and right derivative matrices
+# Standard 4th order compact finite difference 2nd derivative (implicit form)
+def computeCompactFiniteDiffDerivativeOperator2(DIMS, dom):
        N = len(dom)
-       LDM = np.zeros((N,N)) # tridiagonal
-       RDM = np.zeros((N,N)) # centered difference
-       
-       # Loop over each interior point in the irregular grid
-       for ii in range(1,N-1):
-              # Set compact finite difference
-              # Get the metric weights
-              hp = dom[ii+1] - dom[ii]
-              hm = dom[ii] - dom[ii-1]
-              
-              # Compute the stencil coefficients
-              hr = (hm / hp)
-              d = 3.0 / 24.0 - 1.0 / 24.0 * (1.0 / hr)**3
-              c = 3.0 / 24.0 - 1.0 / 24.0 * hr**3
-              b = 1.0
-              a = hr
-              
-              # Write the right equation
-              RDM[ii,ii-1] = b
-              RDM[ii,ii] = -(a + b)
-              RDM[ii,ii+1] = a
-              # Write the left equation
-              LDM[ii,ii-1] = -d * hm**2
-              LDM[ii,ii] = ((0.5 * a + c) * hp**2 + (0.5 * b + d) * hm**2) 
-              LDM[ii,ii+1] = -c * hp**2
-              
-       # Handle the left and right boundaries
-       LDM[0,0] = 1.0
-       LDM[N-1,N-1] = 1.0
+       LL = np.zeros(N); LC = np.ones(N); LU = np.zeros(N)
+       RL = np.zeros(N); RC = np.zeros(N); RU = np.zeros(N)
+       
+       # Set compact finite difference on each interior point
+       # Get the metric weights
+       hp = dom[2:] - dom[1:-1]
+       hm = dom[1:-1] - dom[:-2]
+       
+       # Compute the stencil coefficients
+       hr = (hm / hp)
+       d = 3.0 / 24.0 - 1.0 / 24.0 * (1.0 / hr)**3
+       c = 3.0 / 24.0 - 1.0 / 24.0 * hr**3
+       b = 1.0
+       a = hr
+       
+       # Write the right equation
+       RL[1:N-1] = b
+       RC[1:N-1] = -(a + b)
+       RU[1:N-1] = a
+       # Write the left equation
+       LL[1:N-1] = -d * hm**2
+       LC[1:N-1] = ((0.5 * a + c) * hp**2 + (0.5 * b + d) * hm**2) 
+       LU[1:N-1] = -c * hp**2
        
+       RDM = computeTridiagonalSparse(RL, RC, RU)
+              
        # Left end (forward)
        hp = dom[1] - dom[0]
        hpp = hp + (dom[2] - dom[1])
@@ -206,15 +280,18 @@ def computeCompactFiniteDiffDerivativeMatrix2(DIMS, dom):
        RDM[N-1,N-1] = (1.0 - hr) / cd
        RDM[N-1,N-2] = -1.0 / cd
        RDM[N-1,N-3] = hr / cd
+       
+       LDM = computeTridiagonalBands(LL, LC, LU)
+       
+       return BandedDerivativeOperator(LDM, RDM)
 
+# Computes standard 4th order compact finite difference 2nd derivative matrix
+def computeCompactFiniteDiffDerivativeMatrix2(DIMS, dom):
        # Get the derivative matrix
-       DDM2 = np.linalg.solve(LDM, RDM)
+       DDM2 = computeCompactFiniteDiffDerivativeOperator2(DIMS, dom).toarray()
        
        # Clean up numerical zeros
-       for ii in range(N):
-              for jj in range(N):
-                     if abs(DDM2[ii,jj]) <= 1.0E-15:
-                            DDM2[ii,jj] = 0.0
+       DDM2 = computeCleanNumericalZeros(DDM2)
        
        return DDM2
 
@@ -232,23 +309,17 @@ def computeHermiteFunctionDerivativeMatrix(DIMS):
        # Get the scale factor
        b = (np.amax(alpha) - np.min(alpha)) / abs(L2 - L1)
        
-       # Make a diagonal matrix of weights
-       W = np.diag(whf, k=0)
+       # Hermite function spectral transform in matrix form (weights broadcast)
+       STR_H = HT.T * whf
+       
+       # Spectral derivative coefficients (bidiagonal) applied to columns of HTD
+       # SDIFF[rr,rr+1] = sqrt((rr+1)/2) and SDIFF[rr+1,rr] = -sqrt((rr+1)/2)
+       sup = np.sqrt(0.5 * np.arange(1,NX+1))
+       sub = np.sqrt(0.5 * np.arange(1,NX+2))
+       temp = -HTD[:,1:] * sub
+       temp[:,1:] += HTD[:,0:NX] * sup
        
-       # Compute the coefficients of spectral derivative in matrix form
-       SDIFF = np.zeros((NX+2,NX+1));
-       SDIFF[0,1] = mt.sqrt(0.5)
-       SDIFF[NX,NX-1] = -mt.sqrt(NX * 0.5);
-       SDIFF[NX+1,NX] = -mt.sqrt((NX + 1) * 0.5);
-                     
-       for rr in range(1,NX):
-              SDIFF[rr,rr+1] = mt.sqrt((rr + 1) * 0.5);
-              SDIFF[rr,rr-1] = -mt.sqrt(rr * 0.5);
-              
-       # Hermite function spectral transform in matrix form
-       STR_H = (HT.T).dot(W)
        # Hermite function spatial derivative based on spectral differentiation
-       temp = (HTD).dot(SDIFF)
        temp = temp.dot(STR_H)
        DDM = b * temp
 
@@ -304,6 +375,67 @@ def computeChebyshevDerivativeMatrix(DIMS):
 
        return DDM, STR_C
 
+# Chebyshev derivative on the CGL grid by DCT-I and the SDIFF recurrence
+# Same operator as computeChebyshevDerivativeMatrix in O(NZ log NZ) per column
+class ChebyshevTransformDerivative:
+       
+       def __init__(self, DIMS):
+              ZH = DIMS[2]
+              NZ = DIMS[4]
+              self.N = NZ
+              self.shape = (NZ, NZ)
+              
+              xi, wcp = cheblb(NZ)
+              CT = chebpolym(NZ-1, -xi)
+              
+              # Forward transform scaling (as in the matrix version)
+              S = np.reciprocal(np.sum(np.expand_dims(wcp, axis=1) * np.power(CT, 2.0), axis=0))
+              S[NZ-1] = 1.0 / mt.pi
+              # DCT-I sums end points with unit weight and the interior with 2
+              self.fscale = 0.5 * wcp[1] * S
+              
+              # Recurrence weights 2n with the top coefficient as in SDIFF
+              self.rscale = 2.0 * np.arange(NZ, dtype=float)
+              self.rscale[NZ-1] = 2.0 * NZ
+              
+              # Domain scale factor and inverse DCT-I normalization
+              self.dscale = -(2.0 / ZH) * 0.5
+              
+       def dot(self, Y, axis=0):
+              # Transforms run along the last (contiguous) axis
+              Y = np.moveaxis(np.asarray(Y), axis, -1)
+              
+              # Chebyshev coefficients
+              A = sfft.dct(Y, type=1, axis=-1) * self.fscale
+              
+              # Derivative coefficients: reverse cumulative sums over every other mode
+              G = A * self.rscale
+              R = np.empty(G.shape, dtype=G.dtype)
+              for pp in range(2):
+                     R[...,pp::2] = np.flip(np.cumsum(np.flip(G[...,pp::2], axis=-1), axis=-1), axis=-1)
+              B = np.empty(G.shape, dtype=G.dtype)
+              B[...,0:self.N-1] = R[...,1:self.N]
+              B[...,self.N-1] = 0.0
+              B[...,0] *= 0.5
+              
+              # Back to grid values (top coefficient is zero)
+              DY = sfft.dct(B, type=1, axis=-1)
+              DY += B[...,0:1]
+              DY *= self.dscale
+              
+              return np.moveaxis(DY, -1, axis)
+       
+       def toarray(self):
+              return self.dot(np.eye(self.N))
+       
+       # Copy with scalings stored in another precision
+       def astype(self, dtype):
+              DOP = copy.copy(self)
+              DOP.fscale = self.fscale.astype(dtype)
+              DOP.rscale = self.rscale.astype(dtype)
+              
+              return DOP
+
 def computeFourierDerivativeMatrix(DIMS):
        
        # Get data from DIMS
@@ -318,6 +450,43 @@ def computeFourierDerivativeMatrix(DIMS):
        
        return DDM, DFT
 
+# Fourier derivative on the uniform periodic grid by real FFT
+# Same operator as the real part of computeFourierDerivativeMatrix
+class FourierTransformDerivative:
+       
+       def __init__(self, DIMS):
+              L1 = DIMS[0]
+              L2 = DIMS[1]
+              NX = DIMS[3]
+              self.N = NX + 1
+              self.shape = (self.N, self.N)
+              
+              # Nyquist mode (even N) has no real derivative and is dropped
+              kxf = (2*mt.pi/abs(L2 - L1)) * np.fft.rfftfreq(self.N) * self.N
+              if self.N % 2 == 0:
+                     kxf[-1] = 0.0
+              self.ikxf = 1j * kxf
+              
+       def dot(self, Y, axis=0):
+              # Transforms run along the last (contiguous) axis
+              Y = np.moveaxis(np.asarray(Y), axis, -1)
+              
+              FY = sfft.rfft(Y, axis=-1)
+              FY *= self.ikxf
+              DY = sfft.irfft(FY, n=self.N, axis=-1, overwrite_x=True)
+              
+              return np.moveaxis(DY, -1, axis)
+       
+       def toarray(self):
+              return self.dot(np.eye(self.N))
+       
+       # Copy with wavenumbers stored in another precision
+       def astype(self, dtype):
+              DOP = copy.copy(self)
+              DOP.ikxf = self.ikxf.astype(np.result_type(dtype, np.complex64))
+              
+              return DOP
+
 def computeChebyshevDerivativeMatrix_X(DIMS):
        
        # Get data from DIMS
@@ -8,6 +8,7 @@ Created on Mon Jul 22 13:11:11 2019
 import numpy as np
 import warnings
 import scipy.sparse as sps
+import scipy.sparse.linalg as spl
 import matplotlib.pyplot as plt
 
 def computeFieldDerivatives(q, DDX, DDZ):
@@ -183,6 +184,118 @@ def computeJacobianMatrixLogPLogT(PHYS, REFS, REFG, fields, U, botdex, topdex):
        
        return DOPS
     
+# Pointwise coefficients of the Newton Jacobian (the diagonal operators above)
+def computeJacobianCoefficientsLogPLogT(PHYS, REFS, REFG, fields, U, exactPGF=False):
+       # Get physical constants
+       gc = PHYS[0]
+       Rd = PHYS[3]
+       kap = PHYS[4]
+       
+       # Get the derivative operators
+       DDXM = REFS[10]
+       DDZM = REFS[11]
+       DZDX = REFS[15].flatten()
+       
+       DLTDZ = REFG[1]
+       DQDZ = REFG[2]
+       
+       # Compute (total and partial) derivatives of perturbations
+       DqDx = DDXM.dot(fields)
+       DqDz = DDZM.dot(fields)
+       PqPx = DqDx - np.expand_dims(DZDX, 1) * DqDz
+       
+       # Compute diagonal terms related to sensible temperature
+       RdT_bar = REFS[9][0]
+       T_bar = (1.0 / Rd) * RdT_bar
+       T_ratio = np.expm1(kap * fields[:,2] + fields[:,3]) 
+       bf = T_ratio + 1.0
+       RdT = RdT_bar * bf
+       
+       # Compute derivatives of temperature perturbation
+       T_prime = T_ratio * T_bar
+       DtDz = DDZM.dot(T_prime)
+       PtPx = DDXM.dot(T_prime) - DZDX * DtDz
+       
+       JCF = {'U' : U, 'WXZ' : fields[:,1] - U * DZDX, 'DZDX' : DZDX, 'RdT' : RdT, \
+              'c11' : PqPx[:,0], 'c12' : DqDz[:,0] + DQDZ[:,0], \
+              'c13' : Rd * PtPx, 'c14' : RdT * PqPx[:,2], \
+              'c21' : PqPx[:,1], 'c22' : DqDz[:,1], \
+              'c23' : RdT_bar * DLTDZ[:,0] + Rd * DtDz, 'c24' : RdT * DqDz[:,2] - gc * bf, \
+              'c31' : PqPx[:,2], 'c32' : DqDz[:,2] + DQDZ[:,2], \
+              'c41' : PqPx[:,3], 'c42' : DqDz[:,3] + DQDZ[:,3]}
+       
+       # Derivative of the nonlinear vertical PGF and buoyancy in ln(p) (Newton-Krylov)
+       if exactPGF:
+              JCF['c23'] = kap * JCF['c24']
+       
+       return JCF
+
+# Matrix free Newton Jacobian (same blocks as computeJacobianMatrixLogPLogT)
+# acting on the static system [LMS, q[sysDex]] with Rayleigh and terrain BC
+class JacobianOperatorLogPLogT(spl.LinearOperator):
+       
+       def __init__(self, PHYS, REFS, REFG, ROPS, fields, U, sysDex, ubdex, dHdXB, ExactBC, exactPGF=False):
+              self.OPS = fields.shape[0]
+              self.DDXM = REFS[10]
+              self.DDZM = REFS[11]
+              self.gam = PHYS[6]
+              
+              self.JCF = computeJacobianCoefficientsLogPLogT(PHYS, REFS, REFG, fields, U, exactPGF)
+              # Rayleigh operators are diagonal
+              self.RDG = np.stack([ROPS[vv].diagonal() for vv in range(4)], axis=1)
+              
+              # BC row and column selection and terrain constraint coefficients
+              self.sysDex = np.asarray(sysDex)
+              self.ubdex = np.asarray(ubdex)
+              self.lmsDOF = len(ubdex)
+              if ExactBC:
+                     self.LCU = -1.0 * np.asarray(dHdXB)
+              else:
+                     self.LCU = np.zeros(self.lmsDOF)
+              self.LCW = np.ones(self.lmsDOF)
+              
+              N = self.lmsDOF + len(sysDex)
+              super().__init__(dtype=np.dtype(np.float64), shape=(N, N))
+              
+       # Jacobian (with Rayleigh) on full (OPS, 4) perturbation fields
+       def applyJacobian(self, Q):
+              JCF = self.JCF
+              DqDx = self.DDXM.dot(Q)
+              DqDz = self.DDZM.dot(Q)
+              PqPx = DqDx - np.expand_dims(JCF['DZDX'], 1) * DqDz
+              UPX = np.expand_dims(JCF['U'], 1) * DqDx + np.expand_dims(JCF['WXZ'], 1) * DqDz
+              
+              JQ = UPX + self.RDG * Q
+              JQ[:,0] += JCF['c11'] * Q[:,0] + JCF['c12'] * Q[:,1] + \
+                         JCF['RdT'] * PqPx[:,2] + JCF['c13'] * Q[:,2] + JCF['c14'] * Q[:,3]
+              JQ[:,1] += JCF['c21'] * Q[:,0] + JCF['c22'] * Q[:,1] + \
+                         JCF['RdT'] * DqDz[:,2] + JCF['c23'] * Q[:,2] + JCF['c24'] * Q[:,3]
+              JQ[:,2] += self.gam * (PqPx[:,0] + DqDz[:,1]) + \
+                         JCF['c31'] * Q[:,0] + JCF['c32'] * Q[:,1]
+              JQ[:,3] += JCF['c41'] * Q[:,0] + JCF['c42'] * Q[:,1]
+              
+              return JQ
+       
+       def _matvec(self, x):
+              x = np.ravel(x)
+              lms = x[0:self.lmsDOF]
+              
+              # Zero perturbation on the removed BC DOF
+              q = np.zeros(4 * self.OPS, dtype=np.result_type(x, np.float64))
+              q[self.sysDex] = x[self.lmsDOF:]
+              Q = np.reshape(q, (self.OPS, 4), order='F')
+              
+              JQ = self.applyJacobian(Q)
+              # Lagrange multiplier columns on terrain u and w rows
+              JQ[self.ubdex,0] += self.LCU * lms
+              JQ[self.ubdex,1] += self.LCW * lms
+              
+              # Terrain constraint rows
+              yl = self.LCU * Q[self.ubdex,0] + self.LCW * Q[self.ubdex,1]
+              yq = np.reshape(JQ, (4 * self.OPS,), order='F')[self.sysDex]
+              
+              return np.concatenate((yl, yq))
+       
 #%% The linear equation operator
 def computeEulerEquationsLogPLogT_Classical(DIMS, PHYS, REFS, REFG):
        # Get physical constants
@@ -262,16 +375,16 @@ def computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, DZDX, RdT_bar, fiel
        GMLZ = REFG[0][2]
        DQDZ = REFG[2]
        
-       # Compute advective (multiplicative) operators
-       UM = np.expand_dims(U,1)
-       WM = np.expand_dims(W,1)
+       # Compute advective (multiplicative) operators (totals in state precision)
+       UM = np.expand_dims(U.astype(fields.dtype, copy=False),1)
+       WM = np.expand_dims(W.astype(fields.dtype, copy=False),1)
        
-       # Compute pressure gradient force scaling (buoyancy)
+       # Compute pressure gradient force scaling (buoyancy) in double precision
        with warnings.catch_warnings():
               np.seterr(all='raise')
               try:
                      #'''
-                     earg = kap * fields[:,2] + fields[:,3]
+                     earg = kap * fields[:,2].astype(np.float64) + fields[:,3]
                      T_ratio = np.expm1(earg)
                      RdT = RdT_bar * (T_ratio + 1.0)
                      #'''
@@ -282,7 +395,7 @@ def computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, DZDX, RdT_bar, fiel
                      T_ratio = RdT_hat - 1.0
                      '''
               except FloatingPointError:
-                     earg = kap * fields[:,2] + fields[:,3]
+                     earg = kap * fields[:,2].astype(np.float64) + fields[:,3]
                      earg_max = np.amax(earg)
                      earg_min = np.amin(earg)
                      print('In argument to local T ratio: ', earg_min, earg_max)
@@ -297,6 +410,9 @@ def computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, DZDX, RdT_bar, fiel
                      RdT_hat = 1.0 + T_ratio
                      RdT = RdT_bar * RdT_hat
        
+       T_ratio = T_ratio.astype(fields.dtype, copy=False)
+       RdT = RdT.astype(fields.dtype, copy=False)
+       
        # Compute transport terms with stretching
        ''' Advection with grid stretching
        Uadvect = UM * GMLX.dot(DqDx)
@@ -336,13 +452,23 @@ def computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, DZDX, RdT_bar, fiel
                         
        return DqDt
 
+# Steady (static) residual of the state: the nonlinear tendencies and the Rayleigh
+# layers as a single DOF vector. Static solvers all converge on this definition.
+def computeStaticResidualLogPLogT(PHYS, REFS, REFG, fields, U, W, ebcDex, zeroDex):
+       DqDx, DqDz = computeFieldDerivatives(fields, REFS[10], REFS[11])
+       rhs = computeEulerEquationsLogPLogT_NL(PHYS, DqDx, DqDz, REFG, REFS[15], REFS[9][0], \
+                                              fields, U, W, ebcDex, zeroDex)
+       rhs += computeRayleighTendency(REFG, fields, zeroDex)
+
+       return np.reshape(rhs, (rhs.shape[0] * rhs.shape[1],), order='F')
+
 def computeRayleighTendency(REFG, fields, zeroDex):
        
        # Get the Rayleight operators
        mu = np.expand_dims(REFG[3],0)
        ROP = REFG[4]
        
-       DqDt = -mu * ROP.dot(fields)
+       DqDt = (-mu * ROP.dot(fields)).astype(fields.dtype, copy=False)
        
        # Fix essential boundary conditions
        #'''
@@ -356,7 +482,7 @@ def computeRayleighTendency(REFG, fields, zeroDex):
 
 def computeDiffusionTendency(PHYS, PqPx, PqPz, P2qPx2, P2qPz2, P2qPzx, P2qPxz, DZDX, ebcDex, DX2, DZ2, DXZ, RHOI, DCF, DynSGS):
        
-       DqDt = np.zeros(P2qPx2.shape)
+       DqDt = np.zeros(P2qPx2.shape, dtype=P2qPx2.dtype)
        '''
        # Diffusion of u-w vector
        DqDt[:,0] = 2.0 * DX2 * P2qPx2[:,0] + DZ2 * P2qPz2[:,0] + DXZ * P2qPzx[:,1]       
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 09:48:15 2026
+
+Fast diagonalization preconditioner for the BC reduced static system. Only
+the horizontal derivative DDX_1D = VX * diag(LX) * VX^-1 is eigendecomposed
+(cached with the grid), the vertical stays in dense column systems since
+the coefficients vary with height. With per level background coefficients
+the classical operator then splits into one 4 * NZ column system per
+eigenvalue of DDX_1D (the Fourier mode matrices with i * k replaced by LX),
+each LU factored once. VX^-1 is never formed: the transform along x is a
+solve with the LU factors of VX.
+
+Setup is O(NX^3) for the eigendecomposition and O(NX * NZ^3) for the
+column factors, stored in O(NX * NZ^2) complex entries. An application is
+O(NX^2 * NZ) for the dense transforms along x and O(NX * NZ^2) for the
+column solves, with no global factorization.
+
+The terrain constraint residual sets the Dirichlet value of w at the terrain
+and the Lagrange multipliers take the residual of the replaced w rows. The
+Rayleigh coefficients are column means per level so that the lateral layers
+are felt in the column systems (far field minimum only is much weaker).
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.linalg as dsl
+import scipy.sparse.linalg as spl
+import computeFourierModeSolve as fms
+
+# Eigendecomposition of a 1D derivative matrix (from the operator cache if possible)
+# and the LU factors of the eigenvectors
+def computeEigenDecomposition1D(DDX, key=None, opCache=None):
+       if key is not None and opCache is not None and opCache.contains(key):
+              print('Eigen decomposition of DDX from cache: ' + key)
+              EIG = opCache.load(key)
+              LX, VX = np.array(EIG['LX']), np.array(EIG['VX'])
+       else:
+              LX, VX = np.linalg.eig(np.asarray(DDX))
+
+              if key is not None and opCache is not None:
+                     opCache.store(key, {'LX' : LX, 'VX' : VX})
+
+       return LX, VX, dsl.lu_factor(VX, check_finite=False)
+
+class FastDiagPreconditioner(spl.LinearOperator):
+
+       # EIGX from computeEigenDecomposition1D, COEFS per level (computeFourierModeCoefficients)
+       def __init__(self, EIGX, COEFS, DDZ, PHYS, sysDex, ubdex, OPS):
+              LX, VX, LUVX = EIGX
+              NX = len(LX)
+              NZ = DDZ.shape[0]
+              self.VX = VX
+              self.LUVX = LUVX
+              self.NX = NX
+              self.NZ = NZ
+              self.OPS = OPS
+              self.sysDex = sysDex
+              self.lmsDOF = len(ubdex)
+
+              # Zero eigenvalue (no advection) shifted to the smallest nonzero magnitude
+              LA = np.abs(LX)
+              zdex = LA <= 1.0E-12 * np.amax(LA)
+              LX = np.where(zdex, 1j * np.amin(LA[~zdex]), LX)
+
+              # LU factors of the column systems (Fortran ordered as LAPACK returns them,
+              # no copies in the solves) and the unmodified terrain w rows
+              self.LUB = []
+              self.RWB = np.empty((NX, 4 * NZ), dtype=np.complex128)
+              for mm in range(0, NX, fms.FOURIER_BATCH):
+                     AM = fms.computeFourierModeMatrices(LX[mm:mm+fms.FOURIER_BATCH], COEFS, DDZ, \
+                                                         PHYS[0], PHYS[6], applyBC=False)
+                     self.RWB[mm:mm+fms.FOURIER_BATCH] = AM[:,NZ,:]
+                     fms.setBoundaryRowsW(AM, NZ)
+                     self.LUB += [dsl.lu_factor(AB, check_finite=False) for AB in AM]
+
+              N = self.lmsDOF + len(sysDex)
+              super().__init__(dtype=np.dtype(np.float64), shape=(N, N))
+
+       def _matvec(self, r):
+              r = np.ravel(r)
+              NX = self.NX
+              NZ = self.NZ
+
+              # Fields (variable, column, level) with zero on the removed BC DOF
+              q = np.zeros(4 * self.OPS)
+              q[self.sysDex] = r[self.lmsDOF:]
+              Q = np.reshape(q, (4, NX, NZ))
+              rwb = np.array(Q[1,:,0])
+              Q[1,:,0] = r[0:self.lmsDOF]
+
+              # Eigen coefficients of DDX along x (solve with VX) and the column solves
+              QH = np.reshape(np.transpose(Q, (1, 0, 2)), (NX, 4 * NZ))
+              QH = dsl.lu_solve(self.LUVX, QH.astype(np.complex128), check_finite=False)
+              YH = np.empty((NX, 4 * NZ), dtype=np.complex128)
+              for mm in range(NX):
+                     YH[mm] = dsl.lu_solve(self.LUB[mm], QH[mm], check_finite=False)
+
+              # Lagrange multipliers from the residual of the terrain w rows
+              lms = rwb - np.real(self.VX.dot(np.sum(self.RWB * YH, axis=1)))
+
+              Y = np.real(np.matmul(self.VX, np.transpose(np.reshape(YH, (NX, 4, NZ)), (1, 0, 2))))
+
+              return np.concatenate((lms, np.reshape(Y, (4 * self.OPS,))[self.sysDex]))
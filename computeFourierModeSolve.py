@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 15:36:52 2026
+
+Linear static solution of the classical (LogP, LogTheta) equations mode by
+mode in the horizontal, as in the MATLAB Euler2DTerrainFollowingSpectralEllipticFFT.
+On the periodic Fourier grid with a horizontally uniform background the
+Fourier modes decouple, so the 4 * OPS system reduces to NX+1 independent
+4 * NZ column systems (one per real FFT mode) that are solved as batches.
+
+The background and Rayleigh coefficients are taken per level from the far
+field (flat terrain) column and the terrain enters only through the lower
+boundary condition on w (linear mountain wave theory). The horizontal
+derivative of each mode is the modified wavenumber of the 1D operator DDX
+(its Rayleigh quotient on the discrete Fourier mode, the exact eigenvalue
+for a periodic/circulant DDX) and the vertical one is DDZ_1D. By default
+DDX is the spectral DDX_1D of the static residual (modified wavenumbers
+i * k). The 'classical' linearization of the full solvers uses the cubic
+spline operators instead, whose modified wavenumbers drop to 0.1 * k at
+the highest modes, so the two linear solutions differ at short scales.
+
+The mean mode has no horizontal derivative and its column system is
+singular below the Rayleigh layer (the mean wind and the hydrostatic split
+of p and theta are free without damping). It is solved explicitly in the
+least squares (minimum norm) sense and the part of its forcing that is not
+resolved is reported. Other modes with a zero modified wavenumber (the
+Nyquist mode of the spectral DDX on an even grid) are grid scale modes the
+derivative does not see and are set to zero.
+
+@author: TempestGuerra
+"""
+
+import os
+import numpy as np
+import scipy.fft as sfft
+from concurrent.futures import ThreadPoolExecutor
+
+# Fourier modes per batched solve (bounds the memory of the mode matrices)
+FOURIER_BATCH = 32
+# Modified wavenumbers below this fraction of the largest are zero (no mode solve)
+FOURIER_ZERO_K = 1.0E-12
+# Relative singular value cutoff of the least squares mean mode solve (the singular
+# values below come from the vanishing Rayleigh coefficients under the layer)
+FOURIER_RCOND = 1.0E-9
+
+# Modified wavenumbers (eigenvalues) of DDX on the real FFT modes of its NX+1 points
+# (real part of DDX as in the assembled operators)
+def computeModifiedWavenumbers(DDX):
+       DDX = DDX.real
+       NX = DDX.shape[0]
+       jdex = np.arange(NX)
+       EM = np.exp(2j * np.pi * np.outer(jdex, np.arange(NX // 2 + 1)) / NX)
+
+       return np.sum(np.conj(EM) * DDX.dot(EM), axis=0) / NX
+
+# Column coefficients of the classical operator from the far field column
+# (layerMean: Rayleigh coefficients averaged over columns to keep the lateral layers)
+def computeFourierModeCoefficients(DIMS, REFS, REFG, ROPS, layerMean=False):
+       NX = DIMS[3] + 1
+       NZ = DIMS[4]
+
+       # Column with the lowest terrain (ZTL there is the reference grid)
+       cc = np.argmin(np.abs(REFS[5][0,:]))
+       cdex = np.arange(cc * NZ, (cc + 1) * NZ)
+
+       COEFS = {'U' : REFS[8][cdex], 'POR' : REFS[9][0][cdex], \
+                'DUDZ' : REFG[2][cdex,0], 'DLPDZ' : REFG[2][cdex,2], \
+                'DLPTDZ' : REFG[2][cdex,3], 'DLTDZ' : REFG[1][cdex,0]}
+
+       # Rayleigh layers at the top only (lateral layers do not fit a periodic domain)
+       if layerMean:
+              COEFS['RL'] = [np.mean(np.reshape(RO.diagonal(), (NZ, NX), order='F'), axis=1) for RO in ROPS]
+       else:
+              COEFS['RL'] = [np.amin(np.reshape(RO.diagonal(), (NZ, NX), order='F'), axis=1) for RO in ROPS]
+
+       return COEFS
+
+# Terrain and top boundary conditions on w (Dirichlet rows of the mode matrices)
+def setBoundaryRowsW(AM, NZ):
+       for row in [NZ, 2*NZ - 1]:
+              AM[:,row,:] = 0.0
+              AM[:,row,row] = 1.0
+
+# Batch of mode matrices (variables in blocks of NZ) for the eigenvalues ikx of the
+# horizontal derivative (modified wavenumbers), with the top and bottom w rows
+# replaced by Dirichlet conditions
+def computeFourierModeMatrices(ikx, COEFS, DDZ, gc, gam, applyBC=True):
+       NZ = DDZ.shape[0]
+       NB = len(ikx)
+       idx = np.arange(NZ)
+       ik = ikx[:,np.newaxis]
+       ws = slice(NZ, 2*NZ)
+       ps = slice(2*NZ, 3*NZ)
+
+       AM = np.zeros((NB, 4 * NZ, 4 * NZ), dtype=np.complex128)
+       # Advection and Rayleigh damping on the diagonal blocks
+       for vv in range(4):
+              AM[:,vv*NZ + idx,vv*NZ + idx] = ik * COEFS['U'] + COEFS['RL'][vv]
+
+       # Horizontal momentum
+       AM[:,idx,NZ + idx] += COEFS['DUDZ']
+       AM[:,idx,2*NZ + idx] += ik * COEFS['POR']
+       # Vertical momentum
+       AM[:,ws,ps] += COEFS['POR'][:,np.newaxis] * DDZ
+       AM[:,NZ + idx,2*NZ + idx] += COEFS['POR'] * COEFS['DLTDZ']
+       AM[:,NZ + idx,3*NZ + idx] -= gc
+       # Log-P equation
+       AM[:,2*NZ + idx,idx] += gam * ik
+       AM[:,ps,ws] += gam * DDZ
+       AM[:,2*NZ + idx,NZ + idx] += COEFS['DLPDZ']
+       # Log-Theta equation
+       AM[:,3*NZ + idx,NZ + idx] += COEFS['DLPTDZ']
+
+       if applyBC:
+              setBoundaryRowsW(AM, NZ)
+
+       return AM
+
+# Solution of the classical linear system for the forcing RHS (4 * OPS) with
+# bottom vertical velocity wBot (NX+1), returned in the full state ordering.
+# DDX is the 1D horizontal derivative of the modes (DDX_1D in REFS if None)
+def computeFourierModeSolve(DIMS, PHYS, REFS, REFG, ROPS, RHS, wBot, DDX=None, nworkers=None):
+       if nworkers is None:
+              nworkers = os.cpu_count()
+       if DDX is None:
+              DDX = REFS[2]
+
+       NX = DIMS[3] + 1
+       NZ = DIMS[4]
+       gc = PHYS[0]
+       gam = PHYS[6]
+       COEFS = computeFourierModeCoefficients(DIMS, REFS, REFG, ROPS)
+
+       # Eigenvalues of the horizontal derivative on the real FFT modes
+       ikx = computeModifiedWavenumbers(DDX)
+       NM = len(ikx)
+
+       # Forcing (variable, level, mode) and boundary values
+       FH = sfft.rfft(np.reshape(RHS, (4, NX, NZ)), axis=1)
+       FH = np.reshape(np.transpose(FH, (1, 0, 2)), (NM, 4 * NZ))
+       FH[:,NZ] = sfft.rfft(wBot)
+       FH[:,2*NZ - 1] = 0.0
+
+       # Modes without a horizontal derivative (mean and Nyquist) are singular
+       zeroK = np.abs(ikx) <= FOURIER_ZERO_K * np.amax(np.abs(ikx))
+       zeroK[0] = True
+       modes = np.nonzero(~zeroK)[0]
+       batches = [modes[mm:mm+FOURIER_BATCH] for mm in range(0, len(modes), FOURIER_BATCH)]
+
+       QH = np.zeros((NM, 4 * NZ), dtype=np.complex128)
+       def solveBatch(mdex):
+              AM = computeFourierModeMatrices(ikx[mdex], COEFS, REFS[3], gc, gam)
+              QH[mdex,:] = np.linalg.solve(AM, FH[mdex,:,np.newaxis])[:,:,0]
+
+       # Minimum norm solution of the mean mode (the unresolved forcing is reported
+       # relative to the total forcing), the other singular modes stay zero
+       AM = computeFourierModeMatrices(np.zeros(1), COEFS, REFS[3], gc, gam)[0]
+       QH[0,:] = np.linalg.lstsq(AM, FH[0,:], rcond=FOURIER_RCOND)[0]
+       fnorm = np.linalg.norm(FH)
+       if fnorm > 0.0:
+              print('Fourier mean mode least squares residual: %10.4E' % \
+                    (np.linalg.norm(AM.dot(QH[0,:]) - FH[0,:]) / fnorm))
+
+       # Batched LAPACK solves release the GIL
+       with ThreadPoolExecutor(max_workers=nworkers) as pool:
+              list(pool.map(solveBatch, batches))
+       print('Solve Fourier mode column systems: ', len(modes), ' in batches: ', len(batches), \
+             ' zero modes: ', np.count_nonzero(zeroK[1:]))
+
+       # Back to grid space in the full state ordering (fields are NZ by NX in F order)
+       QH = np.transpose(np.reshape(QH, (NM, 4, NZ)), (1, 0, 2))
+       DQ = sfft.irfft(QH, n=NX, axis=1)
+
+       return np.reshape(DQ, (4 * NX * NZ,))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:12:08 2026
+
+Hierarchical off diagonal low rank (HODLR) representation of a square
+matrix with a compressed direct factorization and solve. The diagonal is
+split recursively down to dense leaves and each off diagonal block is kept
+as U * V^T, truncated at a relative tolerance by a randomized SVD that
+streams the source in column chunks (sparse matrix or memory mapped array).
+Storage grows like O(N r log N) for off diagonal ranks r.
+
+The factorization applies the Sherman-Morrison-Woodbury formula level by
+level so that only the small coupling systems of each node are factored.
+A factored matrix is stored as flat value and pivot files with a small
+pickled tree of offsets, so that processes share it by memory maps.
+
+@author: TempestGuerra
+"""
+
+import pickle
+import numpy as np
+import scipy.sparse as sps
+import scipy.linalg as dsl
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+# Default leaf size (dense LU below this) and memory for a streamed column chunk
+HODLR_LEAF_SIZE = 256
+HODLR_CHUNK_BYTES = 2.5E8
+
+# Block access (index arrays) for sparse matrices and dense/mapped arrays
+class BlockSource:
+
+       def __init__(self, MM):
+              self.sparse = sps.issparse(MM)
+              self.N = MM.shape[0]
+              self.MM = sps.csr_matrix(MM) if self.sparse else MM
+
+       def __call__(self, rows, cols):
+              if self.sparse:
+                     return self.MM[rows,:][:,cols].toarray()
+              else:
+                     # Column gathers are contiguous on Fortran ordered memory maps
+                     return np.asarray(self.MM[:,cols])[rows,:]
+
+       # Rows read from the source per column of a block with M rows
+       def readRows(self, M):
+              return M if self.sparse else self.N
+
+def makeBlockSource(MM):
+       return BlockSource(MM)
+
+# Bandwidth reducing order of a sparsity pattern (keeps near neighbors together)
+def computeLocalityOrder(MM):
+       MM = sps.csr_matrix(MM)
+       PM = abs(MM) + abs(MM.T)
+       return reverse_cuthill_mckee(PM.tocsr(), symmetric_mode=True)
+
+# Truncated A = U * V^T of a block by a randomized range finder (adaptive rank)
+def computeLowRankBlock(getBlock, rows, cols, tol, rng):
+       M = len(rows)
+       N = len(cols)
+       # Chunks sized by the rows read (whole columns of dense sources)
+       NCC = max(1, int(HODLR_CHUNK_BYTES / (8 * getBlock.readRows(M))))
+       chunks = [cols[cc:cc+NCC] for cc in range(0, N, NCC)]
+       starts = range(0, N, NCC)
+
+       KR = min(16, M, N)
+       while True:
+              NS = min(KR + 8, M, N)
+              OM = rng.standard_normal((N, NS))
+
+              # Range of the block from Y = A * Omega
+              Y = np.zeros((M, NS))
+              for cc, cs in zip(chunks, starts):
+                     Y += getBlock(rows, cc).dot(OM[cs:cs+len(cc),:])
+              Q, R = dsl.qr(Y, mode='economic', check_finite=False)
+              del(Y)
+
+              # Project and truncate B = Q^T * A
+              B = np.empty((NS, N))
+              for cc, cs in zip(chunks, starts):
+                     B[:,cs:cs+len(cc)] = Q.T.dot(getBlock(rows, cc))
+              UB, S, VT = dsl.svd(B, full_matrices=False, check_finite=False)
+              del(B)
+
+              if len(S) == 0 or S[0] == 0.0:
+                     return np.zeros((M, 0)), np.zeros((N, 0))
+
+              rank = np.count_nonzero(S > tol * S[0])
+              # Accept when the samples resolve the tail or the block is full
+              if rank < KR or NS == min(M, N):
+                     U = Q.dot(UB[:,0:rank] * S[0:rank])
+                     V = VT[0:rank,:].T.copy()
+                     return U, V
+
+              KR = min(2 * KR, min(M, N))
+
+class HODLRMatrix:
+
+       # getBlock (BlockSource) returns dense blocks of the N x N source (not stored),
+       # groups (in perm order) are labels of unknowns the splits keep together
+       def __init__(self, getBlock, N, tol, perm=None, groups=None, leafSize=HODLR_LEAF_SIZE):
+              if perm is None:
+                     perm = np.arange(N)
+
+              self.N = N
+              self.tol = tol
+              self.perm = np.asarray(perm)
+              self.leafSize = leafSize
+              self.factored = False
+
+              rng = np.random.default_rng(1)
+              self.root = self.buildNode(getBlock, 0, N, groups, rng)
+
+       # Middle of the range or the nearest boundary between groups (None for a leaf)
+       def computeSplit(self, r0, r1, groups):
+              if r1 - r0 <= self.leafSize:
+                     return None
+
+              mid = r0 + (r1 - r0) // 2
+              if groups is None:
+                     return mid
+
+              bounds = r0 + 1 + np.nonzero(groups[r0+1:r1] != groups[r0:r1-1])[0]
+              if len(bounds) == 0:
+                     return None
+
+              return bounds[np.argmin(np.abs(bounds - mid))]
+
+       def buildNode(self, getBlock, r0, r1, groups, rng):
+              node = {'r0' : r0, 'r1' : r1}
+              mid = self.computeSplit(r0, r1, groups)
+              if mid is None:
+                     dex = self.perm[r0:r1]
+                     node['D'] = getBlock(dex, dex)
+                     return node
+
+              dex1 = self.perm[r0:mid]
+              dex2 = self.perm[mid:r1]
+              node['U12'], node['V12'] = computeLowRankBlock(getBlock, dex1, dex2, self.tol, rng)
+              node['U21'], node['V21'] = computeLowRankBlock(getBlock, dex2, dex1, self.tol, rng)
+              node['c1'] = self.buildNode(getBlock, r0, mid, groups, rng)
+              node['c2'] = self.buildNode(getBlock, mid, r1, groups, rng)
+
+              return node
+
+       # Compressed factorization (drops the U factors and the dense leaves)
+       def factor(self):
+              self.factorNode(self.root)
+              self.factored = True
+
+              return self
+
+       # Singular (or non finite) LU factors of a leaf or a coupling system
+       def checkFactor(self, LU, node, name):
+              pivots = np.diag(LU[0])
+              if not np.all(np.isfinite(pivots)) or np.any(pivots == 0.0):
+                     raise np.linalg.LinAlgError('HODLR ' + name + ' of rows %d to %d is singular' % \
+                                                 (node['r0'], node['r1']))
+
+       def factorNode(self, node):
+              if 'D' in node:
+                     node['LU'] = dsl.lu_factor(node.pop('D'), overwrite_a=True, check_finite=False)
+                     self.checkFactor(node['LU'], node, 'leaf')
+                     return
+
+              self.factorNode(node['c1'])
+              self.factorNode(node['c2'])
+
+              # A = diag(A11, A22) * (I + W * Z^T), W = diag(Y1, Y2)
+              node['Y1'] = self.solveNode(node['c1'], node.pop('U12'))
+              node['Y2'] = self.solveNode(node['c2'], node.pop('U21'))
+              R1 = node['Y1'].shape[1]
+              R2 = node['Y2'].shape[1]
+              if R1 + R2 > 0:
+                     K = np.eye(R1 + R2)
+                     K[0:R1,R1:] += node['V12'].T.dot(node['Y2'])
+                     K[R1:,0:R1] += node['V21'].T.dot(node['Y1'])
+                     node['LUK'] = dsl.lu_factor(K, overwrite_a=True, check_finite=False)
+                     self.checkFactor(node['LUK'], node, 'coupling system')
+
+       def solveNode(self, node, b):
+              if 'LU' in node:
+                     return dsl.lu_solve(node['LU'], b, check_finite=False)
+
+              mid = node['c1']['r1'] - node['r0']
+              y1 = self.solveNode(node['c1'], b[0:mid])
+              y2 = self.solveNode(node['c2'], b[mid:])
+
+              # Woodbury correction (I + W * Z^T)^-1 = I - W * K^-1 * Z^T
+              if 'LUK' in node:
+                     R1 = node['Y1'].shape[1]
+                     z = dsl.lu_solve(node['LUK'], np.concatenate((node['V12'].T.dot(y2), \
+                                                                    node['V21'].T.dot(y1))), check_finite=False)
+                     y1 -= node['Y1'].dot(z[0:R1])
+                     y2 -= node['Y2'].dot(z[R1:])
+
+              return np.concatenate((y1, y2))
+
+       # x = A^-1 * b for vectors or column blocks (original ordering)
+       def solve(self, b):
+              if not self.factored:
+                     self.factor()
+
+              x = np.empty(b.shape)
+              x[self.perm] = self.solveNode(self.root, b[self.perm])
+
+              return x
+
+       # Largest off diagonal rank and stored bytes
+       def getStats(self):
+              stats = {'maxRank' : 0, 'bytes' : 0}
+              nodes = [self.root]
+              while len(nodes) > 0:
+                     node = nodes.pop()
+                     for key, val in node.items():
+                            if isinstance(val, np.ndarray):
+                                   stats['bytes'] += val.nbytes
+                            elif isinstance(val, tuple):
+                                   stats['bytes'] += sum([vv.nbytes for vv in val])
+                            elif isinstance(val, dict):
+                                   nodes.append(val)
+                     for key in ['V12', 'V21']:
+                            if key in node:
+                                   stats['maxRank'] = max(stats['maxRank'], node[key].shape[1])
+
+              return stats
+
+# Location of a stored array in the flat value (float) or pivot (int) file
+class MappedArray:
+
+       def __init__(self, kind, offset, shape):
+              self.kind = kind
+              self.offset = offset
+              self.shape = shape
+
+def encodeNode(val, arrays, sizes):
+       if isinstance(val, np.ndarray):
+              kind = 'piv' if np.issubdtype(val.dtype, np.integer) else 'val'
+              arrays.append((kind, sizes[kind], val))
+              sizes[kind] += val.size
+              return MappedArray(kind, arrays[-1][1], val.shape)
+       elif isinstance(val, tuple):
+              return tuple([encodeNode(vv, arrays, sizes) for vv in val])
+       elif isinstance(val, dict):
+              return {key : encodeNode(vv, arrays, sizes) for key, vv in val.items()}
+       else:
+              return val
+
+def decodeNode(val, flat):
+       if isinstance(val, MappedArray):
+              size = int(np.prod(val.shape))
+              # Fortran ordered views (no copies in the LAPACK solves)
+              return flat[val.kind][val.offset:val.offset+size].reshape(val.shape, order='F')
+       elif isinstance(val, tuple):
+              return tuple([decodeNode(vv, flat) for vv in val])
+       elif isinstance(val, dict):
+              return {key : decodeNode(vv, flat) for key, vv in val.items()}
+       else:
+              return val
+
+# Write the factors of HM to baseName + 'Val.npy', 'Piv.npy' and '.pkl'
+def saveHODLR(HM, baseName):
+       if not HM.factored:
+              HM.factor()
+
+       arrays = []
+       sizes = {'val' : 0, 'piv' : 0}
+       tree = encodeNode(HM.root, arrays, sizes)
+
+       flat = {'val' : np.lib.format.open_memmap(baseName + 'Val.npy', mode='w+', \
+                                                 dtype=np.float64, shape=(max(sizes['val'], 1),)), \
+               'piv' : np.lib.format.open_memmap(baseName + 'Piv.npy', mode='w+', \
+                                                 dtype=np.int32, shape=(max(sizes['piv'], 1),))}
+       for kind, offset, val in arrays:
+              flat[kind][offset:offset+val.size] = val.ravel(order='F')
+       for kind in flat:
+              flat[kind].flush()
+       del(flat)
+
+       with open(baseName + '.pkl', 'wb') as hf:
+              pickle.dump({'N' : HM.N, 'tol' : HM.tol, 'perm' : HM.perm, \
+                           'leafSize' : HM.leafSize, 'root' : tree}, hf, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Factored HODLR matrix on a read only memory map of the values from saveHODLR
+# (the O(N) pivots are read in, lu_solve does not take read only pivots)
+def loadHODLR(baseName):
+       with open(baseName + '.pkl', 'rb') as hf:
+              stored = pickle.load(hf)
+
+       flat = {'val' : np.load(baseName + 'Val.npy', mmap_mode='r'), \
+               'piv' : np.load(baseName + 'Piv.npy')}
+
+       HM = HODLRMatrix.__new__(HODLRMatrix)
+       HM.N = stored['N']
+       HM.tol = stored['tol']
+       HM.perm = stored['perm']
+       HM.leafSize = stored['leafSize']
+       HM.root = decodeNode(stored['root'], flat)
+       HM.factored = True
+
+       return HM
@@ -7,44 +7,58 @@ Created on Tue Jul 30 09:47:32 2019
 """
 
 import numpy as np
+import math as mt
 #import matplotlib.pyplot as plt
 import HerfunChebNodesWeights as hcnw
 
-def computeHorizontalInterp(DIMS, NXI, FLD, HF_TRANS):
-       # Get DIMS data
+# Horizontal evaluation matrix (target points X native points), transform included
+# xint: number of uniform points over the native grid or physical x positions
+def computeHorizontalInterpMatrix(DIMS, xint, HF_TRANS, HermCheb):
+       L1 = DIMS[0]
+       L2 = DIMS[1]
        NX = DIMS[3] + 1
        
+       # Native reference grid
+       if HermCheb:
+              xh, dummy = hcnw.hefunclb(NX-1)
+              xmax = np.amax(xh)
+              # Physical to reference map of computeGrid
+              xscale = xmax / (0.5 * abs(L2 - L1))
+       
+       if np.isscalar(xint):
+              if HermCheb:
+                     xi = np.linspace(-xmax, xmax, num=xint, endpoint=True)
+              else:
+                     xi = np.linspace(L1, L2, num=xint, endpoint=True)
+       else:
+              xi = np.array(xint, dtype=float)
+              if HermCheb:
+                     xi *= xscale
+       
+       if HermCheb:
+              # Backward transform to new grid
+              HFM = hcnw.hefuncm(NX-1, xi, True)
+              
+              return HFM.dot(HF_TRANS)
+       else:
+              # Fourier basis with the period and spacing of the derivative
+              # operator: node jj sits at jj * L / NX in the transform
+              kxf = (2*mt.pi/abs(L2 - L1)) * np.fft.fftfreq(NX) * NX
+              xs = (xi - L1) * (NX - 1) / NX
+              FIM = 1.0 / NX * np.exp(1j * np.outer(xs, kxf))
+              
+              return np.real(FIM.dot(HF_TRANS))
+
+def computeHorizontalInterp(DIMS, NXI, FLD, HF_TRANS):
        # Check
        if NXI <= 0:
               print('ERROR: Invalid number of points in new grid! ', NXI)
               return FLD
        
-       # Compute the new horizontal reference grid (linear space)
-       xh, dummy = hcnw.hefunclb(NX)
-       xmax = np.amax(xh)
-       xmin = np.amin(xh)
-       xi = np.linspace(xmin, xmax, num=NXI, endpoint=True)
-       
-       # Compute coefficients for the height field
-       #hcoeffs = np.matmul(HF_TRANS, ZTL.T)
-       # Compute coefficients for the variable field
-       fcoeffs = np.matmul(HF_TRANS, FLD.T)
-       
-       # Compute backward transform to new grid
-       HFM = hcnw.hefuncm(NX-1, xi, True)
-       #HFM_native = hcnw.hefuncm(NX-1, xh, True)
-       
-       #plt.figure()
-       #plt.plot(xh, HFM_native[0,:])
-       #plt.figure()
-       #plt.plot(xi, HFM[0,:])
-       
-       # Apply the backward transforms
-       #ZTLI = np.matmul(HFM.T, hcoeffs)
-       FLDI = np.matmul(HFM, fcoeffs)
+       # Evaluation matrix on the new uniform grid (over the native nodes)
+       HIM = computeHorizontalInterpMatrix(DIMS, NXI, HF_TRANS, True)
        
-       # Make a new XLI meshgrid
-       #varray = np.array(range(NZI))
-       #XLI, dummy = np.meshgrid(L2 / xmax * xi, varray)
+       # Apply the transforms to all rows
+       FLDI = np.matmul(HIM, FLD.T)
        
-       return FLDI.T
\ No newline at end of file
+       return FLDI.T
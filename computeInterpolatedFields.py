@@ -7,8 +7,59 @@ Created on Wed Oct  2 10:20:43 2019
 """
 
 import numpy as np
-from computeColumnInterp import computeColumnInterp
-from computeHorizontalInterp import computeHorizontalInterp
+import HerfunChebNodesWeights as hcnw
+from computeColumnInterp import getColumnInterpolator, hashArray
+from computeHorizontalInterp import computeHorizontalInterpMatrix
+
+# Regridding built once per native grid and target: Chebyshev columns and
+# Hermite (or Fourier) rows as evaluation matrices applied with two GEMMs
+class SpectralRegridder:
+       
+       # xint: NXI uniform points or physical x positions
+       # zint: NZI uniform TF levels or normalized TF heights in [0 1]
+       def __init__(self, DIMS, CH_TRANS, HF_TRANS, xint, zint, HermCheb=True):
+              NZ = DIMS[4]
+              
+              if np.isscalar(zint):
+                     self.MZ = getColumnInterpolator(DIMS, None, zint, None, CH_TRANS, 'TerrainFollowingCheb2Lin').EVM
+              else:
+                     xi = 2.0 * np.array(zint, dtype=float) - 1.0
+                     self.MZ = (hcnw.chebpolym(NZ-1, -xi)).dot(CH_TRANS)
+              
+              self.MX = computeHorizontalInterpMatrix(DIMS, xint, HF_TRANS, HermCheb)
+              self.MXT = np.ascontiguousarray(self.MX.T)
+              self.shape = (self.MZ.shape[0], self.MX.shape[0])
+              
+       # Fields (..., NZ, NX+1) stacked over variables/snapshots or a list of fields
+       def regrid(self, FLDS):
+              if isinstance(FLDS, (list, tuple)):
+                     return list(self.regrid(np.stack(FLDS, axis=0)))
+              
+              FLDI = np.matmul(self.MZ, FLDS)
+              FLDI = np.matmul(FLDI, self.MXT)
+              
+              return FLDI
+
+regridCache = {}
+regridCacheSize = 4
+
+def keyTarget(tint):
+       if np.isscalar(tint):
+              return int(tint)
+       else:
+              return hashArray(np.array(tint, dtype=float))
+
+# Get the regridder for this (native grid, target) from the cache or make it
+def getSpectralRegridder(DIMS, CH_TRANS, HF_TRANS, xint, zint, HermCheb=True):
+       key = (DIMS[0], DIMS[1], DIMS[3], DIMS[4], HermCheb, keyTarget(xint), keyTarget(zint), \
+              hashArray(CH_TRANS), hashArray(HF_TRANS))
+       if key not in regridCache:
+              if len(regridCache) >= regridCacheSize:
+                     # Drop the oldest regridder
+                     regridCache.pop(next(iter(regridCache)))
+              regridCache[key] = SpectralRegridder(DIMS, CH_TRANS, HF_TRANS, xint, zint, HermCheb)
+       
+       return regridCache[key]
 
 def computeInterpolatedFields(DIMS, ZTL, sol, NX, NZ, NXI, NZI, udex, wdex, pdex, tdex, CH_TRANS, HF_TRANS):
        
@@ -19,19 +70,10 @@ def computeInterpolatedFields(DIMS, ZTL, sol, NX, NZ, NXI, NZI, udex, wdex, pdex
        txz = np.reshape(sol[tdex], (NZ, NX+1), order='F')
        print('Recover solution on native grid: DONE!')
        
-       #% Interpolate columns to a finer grid for plotting
-       uxzint = computeColumnInterp(DIMS, None, None, NZI, ZTL, uxz, CH_TRANS, 'TerrainFollowingCheb2Lin')
-       wxzint = computeColumnInterp(DIMS, None, None, NZI, ZTL, wxz, CH_TRANS, 'TerrainFollowingCheb2Lin')
-       pxzint = computeColumnInterp(DIMS, None, None, NZI, ZTL, pxz, CH_TRANS, 'TerrainFollowingCheb2Lin')
-       txzint = computeColumnInterp(DIMS, None, None, NZI, ZTL, txz, CH_TRANS, 'TerrainFollowingCheb2Lin')
-       print('Interpolate columns to finer grid: DONE!')
-       
-       #% Interpolate rows to a finer grid for plotting
-       uxzint = computeHorizontalInterp(DIMS, NXI, uxzint, HF_TRANS)
-       wxzint = computeHorizontalInterp(DIMS, NXI, wxzint, HF_TRANS)
-       pxzint = computeHorizontalInterp(DIMS, NXI, pxzint, HF_TRANS)
-       txzint = computeHorizontalInterp(DIMS, NXI, txzint, HF_TRANS)
-       print('Interpolate columns to finer grid: DONE!')
+       #% Interpolate columns and rows to a finer grid for plotting
+       REGRID = getSpectralRegridder(DIMS, CH_TRANS, HF_TRANS, NXI, NZI)
+       uxzint, wxzint, pxzint, txzint = REGRID.regrid([uxz, wxz, pxz, txz])
+       print('Interpolate to finer grid: DONE!')
        
        native = [uxz, wxz, pxz, txz]
        interp = [uxzint, wxzint, pxzint, txzint]
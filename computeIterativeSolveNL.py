@@ -3,246 +3,221 @@
 """
 Created on Tue Oct  1 17:05:20 2019
 
+Inexact Newton-Krylov solution of the static (steady) nonlinear system on
+the BC reduced unknowns [LMS, q[sysDex]]. The residual is the one of the
+direct Newton steps of runModel (computeStaticResidualLogPLogT and the
+terrain constraint), so all the static solvers converge to the same state.
+Jacobian-vector products are matrix free (JacobianOperatorLogPLogT at the
+current iterate with the exact pressure gradient terms, which cuts the
+Newton steps), linear tolerances follow Eisenstat-Walker (choice 2) and
+GMRES is right preconditioned by any fixed approximate inverse (e.g. the
+initial Newton Jacobian or the classical linearization factored once).
+
+The chord (modified Newton) solver instead reuses one sparse LU of the
+assembled Jacobian for direct steps and refactors only when the residual
+reduction rate degrades past CHORD_RATE.
+
 @author: jorge.guerra
 """
+import time
 import numpy as np
-import scipy.linalg as dsl
-import matplotlib.pyplot as plt
-import scipy.optimize as opt
 import scipy.sparse.linalg as spl
 import computeEulerEquationsLogPLogT as tendency
-from computeResidualViscCoeffs import computeResidualViscCoeffs
-
-def pause():
-    input("Press the <ENTER> key to continue...")
-
-def computeIterativeSolveNL(PHYS, REFS, REFG, DX, DZ, SOLT, INIT, udex, wdex, pdex, tdex, botdex, topdex, wbdex, sysDex, DynSGS):
-       dHdX = REFS[6]
-       lastSol = SOLT[:,0]
-       
-       def computeRHSUpdate(sol):
-              # Update the BC
-              sol[wbdex] = dHdX * (INIT[botdex] + sol[botdex])
-              # Function evaluation
-              fields, U, RdT = tendency.computePrepareFields(PHYS, REFS, sol, INIT, udex, wdex, pdex, tdex)
-              rhs = tendency.computeEulerEquationsLogPLogT_NL(PHYS, REFS, REFG, fields, U, RdT)
-              rhs += tendency.computeRayleighTendency(REFG, fields)
-              
-              if DynSGS:
-                     RESCF = computeResidualViscCoeffs(sol, rhs, DX, DZ, udex, wdex, pdex, tdex)
-                     rhs += tendency.computeDynSGSTendency(RESCF, REFS, fields, udex, wdex, pdex, tdex, botdex, topdex)
-       
-              return rhs
-       
-       def computeJacVecUpdate(sol, vec):
-              # Prepare the Jacobian
-              fields, U, RdT = tendency.computePrepareFields(PHYS, REFS, sol, INIT, udex, wdex, pdex, tdex)
-              DOPS = tendency.computeJacobianMatrixLogPLogT(PHYS, REFS, REFG, fields, U, RdT, botdex, topdex)
-              # Compute the product
-              jv = tendency.computeJacobianVectorProduct(DOPS, REFG, vec, udex, wdex, pdex, tdex)
-       
-              return jv
-       
-       # Solve for nonlinear equilibrium (default krylov)
-       #'''
-       jac_options = {'method':'gmres','inner_maxiter':1000,'outer_k':3}
-       sol, info = opt.nonlin.nonlin_solve(computeRHSUpdate, lastSol, 
-                                  jacobian=opt.nonlin.KrylovJacobian(**jac_options),
-                                  iter=5, verbose=True,
-                                  maxiter=100,
-                                  line_search='armijo',
-                                  full_output=True,
-                                  raise_exception=False)
-       
-       # Solve for nonlinear equilibrium (modified direct krylov)
-       '''
-       jac_options = {'jdv':computeJacVecUpdate, \
-                      'method':'gmres', \
-                      'inner_maxiter':2000, \
-                      'outer_k':2}
-       sol, info = opt.nonlin.nonlin_solve(computeRHSUpdate, lastSol, 
-                                  jacobian=KrylovDirectJacobian(**jac_options),
-                                  iter=5, verbose=True,
-                                  maxiter=100,
-                                  line_search='armijo',
-                                  full_output=True,
-                                  raise_exception=False)
-       '''
-       print('NL solver exit on: ', info)
-       
-       return sol
-
-#------------------------------------------------------------------------------
-# Iterative/Krylov un-approximated Jacobians
-#------------------------------------------------------------------------------
-
-class KrylovDirectJacobian(opt.nonlin.Jacobian):
-    r"""
-    Find a root of a function, using Krylov approximation for inverse Jacobian.
-
-    This method is suitable for solving large-scale problems.
-
-    Parameters
-    ----------
-    %(params_basic)s
-    rdiff : float, optional
-        Relative step size to use in numerical differentiation.
-    method : {'lgmres', 'gmres', 'bicgstab', 'cgs', 'minres'} or function
-        Krylov method to use to approximate the Jacobian.
-        Can be a string, or a function implementing the same interface as
-        the iterative solvers in `scipy.sparse.linalg`.
-
-        The default is `scipy.sparse.linalg.lgmres`.
-    inner_M : LinearOperator or InverseJacobian
-        Preconditioner for the inner Krylov iteration.
-        Note that you can use also inverse Jacobians as (adaptive)
-        preconditioners. For example,
-
-        >>> from scipy.optimize.nonlin import BroydenFirst, KrylovJacobian
-        >>> from scipy.optimize.nonlin import InverseJacobian
-        >>> jac = BroydenFirst()
-        >>> kjac = KrylovJacobian(inner_M=InverseJacobian(jac))
-
-        If the preconditioner has a method named 'update', it will be called
-        as ``update(x, f)`` after each nonlinear step, with ``x`` giving
-        the current point, and ``f`` the current function value.
-    inner_tol, inner_maxiter, ...
-        Parameters to pass on to the \"inner\" Krylov solver.
-        See `scipy.sparse.linalg.gmres` for details.
-    outer_k : int, optional
-        Size of the subspace kept across LGMRES nonlinear iterations.
-        See `scipy.sparse.linalg.lgmres` for details.
-    %(params_extra)s
-
-    See Also
-    --------
-    scipy.sparse.linalg.gmres
-    scipy.sparse.linalg.lgmres
-
-    Notes
-    -----
-    This function implements a Newton-Krylov solver. The basic idea is
-    to compute the inverse of the Jacobian with an iterative Krylov
-    method. These methods require only evaluating the Jacobian-vector
-    products, which are NOT approximated by evaluated directly and
-    passed to the "matvec" member function.
-
-    Due to the use of iterative matrix inverses, these methods can
-    deal with large nonlinear problems.
-
-    SciPy's `scipy.sparse.linalg` module offers a selection of Krylov
-    solvers to choose from. The default here is `lgmres`, which is a
-    variant of restarted GMRES iteration that reuses some of the
-    information obtained in the previous Newton steps to invert
-    Jacobians in subsequent steps.
-
-    For a review on Newton-Krylov methods, see for example [1]_,
-    and for the LGMRES sparse inverse method, see [2]_.
-
-    References
-    ----------
-    .. [1] D.A. Knoll and D.E. Keyes, J. Comp. Phys. 193, 357 (2004).
-           :doi:`10.1016/j.jcp.2003.08.010`
-    .. [2] A.H. Baker and E.R. Jessup and T. Manteuffel,
-           SIAM J. Matrix Anal. Appl. 26, 962 (2005).
-           :doi:`10.1137/S0895479803422014`
-
-    """
-
-    def __init__(self, rdiff=None, jdv=None, method='lgmres', inner_maxiter=20,
-                 inner_M=None, outer_k=10, **kw):
-        self.rdiff = rdiff
-        self.jac_vec = jdv
-        self.preconditioner = inner_M
-        self.method = dict(
-            bicgstab = spl.bicgstab,
-            gmres = spl.gmres,
-            lgmres = spl.lgmres,
-            cgs = spl.cgs,
-            minres = spl.minres,
-            ).get(method, method)
-
-        self.method_kw = dict(maxiter=inner_maxiter, M=self.preconditioner)
-
-        if self.method is spl.gmres:
-            # Replace GMRES's outer iteration with Newton steps
-            self.method_kw['restrt'] = inner_maxiter
-            self.method_kw['maxiter'] = 1
-            self.method_kw.setdefault('atol', 0)
-        elif self.method is spl.gcrotmk:
-            self.method_kw.setdefault('atol', 0)
-        elif self.method is spl.lgmres:
-            self.method_kw['outer_k'] = outer_k
-            # Replace LGMRES's outer iteration with Newton steps
-            self.method_kw['maxiter'] = 1
-            # Carry LGMRES's `outer_v` vectors across nonlinear iterations
-            self.method_kw.setdefault('outer_v', [])
-            self.method_kw.setdefault('prepend_outer_v', True)
-            # But don't carry the corresponding Jacobian*v products, in case
-            # the Jacobian changes a lot in the nonlinear step
-            #
-            # XXX: some trust-region inspired ideas might be more efficient...
-            #      See eg. Brown & Saad. But needs to be implemented separately
-            #      since it's not an inexact Newton method.
-            self.method_kw.setdefault('store_outer_Av', False)
-            self.method_kw.setdefault('atol', 0)
-
-        for key, value in kw.items():
-            if not key.startswith('inner_'):
-                raise ValueError("Unknown parameter %s" % key)
-            self.method_kw[key[6:]] = value
-            
-    def _update_diff_step(self):
-        mx = abs(self.x0).max()
-        mf = abs(self.f0).max()
-        self.omega = self.rdiff * max(1, mx) / max(1, mf)
-
-    def matvec(self, v):
-        nv = dsl.norm(v)
-        if nv == 0:
-            return 0*v
-        # Compute the updated Jacobian-vector product
-        #r1 = self.jac_vec(self.x0, v)
-        sc = 0.5*self.omega / nv
-        #r = (self.func(self.x0 + sc*v) - self.f0) / sc
-        r2 = (self.func(self.x0 + sc*v) - self.func(self.x0 - sc*v)) / sc
-        '''
-        plt.figure(figsize=(12.0, 8.0))
-        varL = (int) (len(v) / 4)
-        udex = range(0, varL)
-        wdex = range(varL, 2*varL)
-        pdex = range(2*varL, 3*varL)
-        tdex = range(3*varL, len(v))
-        plt.plot(r1[tdex], 'k-'); #plt.xscale('log'); plt.yscale('linear'); #plt.ylim(1.0E-6, 1.0E-1)
-        plt.plot(r2[tdex], 'b:'); #plt.xscale('log'); plt.yscale('linear'); #plt.ylim(1.0E-6, 1.0E-1)
-        plt.show()
-        pause()
-        '''
-        r = r2
-        
-        if not np.all(np.isfinite(r)) and np.all(np.isfinite(v)):
-            raise ValueError('Function returned non-finite results')
-        return r
-
-    def solve(self, rhs, tol=0):
-        if 'tol' in self.method_kw:
-            sol, info = self.method(self.op, rhs, **self.method_kw)
-        else:
-            sol, info = self.method(self.op, rhs, tol=tol, **self.method_kw)
-        return sol
-
-    def update(self, x, f):
-        self.x0 = x
-        self.f0 = f
-        self._update_diff_step()
-
-    def setup(self, x, f, func):
-        opt.nonlin.Jacobian.setup(self, x, f, func)
-        self.x0 = x
-        self.f0 = f
-        self.op = spl.aslinearoperator(self)
-        
-        if self.rdiff is None:
-            self.rdiff = np.finfo(x.dtype).eps ** (1./2)
-            
-        self._update_diff_step()
\ No newline at end of file
+import computeColumnPreconditioner as cpc
+
+# Eisenstat-Walker choice 2 parameters and safeguards
+EW_GAMMA = 0.9
+EW_ALPHA = 2.0
+EW_ETA0 = 0.1
+EW_ETAMAX = 0.9
+
+# Backtracking (Armijo) on the residual norm
+LS_ARMIJO = 1.0E-4
+LS_MAXCUTS = 5
+
+# Chord steps refactor when ||F_k+1|| / ||F_k|| exceeds this rate
+CHORD_RATE = 0.5
+
+# Sparse LU of the global operator (same options as the full SuperLU solve)
+def computeSparseFactor(GOP):
+       opts = dict(Equil=True, IterRefine='DOUBLE')
+       return spl.splu(GOP.tocsc(), permc_spec='MMD_ATA', options=opts)
+
+# Preconditioner from a sparse approximate Jacobian factored once (SuperLU)
+def computeFactoredPreconditioner(GOP):
+       factor = computeSparseFactor(GOP)
+
+       return spl.LinearOperator(GOP.shape, matvec=factor.solve, dtype=np.dtype(np.float64))
+
+# Nonlinear static residual on [LMS, q[sysDex]] (right side of the Newton system,
+# the multipliers only enter through the Jacobian as in the direct Newton steps)
+class StaticResidualLogPLogT:
+
+       def __init__(self, PHYS, REFS, REFG, ROPS, INIT, dHdXB, udex, wdex, pdex, tdex, \
+                    ubdex, wbdex, sysDex, ebcDex, zeroDex, ExactBC):
+              self.PHYS = PHYS
+              self.REFS = REFS
+              self.REFG = REFG
+              self.ROPS = ROPS
+              self.INIT = INIT
+              self.dHdXB = dHdXB
+              self.vdex = (udex, wdex, pdex, tdex)
+              self.ubdex = ubdex
+              self.wbdex = wbdex
+              self.sysDex = sysDex
+              self.ebcDex = ebcDex
+              self.zeroDex = zeroDex
+              self.ExactBC = ExactBC
+
+       # Residual and the (matrix free) Jacobian at the state q
+       def computeResidual(self, q):
+              fields, U, W = tendency.computePrepareFields(self.REFS, q, self.INIT, *self.vdex)
+              RHS = tendency.computeStaticResidualLogPLogT(self.PHYS, self.REFS, self.REFG, fields, U, W, \
+                                                           self.ebcDex, self.zeroDex)
+
+              JOP = tendency.JacobianOperatorLogPLogT(self.PHYS, self.REFS, self.REFG, self.ROPS, np.array(fields), U, \
+                                                      self.sysDex, self.ubdex, self.dHdXB, self.ExactBC, exactPGF=True)
+
+              # Terrain constraint residual
+              dWBC = q[self.wbdex] - self.dHdXB * (self.INIT[self.ubdex] + q[self.ubdex])
+
+              return np.concatenate((-dWBC, RHS[self.sysDex])), JOP
+
+# Raises cpc.ConvergenceError when the line search fails or tol is not reached in maxiter
+def computeIterativeSolveNL(NLR, SOLT, LMS, PCOP, tol=1.0E-8, maxiter=20, restart=200, cycles=5):
+       sysDex = NLR.sysDex
+       q = np.array(SOLT[:,0])
+       lms = np.array(LMS)
+       lmsDOF = len(lms)
+
+       res, JOP = NLR.computeResidual(q)
+       rnorm0 = np.linalg.norm(res)
+       rnorm = rnorm0
+       eta = EW_ETA0
+       dsol = np.zeros(len(res))
+       print('Newton-Krylov initial residual: %10.4E' % rnorm0)
+
+       for nn in range(maxiter):
+              if rnorm <= tol * rnorm0:
+                     break
+
+              # Inexact Newton step with the exact Jacobian-vector products (the line search checks it)
+              step = cpc.solveKrylov(JOP, res, M=PCOP, method='gmres', tol=eta, restart=restart, maxiter=cycles, \
+                                     strict=False)
+
+              # Backtrack until sufficient decrease of the residual
+              lam = 1.0
+              for cc in range(LS_MAXCUTS + 1):
+                     qn = np.array(q)
+                     qn[sysDex] += lam * step[lmsDOF:]
+                     lmsn = lms + lam * step[0:lmsDOF]
+                     resn, JOPn = NLR.computeResidual(qn)
+                     rnormn = np.linalg.norm(resn)
+                     if rnormn <= (1.0 - LS_ARMIJO * lam) * rnorm:
+                            break
+                     lam *= 0.5
+              else:
+                     raise cpc.ConvergenceError('Newton-Krylov line search failed at iteration %d: ' % (nn+1) + \
+                                                'no sufficient decrease after %d cuts, residual: %10.4E' % \
+                                                (LS_MAXCUTS, rnorm / rnorm0))
+
+              dsol[lmsDOF:] += qn[sysDex] - q[sysDex]
+              dsol[0:lmsDOF] += lmsn - lms
+              q = qn; lms = lmsn; res = resn; JOP = JOPn
+
+              # Eisenstat-Walker forcing term (choice 2) with safeguards
+              etaLast = eta
+              eta = EW_GAMMA * (rnormn / rnorm)**EW_ALPHA
+              if EW_GAMMA * etaLast**EW_ALPHA > 0.1:
+                     eta = max(eta, EW_GAMMA * etaLast**EW_ALPHA)
+              eta = max(eta, 0.5 * tol * rnorm0 / rnormn)
+              eta = min(eta, EW_ETAMAX)
+              rnorm = rnormn
+
+              print('Newton-Krylov iteration: %d, step: %.4f, residual: %10.4E, next forcing: %10.4E' % \
+                    (nn+1, lam, rnorm / rnorm0, eta))
+
+       if rnorm > tol * rnorm0:
+              raise cpc.ConvergenceError('Newton-Krylov NOT converged after %d iterations, residual: %10.4E' % \
+                                         (maxiter, rnorm / rnorm0))
+
+       # Total change in [LMS, q[sysDex]]
+       return dsol
+
+# Chord (modified) Newton: direct steps with a reused factorization of the
+# assembled Jacobian, refactored at the current iterate on slow contraction.
+# The state converges to the direct Newton solution of runModel, the summed
+# multiplier steps (LMS) depend on the Jacobians along the way. Raises
+# cpc.ConvergenceError on a divergent step with fresh factors or when tol is
+# not reached in maxiter.
+def computeChordSolveNL(NLR, SOLT, LMS, JAC, LCU, tol=1.0E-8, maxiter=20, rateMax=CHORD_RATE):
+       sysDex = NLR.sysDex
+       q = np.array(SOLT[:,0])
+       lms = np.array(LMS)
+       lmsDOF = len(lms)
+
+       def computeFactor(JOP):
+              start = time.time()
+              GOP = JAC.assembleNewton(JOP.JCF, JOP.RDG, NLR.PHYS[6], LCU)
+              factor = computeSparseFactor(GOP)
+              del(GOP)
+              return factor, time.time() - start
+
+       res, JOP = NLR.computeResidual(q)
+       rnorm0 = np.linalg.norm(res)
+       rnorm = rnorm0
+       dsol = np.zeros(len(res))
+       print('Chord Newton initial residual: %10.4E' % rnorm0)
+
+       factor, ftime = computeFactor(JOP)
+       nfac = 1; fresh = True
+       print('Chord Newton factorization: %d, time: %.2f s' % (nfac, ftime))
+
+       for nn in range(maxiter):
+              if rnorm <= tol * rnorm0:
+                     break
+
+              start = time.time()
+              step = factor.solve(res)
+              qn = np.array(q)
+              qn[sysDex] += step[lmsDOF:]
+              lmsn = lms + step[0:lmsDOF]
+              resn, JOPn = NLR.computeResidual(qn)
+              rnormn = np.linalg.norm(resn)
+              rate = rnormn / rnorm
+
+              # Divergent step with the factors of the current iterate: reject it and stop
+              if rate > 1.0 and fresh:
+                     raise cpc.ConvergenceError('Chord Newton diverging at iteration %d with fresh factors, ' % (nn+1) + \
+                                                'rate: %.4f, residual: %10.4E' % (rate, rnorm / rnorm0))
+
+              # Stale factors that increase the residual: refactor here and redo the step
+              if rate > 1.0:
+                     factor, ftime = computeFactor(JOP)
+                     nfac += 1; fresh = True
+                     print('Chord Newton iteration: %d, rejected (rate: %.4f), factorization: %d, time: %.2f s' % \
+                           (nn+1, rate, nfac, time.time() - start))
+                     continue
+
+              dsol[lmsDOF:] += step[lmsDOF:]
+              dsol[0:lmsDOF] += step[0:lmsDOF]
+              q = qn; lms = lmsn; res = resn; JOP = JOPn
+              rnorm = rnormn
+              fresh = False
+
+              # Refactor at the new iterate when the contraction is too slow
+              refactor = rate > rateMax and rnorm > tol * rnorm0
+              if refactor:
+                     factor, ftime = computeFactor(JOP)
+                     nfac += 1; fresh = True
+
+              print('Chord Newton iteration: %d, residual: %10.4E, rate: %.4f, refactor: %s, time: %.2f s' % \
+                    (nn+1, rnorm / rnorm0, rate, refactor, time.time() - start))
+
+       print('Chord Newton factorizations: %d' % nfac)
+       if rnorm > tol * rnorm0:
+              raise cpc.ConvergenceError('Chord Newton NOT converged after %d iterations, residual: %10.4E' % \
+                                         (maxiter, rnorm / rnorm0))
+
+       # Total change in [LMS, q[sysDex]]
+       return dsol
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:05:12 2026
+
+Assembly of the BC reduced Jacobian as one global CSR matrix in the static
+solver ordering [LMS, u, w, ln_p, ln_theta] (Lagrange multipliers first).
+The sparsity pattern and the maps from derivative operator entries to global
+matrix entries are set up once; a Newton step only refreshes the data array.
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.sparse as sps
+
+# Newton Jacobian blocks (see computeJacobianMatrixLogPLogT) as
+# (row variable, column variable, pattern, x coefficient, z coefficient, diagonal coefficient)
+# Pattern 'XZ' is the union of the x and z operator patterns, 'Z' the z pattern, 'D' the diagonal
+JACOBIAN_BLOCKS = [(0, 0, 'XZ', 'U', 'WXZ', 'd11'), \
+                   (0, 1, 'D', None, None, 'c12'), \
+                   (0, 2, 'XZ', 'RdT', 'mRdTDZDX', 'c13'), \
+                   (0, 3, 'D', None, None, 'c14'), \
+                   (1, 0, 'D', None, None, 'c21'), \
+                   (1, 1, 'XZ', 'U', 'WXZ', 'd22'), \
+                   (1, 2, 'Z', None, 'RdT', 'c23'), \
+                   (1, 3, 'D', None, None, 'c24'), \
+                   (2, 0, 'XZ', 'gam', 'mgamDZDX', 'c31'), \
+                   (2, 1, 'Z', None, 'gam', 'c32'), \
+                   (2, 2, 'XZ', 'U', 'WXZ', 'd33'), \
+                   (3, 0, 'D', None, None, 'c41'), \
+                   (3, 1, 'D', None, None, 'c42'), \
+                   (3, 3, 'XZ', 'U', 'WXZ', 'd44')]
+
+# Assemblers kept between Newton steps in the same process
+assemblerCache = {}
+assemblerCacheSize = 4
+
+# Pointwise coefficients of each Jacobian term (Rayleigh on the diagonal blocks)
+def computeJacobianBlockCoefficients(JCF, RDG, gam):
+       JBC = dict(JCF)
+       JBC['mRdTDZDX'] = -JCF['RdT'] * JCF['DZDX']
+       JBC['gam'] = np.full(len(JCF['U']), gam)
+       JBC['mgamDZDX'] = -gam * JCF['DZDX']
+       JBC['d11'] = JCF['c11'] + RDG[:,0]
+       JBC['d22'] = JCF['c22'] + RDG[:,1]
+       JBC['d33'] = RDG[:,2]
+       JBC['d44'] = RDG[:,3]
+
+       return JBC
+
+# Union pattern of the given operators in CSR order with the values of each
+# operator on it (zero where an operator has no entry)
+def computeSourcePattern(OPS, operators):
+       keys = []
+       for MM in operators:
+              MM = sps.csr_matrix(MM)
+              MM.sum_duplicates()
+              rows = np.repeat(np.arange(OPS, dtype=np.int64), np.diff(MM.indptr))
+              keys.append((rows * OPS + MM.indices, MM.data))
+
+       # Row major keys sort into CSR order
+       ukeys, inv = np.unique(np.concatenate([kk[0] for kk in keys]), return_inverse=True)
+       src = {'prow' : ukeys // OPS, 'pcol' : ukeys % OPS}
+       start = 0
+       for ii in range(len(keys)):
+              vals = np.zeros(len(ukeys))
+              nk = len(keys[ii][0])
+              vals[inv[start:start+nk]] = keys[ii][1]
+              src['P' + str(ii)] = vals
+              start += nk
+
+       return src
+
+class JacobianAssembler:
+
+       def __init__(self, DDXM, DDZM, sysDex, ubdex, items=None):
+              if items is not None:
+                     # Pattern and maps from storage (operator cache)
+                     self.items = items
+                     self.shape = tuple(items['shape'])
+                     return
+
+              OPS = DDXM.shape[0]
+              if hasattr(DDXM, 'tocsr'):
+                     DDXM = DDXM.tocsr()
+                     DDZM = DDZM.tocsr()
+
+              # Per variable kept DOF (sysDex is sorted by variable) and maps to reduced indices
+              sysDex = np.asarray(sysDex)
+              ubdex = np.asarray(ubdex)
+              lmsDOF = len(ubdex)
+              rmaps = []
+              sizes = [lmsDOF]
+              for vv in range(4):
+                     vdex = sysDex[(sysDex >= vv * OPS) & (sysDex < (vv+1) * OPS)] - vv * OPS
+                     vmap = np.full(OPS, -1, dtype=np.int64)
+                     vmap[vdex] = np.arange(len(vdex))
+                     rmaps.append(vmap)
+                     sizes.append(len(vdex))
+              # Global offsets of [LMS, u, w, p, t]
+              offsets = np.concatenate(([0], np.cumsum(sizes)))
+              N = offsets[-1]
+
+              # Source patterns: x and z operators, z operator, identity
+              IOP = sps.identity(OPS, format='csr')
+              sources = {'XZ' : computeSourcePattern(OPS, [DDXM, DDZM, IOP]), \
+                         'Z' : computeSourcePattern(OPS, [DDZM, IOP]), \
+                         'D' : computeSourcePattern(OPS, [IOP])}
+
+              items = {}
+              for name, src in sources.items():
+                     for key in src:
+                            if key != 'pcol':
+                                   items['src.' + name + '.' + key] = src[key]
+
+              # Kept entries of each block and their reduced row and column (row sorted)
+              blocks = []
+              for bb, blk in enumerate(JACOBIAN_BLOCKS):
+                     src = sources[blk[2]]
+                     rr = rmaps[blk[0]][src['prow']]
+                     cc = rmaps[blk[1]][src['pcol']]
+                     kept = np.nonzero((rr >= 0) & (cc >= 0))[0]
+                     blocks.append((blk[0] + 1, blk[1] + 1, rr[kept], cc[kept]))
+                     items['blk' + str(bb) + '.kept'] = kept
+
+              # Lagrange multiplier columns (u and w terrain rows) and rows (transpose)
+              lagDex = np.arange(lmsDOF)
+              for vv in range(2):
+                     rr = rmaps[vv][ubdex]
+                     kept = np.nonzero(rr >= 0)[0]
+                     blocks.append((vv + 1, 0, rr[kept], lagDex[kept]))
+                     blocks.append((0, vv + 1, lagDex[kept], rr[kept]))
+                     items['lag' + str(vv) + '.kept'] = kept
+
+              # Row counts of each block (blocks in a block row ordered by column variable)
+              counts = [np.bincount(blk[2], minlength=sizes[blk[0]]) for blk in blocks]
+              rowTotal = np.zeros(N, dtype=np.int64)
+              for bb, blk in enumerate(blocks):
+                     rowTotal[offsets[blk[0]]:offsets[blk[0]+1]] += counts[bb]
+              indptr = np.concatenate(([0], np.cumsum(rowTotal)))
+
+              # Global data position of each kept entry
+              indices = np.empty(indptr[-1], dtype=np.int64)
+              colOffset = [np.zeros(sizes[vv], dtype=np.int64) for vv in range(5)]
+              for cv in range(5):
+                     for bb, blk in enumerate(blocks):
+                            if blk[1] != cv:
+                                   continue
+                            rows = blk[2]
+                            rowStart = np.cumsum(counts[bb]) - counts[bb]
+                            rank = np.arange(len(rows)) - rowStart[rows]
+                            pos = indptr[offsets[blk[0]] + rows] + colOffset[blk[0]][rows] + rank
+                            indices[pos] = offsets[cv] + blk[3]
+                            colOffset[blk[0]] += counts[bb]
+                            items['pos' + str(bb)] = pos
+
+              if N < np.iinfo(np.int32).max and indptr[-1] < np.iinfo(np.int32).max:
+                     indices = indices.astype(np.int32)
+                     indptr = indptr.astype(np.int32)
+              items['indptr'] = indptr
+              items['indices'] = indices
+              items['shape'] = np.array([N, N])
+              items['offsets'] = offsets
+              items['rmaps'] = np.stack(rmaps)
+              items['ubdex'] = ubdex
+
+              self.items = items
+              self.shape = (N, N)
+
+       # Global CSR matrix with the fixed pattern and new data
+       def makeMatrix(self, data):
+              return sps.csr_matrix((data, self.items['indices'], self.items['indptr']), \
+                                    shape=self.shape, copy=False)
+
+       def setLagrangeData(self, data, LCU):
+              nb = len(JACOBIAN_BLOCKS)
+              for vv in range(2):
+                     kept = self.items['lag' + str(vv) + '.kept']
+                     if vv == 0:
+                            vals = np.asarray(LCU)[kept]
+                     else:
+                            vals = np.ones(len(kept))
+                     data[self.items['pos' + str(nb + 2*vv)]] = vals
+                     data[self.items['pos' + str(nb + 2*vv + 1)]] = vals
+
+       # Newton Jacobian from pointwise coefficients (refreshes data only)
+       def assembleNewton(self, JCF, RDG, gam, LCU):
+              JBC = computeJacobianBlockCoefficients(JCF, RDG, gam)
+              data = np.zeros(len(self.items['indices']))
+
+              for bb, blk in enumerate(JACOBIAN_BLOCKS):
+                     sname = 'src.' + blk[2] + '.'
+                     kept = self.items['blk' + str(bb) + '.kept']
+                     rows = self.items[sname + 'prow'][kept]
+
+                     # Diagonal term is the last source operator
+                     if blk[2] == 'XZ':
+                            vals = JBC[blk[3]][rows] * self.items[sname + 'P0'][kept] + \
+                                   JBC[blk[4]][rows] * self.items[sname + 'P1'][kept] + \
+                                   JBC[blk[5]][rows] * self.items[sname + 'P2'][kept]
+                     elif blk[2] == 'Z':
+                            vals = JBC[blk[4]][rows] * self.items[sname + 'P0'][kept] + \
+                                   JBC[blk[5]][rows] * self.items[sname + 'P1'][kept]
+                     else:
+                            vals = JBC[blk[5]][rows]
+
+                     data[self.items['pos' + str(bb)]] = vals
+
+              self.setLagrangeData(data, LCU)
+
+              return self.makeMatrix(data)
+
+       # Any sparse Jacobian blocks (OPS X OPS, None for empty) and Rayleigh operators in one pass
+       def assembleBlocks(self, DOPS, ROPS, LCU):
+              rmaps = self.items['rmaps']
+              offsets = self.items['offsets']
+
+              # Lagrange multiplier entries from the fixed pattern
+              data = np.zeros(len(self.items['indices']))
+              self.setLagrangeData(data, LCU)
+              LM = self.makeMatrix(data).tocoo()
+              rows = [LM.row]; cols = [LM.col]; vals = [LM.data]
+
+              for rv in range(4):
+                     for cv in range(4):
+                            MM = DOPS[4*rv + cv]
+                            if rv == cv:
+                                   MM = ROPS[rv] if MM is None else MM + ROPS[rv]
+                            if MM is None:
+                                   continue
+                            MM = sps.coo_matrix(MM)
+                            rr = rmaps[rv][MM.row]
+                            cc = rmaps[cv][MM.col]
+                            kept = (rr >= 0) & (cc >= 0)
+                            rows.append(offsets[rv+1] + rr[kept])
+                            cols.append(offsets[cv+1] + cc[kept])
+                            vals.append(MM.data[kept])
+
+              return sps.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), \
+                                    shape=self.shape)
+
+       # Size of the velocity (Schur A) partition [LMS, u, w]
+       def getSchurSplit(self):
+              return int(self.items['offsets'][3])
+
+# Get the assembler from memory, the operator cache or make it
+def getJacobianAssembler(DDXM, DDZM, sysDex, ubdex, key=None, opCache=None):
+       if key is not None and key in assemblerCache:
+              return assemblerCache[key]
+
+       if key is not None and opCache is not None and opCache.contains(key):
+              print('Jacobian assembly pattern from cache: ' + key)
+              JAC = JacobianAssembler(None, None, None, None, items=opCache.load(key))
+       else:
+              JAC = JacobianAssembler(DDXM, DDZM, sysDex, ubdex)
+              if key is not None and opCache is not None:
+                     opCache.store(key, JAC.items)
+
+       if key is not None:
+              if len(assemblerCache) >= assemblerCacheSize:
+                     assemblerCache.pop(next(iter(assemblerCache)))
+              assemblerCache[key] = JAC
+
+       return JAC
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 10:14:37 2026
+
+Mixed precision direct solution of the static system. The operator is
+factored in single precision (half the memory of the factors and twice the
+LAPACK/SuperLU throughput) and double precision accuracy is recovered by
+refinement against the float64 operator, either classical iterative
+refinement with the low precision solve ('ir') or GMRES-IR ('gmres'), where
+each correction is a GMRES solve right preconditioned by the low precision
+factors (robust when cond(A) * eps_single approaches 1).
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.sparse.linalg as spl
+import computeColumnPreconditioner as cpc
+
+# Refinement sweeps and relative residual target
+MIXED_REFINE_ITS = 10
+MIXED_REFINE_TOL = 1.0E-12
+# Inner GMRES of GMRES-IR (relative tolerance and Krylov space per correction)
+MIXED_GMRES_TOL = 1.0E-4
+MIXED_GMRES_RESTART = 20
+
+# Single precision SuperLU of a sparse operator (float64 in and out)
+def computeLowPrecisionFactor(AN):
+       opts = dict(Equil=True, IterRefine='NOREFINE')
+       factor = spl.splu(AN.astype(np.float32).tocsc(), permc_spec='MMD_ATA', options=opts)
+
+       def lowSolve(b):
+              return factor.solve(b.astype(np.float32)).astype(np.float64)
+
+       return lowSolve
+
+# Solution of AOP * x = b (float64) refined from the approximate solve lowSolve
+# (raises ValueError for an unknown method and cpc.ConvergenceError when the
+# refinement diverges or misses tol)
+def solveRefined(AOP, b, lowSolve, method='ir', tol=MIXED_REFINE_TOL, maxiter=MIXED_REFINE_ITS, \
+                 label='Mixed precision'):
+       if method not in ('ir', 'gmres'):
+              raise ValueError('INVALID REFINEMENT METHOD: ' + str(method))
+
+       if method == 'gmres':
+              M = spl.LinearOperator(AOP.shape, matvec=lowSolve, dtype=np.dtype(np.float64))
+
+       bnorm = np.linalg.norm(b)
+       x = np.zeros(b.shape)
+       r = np.array(b)
+       rnorm = bnorm
+       for ii in range(maxiter):
+              if method == 'ir':
+                     dx = lowSolve(r)
+              else:
+                     dx = cpc.solveKrylov(AOP, r, M=M, method='gmres', tol=MIXED_GMRES_TOL, \
+                                          restart=MIXED_GMRES_RESTART, maxiter=1, strict=False)
+
+              # Residual in double precision
+              rn = b - AOP.dot(x + dx)
+              rnormn = np.linalg.norm(rn)
+              print(label + ' refinement (' + method + '): %d, relative residual: %10.4E' % \
+                    (ii+1, rnormn / bnorm))
+
+              if not rnormn < rnorm:
+                     raise cpc.ConvergenceError(label + ' refinement NOT converging: ' + \
+                                                'cond(A) too large for the approximate factors')
+
+              x += dx
+              r = rn
+              rnorm = rnormn
+              if rnorm <= tol * bnorm:
+                     return x
+
+       raise cpc.ConvergenceError(label + ' refinement NOT converged after %d sweeps, relative residual: %10.4E' % \
+                                  (maxiter, rnorm / bnorm))
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 24 09:12:51 2026
+
+Grid, terrain following domain, boundary index vectors, background state,
+Rayleigh layers and 2D derivative operators of a test case on a grid DIMS.
+This is the setup of runModel (static or transient configuration) and of
+the coarse static levels of the spectral multigrid, so all of them share one
+definition and the same operator cache entries.
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.sparse as sps
+from computeGrid import computeGrid
+from computeAdjust4CBC import computeAdjust4CBC
+from computeColumnInterp import getColumnInterpolator
+from computeTopographyOnGrid import computeTopographyOnGrid
+from computeTemperatureProfileOnGrid import computeTemperatureProfileOnGrid
+from computeThermoMassFields import computeThermoMassFields
+from computeShearProfileOnGrid import computeShearProfileOnGrid
+from computeRayleighEquations import computeRayleighEquations
+import computeGuellrichDomain2D as coords
+import computePartialDerivativesXZ as devop
+import computeDerivativeMatrix as derv
+
+# BC profile of the sponge layer options
+def computeBCType(RLOPT):
+       if RLOPT[5] == 'uwpt_static':
+              print('BC profile: ' + RLOPT[5])
+              return 1
+       elif RLOPT[5] == 'uwpt_transient':
+              print('BC profile: ' + RLOPT[5])
+              return 2
+       else:
+              print('DEFAULT BC profile: ' + RLOPT[5])
+              return 1
+
+# Setup of the test case on the grid DIMS (operators from the cache opCache if given).
+# TensorOps, ChebTransOps, RSBops and ApplyGML are the transient operator switches of runModel
+def computeModelSetup(thisTest, DIMS, StaticSolve, opCache=None, TensorOps=False, ChebTransOps=False, \
+                      RSBops=False, ApplyGML=False):
+       PHYS = thisTest.PHYS
+       RLOPT = thisTest.RLOPT
+       HOPT = thisTest.HOPT
+       HermCheb = thisTest.solType['HermChebGrid']
+       # Use the uniform grid fourier solution if not Hermite Functions
+       FourCheb = not HermCheb
+       bcType = computeBCType(RLOPT)
+       numVar = 4
+       NX = DIMS[3]
+       NZ = DIMS[4]
+       OPS = DIMS[5]
+
+       #%% SET UP THE GRID AND INDEX VECTORS
+       #% Define the computational and physical grids+
+       verticalChebGrid = True
+
+       gridKey = None
+       if opCache is not None:
+              gridKey = opCache.makeKey('grid1D', DIMS, HermCheb, FourCheb, verticalChebGrid)
+
+       if opCache is not None and opCache.contains(gridKey):
+              print('Grids and 1D operators from cache: ' + gridKey)
+              OP1D = opCache.load(gridKey)
+              REFS = [OP1D['x'], OP1D['z']]
+              DDX_1D, HF_TRANS = OP1D['DDX_1D'], OP1D['HF_TRANS']
+              DDZ_1D, CH_TRANS = OP1D['DDZ_1D'], OP1D['CH_TRANS']
+              DDX_D4, DDZ_D4 = OP1D['DDX_D4'], OP1D['DDZ_D4']
+              DDX_CS, DDZ_CS = OP1D['DDX_CS'], OP1D['DDZ_CS']
+              del(OP1D)
+       else:
+              REFS = computeGrid(DIMS, HermCheb, FourCheb, verticalChebGrid)
+
+              # Compute the raw derivative matrix operators in alpha-xi computational space
+              if HermCheb and not FourCheb:
+                     DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
+              elif FourCheb and not HermCheb:
+                     DDX_1D, HF_TRANS = derv.computeFourierDerivativeMatrix(DIMS)
+              else:
+                     DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
+
+              DDZ_1D, CH_TRANS = derv.computeChebyshevDerivativeMatrix(DIMS)
+
+              # Turn on compact finite difference...
+              DDX_D4 = derv.computeCompactFiniteDiffDerivativeMatrix1(DIMS, REFS[0])
+              DDZ_D4 = derv.computeCompactFiniteDiffDerivativeMatrix1(DIMS, REFS[1])
+              # Turn on cubic spline derivatives...
+              DDX_CS, DDX2_CS = derv.computeCubicSplineDerivativeMatrix(DIMS, REFS[0], True)
+              DDZ_CS, DDX2_CS = derv.computeCubicSplineDerivativeMatrix(DIMS, REFS[1], True)
+
+              if opCache is not None:
+                     opCache.store(gridKey, {'x' : REFS[0], 'z' : REFS[1], \
+                                             'DDX_1D' : DDX_1D, 'HF_TRANS' : HF_TRANS, \
+                                             'DDZ_1D' : DDZ_1D, 'CH_TRANS' : CH_TRANS, \
+                                             'DDX_D4' : DDX_D4, 'DDZ_D4' : DDZ_D4, \
+                                             'DDX_CS' : DDX_CS, 'DDZ_CS' : DDZ_CS})
+
+       # Update the REFS collection
+       REFS.append(DDX_1D)
+       REFS.append(DDZ_1D)
+
+       #% Read in topography profile or compute from analytical function
+       HofX, dHdX = computeTopographyOnGrid(REFS, HOPT, DDX_1D)
+
+       # Compute DX and DZ grid length scales
+       DX_min = 1.0 * np.min(np.abs(np.diff(REFS[0])))
+       DZ_min = 1.0 * np.min(np.abs(np.diff(REFS[1])))
+       print('Minimum grid lengths:',DX_min,DZ_min)
+       DX_avg = 1.0 * np.mean(np.abs(np.diff(REFS[0])))
+       DZ_avg = 1.0 * np.mean(np.abs(np.diff(REFS[1])))
+       print('Average grid lengths:',DX_avg,DZ_avg)
+       DX_max = 1.0 * np.max(np.abs(np.diff(REFS[0])))
+       DZ_max = 1.0 * np.max(np.abs(np.diff(REFS[1])))
+       print('Maximum grid lengths:',DX_max,DZ_max)
+       DX_wav = 1.0 * abs(DIMS[1] - DIMS[0]) / (NX+1)
+       DZ_wav = 1.0 * abs(DIMS[2]) / (NZ)
+       print('Wavelength grid lengths:',DX_wav,DZ_wav)
+
+       # Make the 2D physical domains from reference grids and topography
+       zRay = DIMS[2] - RLOPT[0]
+       # USE THE GUELLRICH TERRAIN DECAY
+       XL, ZTL, DZT, sigma, ZRL, DXM, DZM = \
+              coords.computeGuellrichDomain2D(DIMS, REFS, zRay, HofX, dHdX, StaticSolve)
+       # USE UNIFORM STRETCHING
+       #XL, ZTL, DZT, sigma, ZRL = coords.computeStretchedDomain2D(DIMS, REFS, zRay, HofX, dHdX)
+
+       # Update the REFS collection
+       REFS.append(XL)
+       REFS.append(ZTL)
+       REFS.append(dHdX)
+       REFS.append(sigma)
+
+       #% Compute the BC index vector
+       uldex, urdex, ubdex, utdex, wbdex, \
+       ubcDex, wbcDex, pbcDex, tbcDex, \
+       zeroDex, sysDex, ebcDex = \
+              computeAdjust4CBC(DIMS, numVar, thisTest.varDex, bcType)
+
+       #%% MAKE THE INITIAL/BACKGROUND STATE
+       # Map the sounding to the computational vertical 2D grid [0 H]
+       TZ, DTDZ, D2TDZ2 = \
+              computeTemperatureProfileOnGrid(PHYS, REFS, thisTest.Z_in, thisTest.T_in, \
+                                              thisTest.solType['Smooth3Layer'], thisTest.solType['UnifStrat'])
+
+       # Compute background fields on the reference column
+       dlnPdz, LPZ, PZ, dlnPTdz, LPT, PT, RHO = \
+              computeThermoMassFields(PHYS, DIMS, REFS, TZ[:,0], DTDZ[:,0], 'sensible', \
+                                      thisTest.solType['UnifStrat'])
+
+       # Read in or compute background horizontal wind profile
+       U, dUdz = computeShearProfileOnGrid(REFS, thisTest.JETOPS, PHYS[1], PZ, dlnPdz, \
+                                           thisTest.solType['UnifWind'], thisTest.solType['LinShear'])
+
+       if verticalChebGrid:
+              interpolationType = '1DtoTerrainFollowingCheb'
+       else:
+              interpolationType = '1DtoTerrainFollowingCheb2Lin'
+
+       #% Interpolate background profiles to the 2D grid (one batched product)
+       colInterp = getColumnInterpolator(DIMS, REFS[1], 0, ZTL, CH_TRANS, interpolationType)
+       DUDZ, UZ, LOGP, LOGT = colInterp.interpolate([dUdz, U, LPZ, LPT])
+
+       #% Compute the background gradients in physical 2D space
+       # Compute thermodynamic gradients (no interpolation!)
+       PORZ = PHYS[3] * TZ
+       DLPDZ = -PHYS[0] / PHYS[3] * np.reciprocal(TZ)
+       DLTDZ = np.reciprocal(TZ) * DTDZ
+       DLPTDZ = DLTDZ - PHYS[4] * DLPDZ
+       # Compute 2nd derivatives
+       D2LPDZ2 = - DLTDZ * DLPDZ
+       D2LPTDZ2 = np.reciprocal(TZ) * D2TDZ2 - DLTDZ * DLPTDZ
+
+       # Get the static vertical gradients and store
+       DUDZ = np.reshape(DUDZ, (OPS,1), order='F')
+       DLTDZ = np.reshape(DLTDZ, (OPS,1), order='F')
+       DLPDZ = np.reshape(DLPDZ, (OPS,1), order='F')
+       DLPTDZ = np.reshape(DLPTDZ, (OPS,1), order='F')
+       DQDZ = np.hstack((DUDZ, np.zeros((OPS,1)), DLPDZ, DLPTDZ))
+
+       # Compute the background (initial) fields
+       PBAR = np.exp(LOGP) # Hydrostatic pressure
+
+       #%% RAYLEIGH AND GML WEIGHT OPERATORS
+       ROPS, RLM, GML, SBR = computeRayleighEquations(DIMS, REFS, ZRL, RLOPT, ubdex, utdex)
+       if ApplyGML:
+              GMLOP = sps.diags(np.reshape(GML[0], (OPS,), order='F'), offsets=0, format='csr')
+              GMLOX = sps.diags(np.reshape(GML[1], (OPS,), order='F'), offsets=0, format='csr')
+              GMLOZ = sps.diags(np.reshape(GML[2], (OPS,), order='F'), offsets=0, format='csr')
+       else:
+              GMLOP = sps.identity(OPS, format='csr')
+              GMLOX = sps.identity(OPS, format='csr')
+              GMLOZ = sps.identity(OPS, format='csr')
+
+       SBROP = sps.diags(np.reshape(SBR, (OPS,), order='F'), offsets=0, format='csr')
+       # Make a collection for background field derivatives
+       REFG = [(GMLOP, GMLOX, GMLOZ), DLTDZ, DQDZ, RLOPT[4], RLM, SBROP]
+
+       # Update the REFS collection
+       REFS.append(np.reshape(UZ, (OPS,), order='F'))
+       REFS.append((np.reshape(PORZ, (OPS,), order='F'), np.reshape(PBAR, (OPS,), order='F')))
+
+       # Get some memory back here
+       del(PORZ)
+       del(DUDZ)
+       del(DLTDZ)
+       del(DLPDZ)
+       del(DLPTDZ)
+       del(GML)
+
+       #%% DIFFERENTIATION OPERATORS
+
+       # Quality control on derivative matrices
+       #DDX_1D[np.isclose(DDX_1D, 0.0, atol=1.0E-15)] = 0.0
+       #DDZ_1D[np.isclose(DDZ_1D, 0.0, atol=1.0E-15)] = 0.0
+
+       if TensorOps:
+              # Kronecker structured operators (no OPS X OPS assembly)
+              if ChebTransOps:
+                     DDZ_TR = derv.ChebyshevTransformDerivative(DIMS)
+              else:
+                     DDZ_TR = DDZ_1D
+              # Cubic Spline first derivative (implicit banded form, no inverse)
+              DDX_CSB = derv.computeCubicSplineDerivativeOperator(DIMS, REFS[0], True)
+              DDZ_CSB = derv.computeCubicSplineDerivativeOperator(DIMS, REFS[1], True)
+
+              if FourCheb:
+                     # Periodic grid: real FFT derivative for dynamics and diffusion
+                     DDX_TR = derv.FourierTransformDerivative(DIMS)
+                     DDX_CSB = DDX_TR
+              else:
+                     DDX_TR = DDX_1D
+
+              DDXMS, DDZMS = devop.computePartialDerivativesXZ_Tensor(DIMS, REFS, DDX_TR, DDZ_TR)
+              DDXM_CS, DDZM_CS = devop.computePartialDerivativesXZ_Tensor(DIMS, REFS, DDX_CSB, DDZ_CSB)
+       else:
+              if opCache is not None:
+                     # 2D operators also depend on the terrain following coordinate
+                     opsKey = opCache.makeKey('ops2D', gridKey, HOPT, RLOPT[0], StaticSolve)
+
+              if opCache is not None and opCache.contains(opsKey):
+                     print('2D derivative operators from cache: ' + opsKey)
+                     OP2D = opCache.load(opsKey)
+                     DDXMS, DDZMS = OP2D['DDXMS'], OP2D['DDZMS']
+                     DDXM_CS, DDZM_CS = OP2D['DDXM_CS'], OP2D['DDZM_CS']
+                     del(OP2D)
+              else:
+                     DDXMS, DDZMS = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_1D, DDZ_1D)
+                     # 4th order compact finite difference (Gamet, 1999)
+                     DDXM_D4, DDZM_D4 = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_D4, DDZ_D4)
+                     del(DDXM_D4); del(DDZM_D4)
+                     # Cubic Spline first derivative matrix
+                     DDXM_CS, DDZM_CS = devop.computePartialDerivativesXZ(DIMS, REFS, DDX_CS, DDZ_CS)
+
+                     if opCache is not None:
+                            opCache.store(opsKey, {'DDXMS' : DDXMS, 'DDZMS' : DDZMS, \
+                                                   'DDXM_CS' : DDXM_CS, 'DDZM_CS' : DDZM_CS})
+
+       REFS.append(DDXMS) # index 10
+       REFS.append(DDZMS) # index 11
+
+       if not StaticSolve and TensorOps:
+              # Matrix free operators for the transient solution
+              REFS.append((DDXMS, DDZMS))
+              REFS.append((DDXM_CS, DDZM_CS))
+       elif not StaticSolve and RSBops:
+              from rsb import rsb_matrix
+              # Multithreaded enabled for transient solution
+              REFS.append((rsb_matrix(DDXMS), rsb_matrix(DDZMS)))
+              REFS.append((rsb_matrix(DDXM_CS), rsb_matrix(DDZM_CS)))
+       elif not StaticSolve and not RSBops:
+              # Native sparsr
+              REFS.append((DDXMS, DDZMS))
+              REFS.append((DDXM_CS, DDZM_CS))
+       else:
+              # Matrix operators for Jacobian assembly
+              REFS.append(DDXM_CS)
+              REFS.append(DDZM_CS)
+
+       # Store the terrain profile
+       REFS.append(DZT)
+       DZDX = np.reshape(DZT, (OPS,1), order='F')
+       REFS.append(DZDX)
+
+       # Compute and store the 2nd derivatives of background quantities
+       D2QDZ2 = DDZM_CS.dot(DQDZ)
+       D2QDZ2[:,2] = np.reshape(D2LPDZ2, (OPS,), order='F')
+       D2QDZ2[:,3] = np.reshape(D2LPTDZ2, (OPS,), order='F')
+       REFG.append(D2QDZ2)
+
+       return {'DIMS' : DIMS, 'bcType' : bcType, 'gridKey' : gridKey, 'REFS' : REFS, 'REFG' : REFG, \
+               'ROPS' : ROPS, 'HF_TRANS' : HF_TRANS, 'CH_TRANS' : CH_TRANS, \
+               'dHdX' : dHdX, 'XL' : XL, 'ZTL' : ZTL, 'DZT' : DZT, 'DX_avg' : DX_avg, 'DZ_avg' : DZ_avg, \
+               'uldex' : uldex, 'ubdex' : ubdex, 'wbdex' : wbdex, 'ubcDex' : ubcDex, 'wbcDex' : wbcDex, \
+               'pbcDex' : pbcDex, 'tbcDex' : tbcDex, 'zeroDex' : zeroDex, 'sysDex' : sysDex, 'ebcDex' : ebcDex, \
+               'UZ' : UZ, 'LOGP' : LOGP, 'LOGT' : LOGT, 'U' : U}
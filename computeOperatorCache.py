@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:12:40 2026
+
+Content addressed disk cache for grids and derivative operators. Entries are
+directories of .npy files (memory mapped on load) named by a hash of the
+inputs that define them (input files named in a key are hashed by content).
+A manifest keeps sizes and access times for LRU eviction and the cache
+version for invalidation. Manifest updates are read-modify-write under an
+exclusive lock file and written atomically, so concurrent runs can share
+the cache.
+
+@author: TempestGuerra
+"""
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import numpy as np
+import scipy.sparse as sps
+
+# Bump this when any cached operator construction changes
+OPCACHE_VERSION = 3
+
+# Content hash of an input file (edited inputs make new keys)
+def computeFileDigest(fileName):
+       digest = hashlib.sha1()
+       with open(fileName, 'rb') as ff:
+              for block in iter(lambda: ff.read(1 << 20), b''):
+                     digest.update(block)
+                     
+       return digest.hexdigest()
+
+# Reduce keys to plain (platform independent) python types
+def normalizeKeyArg(arg):
+       if isinstance(arg, str) and os.path.isfile(arg):
+              return [arg, computeFileDigest(arg)]
+       elif isinstance(arg, (list, tuple)):
+              return [normalizeKeyArg(aa) for aa in arg]
+       elif isinstance(arg, dict):
+              return {str(kk) : normalizeKeyArg(arg[kk]) for kk in sorted(arg)}
+       elif isinstance(arg, (np.ndarray, np.generic)):
+              return np.asarray(arg).tolist()
+       else:
+              return arg
+
+class OperatorCache:
+
+       def __init__(self, cacheDir, maxBytes=8.0E9, version=OPCACHE_VERSION):
+              self.cacheDir = cacheDir
+              self.maxBytes = maxBytes
+              self.version = version
+              self.manifestName = os.path.join(cacheDir, 'manifest.json')
+              self.lockName = os.path.join(cacheDir, 'manifest.lock')
+
+              os.makedirs(cacheDir, exist_ok=True)
+
+              # Invalidate entries written by other cache versions
+              def removeOtherVersions():
+                     for key in list(self.manifest):
+                            if self.manifest[key]['version'] != self.version:
+                                   self.removeEntry(key)
+              self.updateManifest(removeOtherVersions)
+
+       def readManifest(self):
+              try:
+                     with open(self.manifestName, 'r') as mf:
+                            return json.load(mf)
+              except (OSError, ValueError):
+                     return {}
+
+       def writeManifest(self):
+              tempName = self.manifestName + '.' + str(os.getpid()) + '.tmp'
+              with open(tempName, 'w') as mf:
+                     json.dump(self.manifest, mf, indent=1)
+              os.replace(tempName, self.manifestName)
+
+       # Apply update() to the current manifest on disk under the lock file
+       def updateManifest(self, update):
+              with open(self.lockName, 'a') as lf:
+                     fcntl.flock(lf, fcntl.LOCK_EX)
+                     try:
+                            self.manifest = self.readManifest()
+                            update()
+                            self.writeManifest()
+                     finally:
+                            fcntl.flock(lf, fcntl.LOCK_UN)
+
+       def makeKey(self, *args):
+              keyString = json.dumps([self.version, normalizeKeyArg(args)], sort_keys=True)
+              return hashlib.sha1(keyString.encode('utf-8')).hexdigest()
+
+       def contains(self, key):
+              return key in self.manifest and \
+                     os.path.isdir(os.path.join(self.cacheDir, key))
+
+       def removeEntry(self, key):
+              shutil.rmtree(os.path.join(self.cacheDir, key), ignore_errors=True)
+              self.manifest.pop(key, None)
+
+       # Drop least recently used entries until the cache fits in maxBytes
+       def evict(self, keepKey=None):
+              totalBytes = sum([entry['bytes'] for entry in self.manifest.values()])
+              byAccess = sorted(self.manifest, key=lambda kk: self.manifest[kk]['access'])
+
+              for key in byAccess:
+                     if totalBytes <= self.maxBytes:
+                            break
+                     if key == keepKey:
+                            continue
+                     totalBytes -= self.manifest[key]['bytes']
+                     self.removeEntry(key)
+                     print('Operator cache evicted: ' + key)
+
+       def store(self, key, items):
+              entryDir = os.path.join(self.cacheDir, key)
+              tempDir = entryDir + '.tmp'
+              shutil.rmtree(tempDir, ignore_errors=True)
+              os.makedirs(tempDir)
+
+              # Dense arrays stored as is, sparse matrices as CSR arrays
+              sparse = {}
+              nbytes = 0
+              for name, MM in items.items():
+                     if sps.issparse(MM):
+                            MM = MM.tocsr()
+                            sparse[name] = list(MM.shape)
+                            arrays = {name + '.data' : MM.data, \
+                                      name + '.indices' : MM.indices, \
+                                      name + '.indptr' : MM.indptr}
+                     else:
+                            arrays = {name : np.asarray(MM)}
+
+                     for aname, AA in arrays.items():
+                            np.save(os.path.join(tempDir, aname + '.npy'), AA)
+                            nbytes += AA.nbytes
+
+              shutil.rmtree(entryDir, ignore_errors=True)
+              os.replace(tempDir, entryDir)
+
+              def addEntry():
+                     self.manifest[key] = {'version' : self.version, 'bytes' : nbytes, \
+                                           'access' : time.time(), 'names' : list(items), \
+                                           'sparse' : sparse}
+                     self.evict(keepKey=key)
+              self.updateManifest(addEntry)
+
+       # Memory mapped (copy on write) arrays of a cached entry
+       def load(self, key):
+              entryDir = os.path.join(self.cacheDir, key)
+              entry = self.manifest[key]
+
+              items = {}
+              for name in entry['names']:
+                     if name in entry['sparse']:
+                            data = np.load(os.path.join(entryDir, name + '.data.npy'), mmap_mode='c')
+                            indices = np.load(os.path.join(entryDir, name + '.indices.npy'), mmap_mode='c')
+                            indptr = np.load(os.path.join(entryDir, name + '.indptr.npy'), mmap_mode='c')
+                            items[name] = sps.csr_matrix((data, indices, indptr), \
+                                                         shape=tuple(entry['sparse'][name]))
+                     else:
+                            items[name] = np.load(os.path.join(entryDir, name + '.npy'), mmap_mode='c')
+
+              def touchEntry():
+                     if key in self.manifest:
+                            self.manifest[key]['access'] = time.time()
+              self.updateManifest(touchEntry)
+
+              return items
@@ -6,8 +6,80 @@ Created on Fri Aug  2 17:10:18 2019
 @author: TempestGuerra
 """
 
+import time
+import tracemalloc
 import numpy as np
 import scipy.sparse as sps
+import scipy.sparse.linalg as spl
+
+# Trace the peak memory of the operator assembly (tracemalloc slows the assembly)
+TRACE_ASSEMBLY = False
+
+# Sparse triplets of the 2D x operator: 1D operator on each level (Kronecker)
+def computeSparseTripletsX(NX, NZ, DDX_1D, levels):
+       # Nonzero pattern of the 1D operator (same pruning as dense to sparse)
+       DD = np.real(DDX_1D)
+       ii, jj = np.nonzero(DD)
+       vv = DD[ii, jj]
+       
+       levels = np.expand_dims(np.asarray(levels), axis=0)
+       rows = np.expand_dims(ii * NZ, axis=1) + levels
+       cols = np.expand_dims(jj * NZ, axis=1) + levels
+       vals = np.repeat(np.expand_dims(vv, axis=1), levels.shape[1], axis=1)
+       
+       return rows.ravel(), cols.ravel(), vals.ravel()
+
+# Sparse triplets of the 2D z operator: sigma scaled 1D operator on each column
+def computeSparseTripletsZ(NX, NZ, DDZ_1D, sigma, columns):
+       DD = np.real(DDZ_1D)
+       ii, jj = np.nonzero(DD)
+       vv = DD[ii, jj]
+       
+       columns = np.expand_dims(np.asarray(columns), axis=0)
+       rows = np.expand_dims(ii, axis=1) + NZ * columns
+       cols = np.expand_dims(jj, axis=1) + NZ * columns
+       # TF adjustment for vertical coordinate transformation
+       vals = np.expand_dims(vv, axis=1) * sigma[np.expand_dims(ii, axis=1), columns]
+       
+       return rows.ravel(), cols.ravel(), vals.ravel()
+
+def computeSparseFromTriplets(OPS, triplets):
+       rows = np.concatenate([tt[0] for tt in triplets])
+       cols = np.concatenate([tt[1] for tt in triplets])
+       vals = np.concatenate([tt[2] for tt in triplets])
+       
+       return sps.csr_matrix((vals, (rows, cols)), shape=(OPS,OPS))
+
+def startAssemblyTrace():
+       if TRACE_ASSEMBLY and not tracemalloc.is_tracing():
+              tracemalloc.start()
+              return True
+       
+       return False
+
+def stopAssemblyTrace(isStarted):
+       peak = None
+       if tracemalloc.is_tracing():
+              peak = tracemalloc.get_traced_memory()[1]
+       if isStarted:
+              tracemalloc.stop()
+              
+       return peak
+
+def reportAssembly(start, peak, DDXM, DDZM):
+       endt = time.time()
+       nnz = DDXM.nnz + DDZM.nnz
+       opMem = 0
+       for MM in (DDXM, DDZM):
+              opMem += MM.data.nbytes + MM.indices.nbytes + MM.indptr.nbytes
+              
+       message = 'Assembled 2D derivative operators: %.4f (sec), nnz = %d, storage = %.2f (MB)' \
+                 % (endt - start, nnz, opMem / 1.0E6)
+       if peak is not None:
+              message += ', peak = %.2f (MB)' % (peak / 1.0E6)
+       print(message)
+       
+       return
 
 def computePartialDerivativesXZ(DIMS, REFS, DDX_1D, DDZ_1D):
        # Get the dimensions
@@ -18,29 +90,21 @@ def computePartialDerivativesXZ(DIMS, REFS, DDX_1D, DDZ_1D):
        # Get REFS data
        sigma = REFS[7]
        
-       # Unwrap the 1D derivative matrices into 2D operators
+       start = time.time()
+       traceStarted = startAssemblyTrace()
+       
+       # Unwrap the 1D derivative matrices into 2D operators (no dense OPS X OPS)
        
        #%% Vertical derivative and diffusion operators
-       DDZ_OP = np.empty((OPS,OPS))
-       for cc in range(NX):
-              # Advanced slicing used to get submatrix
-              ddex = np.array(range(NZ)) + cc * NZ
-              # TF adjustment for vertical coordinate transformation
-              SIGMA = sps.diags(sigma[:,cc])
-              DDZ_OP[np.ix_(ddex,ddex)] = SIGMA.dot(DDZ_1D)
-              
-       # Make the operators sparse
-       DDZM = sps.csr_matrix(DDZ_OP); del(DDZ_OP)
+       tripletsZ = computeSparseTripletsZ(NX, NZ, DDZ_1D, sigma, range(NX))
+       DDZM = computeSparseFromTriplets(OPS, [tripletsZ]); del(tripletsZ)
            
        #%% Horizontal Derivative
-       DDX_OP = np.empty((OPS,OPS))
-       for rr in range(NZ):
-              ddex = np.array(range(0,OPS,NZ)) + rr
-              # Advanced slicing used to get submatrix
-              DDX_OP[np.ix_(ddex,ddex)] = DDX_1D
-              
-       # Make the operators sparse
-       DDXM = sps.csr_matrix(DDX_OP); del(DDX_OP)
+       tripletsX = computeSparseTripletsX(NX, NZ, DDX_1D, range(NZ))
+       DDXM = computeSparseFromTriplets(OPS, [tripletsX]); del(tripletsX)
+       
+       peak = stopAssemblyTrace(traceStarted)
+       reportAssembly(start, peak, DDXM, DDZM)
 
        return DDXM, DDZM
 
@@ -53,34 +117,134 @@ def computePartialDerivativesXZ_BC(DIMS, REFS, DDX_1D, DDZ_1D, DDX_BC, DDZ_BC):
        # Get REFS data
        sigma = REFS[7]
        
-       # Unwrap the 1D derivative matrices into 2D operators
+       start = time.time()
+       traceStarted = startAssemblyTrace()
        
-       #%% Vertical derivative and diffusion operators
-       DDZ_OP = np.empty((OPS,OPS))
-       for cc in range(NX):
-              # Advanced slicing used to get submatrix
-              ddex = np.array(range(NZ)) + cc * NZ
+       # Unwrap the 1D derivative matrices into 2D operators (no dense OPS X OPS)
+       
+       #%% Vertical derivative and diffusion operators (BC operator on end columns)
+       bcCols = [0, NX-1]
+       inCols = range(1, NX-1)
+       tripletsZ = [computeSparseTripletsZ(NX, NZ, DDZ_BC, sigma, bcCols), \
+                    computeSparseTripletsZ(NX, NZ, DDZ_1D, sigma, inCols)]
+       DDZM = computeSparseFromTriplets(OPS, tripletsZ); del(tripletsZ)
+           
+       #%% Horizontal Derivative (BC operator on bottom and top levels)
+       bcLevs = [0, NZ-1]
+       inLevs = range(1, NZ-1)
+       tripletsX = [computeSparseTripletsX(NX, NZ, DDX_BC, bcLevs), \
+                    computeSparseTripletsX(NX, NZ, DDX_1D, inLevs)]
+       DDXM = computeSparseFromTriplets(OPS, tripletsX); del(tripletsX)
+       
+       peak = stopAssemblyTrace(traceStarted)
+       reportAssembly(start, peak, DDXM, DDZM)
+
+       return DDXM, DDZM
+
+# Matrix free 2D derivative operator from 1D operators (Kronecker structure)
+# Fields are column major (NZ, NX+1) grids stacked as (OPS, numVar) arrays
+class TensorDerivativeOperatorXZ(spl.LinearOperator):
+       
+       def __init__(self, DIMS, DD_1D, direction, sigma=None, dtype=np.float64):
+              self.DIMS = DIMS
+              self.NX = DIMS[3] + 1
+              self.NZ = DIMS[4]
+              self.OPS = self.NX * self.NZ
+              self.direction = direction
+              
+              # Keep the real operator as the assembled versions do
+              if isinstance(DD_1D, np.ndarray):
+                     self.DD = np.ascontiguousarray(np.real(DD_1D), dtype=dtype)
+              elif np.dtype(dtype) != np.float64:
+                     self.DD = DD_1D.astype(dtype)
+              else:
+                     self.DD = DD_1D
+              
               # TF adjustment for vertical coordinate transformation
-              SIGMA = sps.diags(sigma[:,cc])
-              if cc == 0 or cc == NX-1:
-                     DDZ_OP[np.ix_(ddex,ddex)] = SIGMA.dot(DDZ_BC)
+              if sigma is not None:
+                     self.sigma = sigma
+                     self.sigmaT = np.ascontiguousarray(sigma.T, dtype=dtype)
               else:
-                     DDZ_OP[np.ix_(ddex,ddex)] = SIGMA.dot(DDZ_1D)
+                     self.sigma = None
+                     self.sigmaT = None
               
-       # Make the operators sparse
-       DDZM = sps.csr_matrix(DDZ_OP); del(DDZ_OP)
-           
-       #%% Horizontal Derivative
-       DDX_OP = np.empty((OPS,OPS))
-       for rr in range(NZ):
-              ddex = np.array(range(0,OPS,NZ)) + rr
-              # Advanced slicing used to get submatrix
-              if rr == 0 or cc == NZ-1:
-                     DDX_OP[np.ix_(ddex,ddex)] = DDX_BC
+              super().__init__(dtype=np.dtype(dtype), shape=(self.OPS, self.OPS))
+              
+       # Copy of the operator in another precision
+       def astype(self, dtype):
+              return TensorDerivativeOperatorXZ(self.DIMS, self.DD, self.direction, self.sigma, dtype)
+              
+       def _matvec(self, x):
+              return self._matmat(np.reshape(x, (self.OPS,1)))
+       
+       def _matmat(self, X):
+              NV = X.shape[1]
+              # (OPS, NV) column major is a stack of NV (NX, NZ) row major grids
+              Q = np.reshape(X.T, (NV, self.NX, self.NZ))
+              
+              if self.direction == 'x':
+                     if isinstance(self.DD, np.ndarray):
+                            # Batched GEMM along the rows of each field
+                            DQ = np.matmul(self.DD, Q)
+                     else:
+                            # 1D engine (banded solve, transform) along rows
+                            DQ = self.DD.dot(Q, axis=1)
+              elif self.direction == 'z':
+                     if isinstance(self.DD, np.ndarray):
+                            # Single GEMM over all columns of all fields
+                            QZ = np.reshape(Q, (NV * self.NX, self.NZ))
+                            DQ = QZ.dot(self.DD.T)
+                            DQ = np.reshape(DQ, (NV, self.NX, self.NZ))
+                     else:
+                            # 1D engine (banded solve, transform) along columns
+                            DQ = self.DD.dot(Q, axis=2)
+                     
+                     if self.sigmaT is not None:
+                            DQ = DQ * self.sigmaT
+              
+              return np.reshape(DQ, (NV, self.OPS)).T
+       
+       def toarray1D(self):
+              if isinstance(self.DD, np.ndarray):
+                     return self.DD
               else:
-                     DDX_OP[np.ix_(ddex,ddex)] = DDX_1D
+                     return self.DD.toarray()
+
+       # Assembled sparse 2D operator (when an explicit matrix is needed)
+       def tocsr(self):
+              if self.direction == 'x':
+                     triplets = computeSparseTripletsX(self.NX, self.NZ, self.toarray1D(), range(self.NZ))
+              elif self.direction == 'z':
+                     triplets = computeSparseTripletsZ(self.NX, self.NZ, self.toarray1D(), self.sigmaT.T, range(self.NX))
+
+              return computeSparseFromTriplets(self.OPS, [triplets])
+
+       # Dense submatrix M[np.ix_(rowDex, colDex)] without the 2D operator
+       def submatrix(self, rowDex, colDex):
+              rowDex = np.asarray(rowDex)
+              colDex = np.asarray(colDex)
+              DD = self.toarray1D()
+              
+              # Grid row (level) and column indices of each DOF
+              rr = np.expand_dims(rowDex % self.NZ, 1)
+              rc = np.expand_dims(rowDex // self.NZ, 1)
+              cr = np.expand_dims(colDex % self.NZ, 0)
+              cc = np.expand_dims(colDex // self.NZ, 0)
               
-       # Make the operators sparse
-       DDXM = sps.csr_matrix(DDX_OP); del(DDX_OP)
+              if self.direction == 'x':
+                     SM = np.where(rr == cr, DD[rc, cc], 0.0)
+              elif self.direction == 'z':
+                     SM = np.where(rc == cc, DD[rr, cr], 0.0)
+                     if self.sigmaT is not None:
+                            SM *= self.sigmaT[rc, rr]
+              
+              return SM
 
-       return DDXM, DDZM
\ No newline at end of file
+def computePartialDerivativesXZ_Tensor(DIMS, REFS, DDX_1D, DDZ_1D):
+       # Get REFS data
+       sigma = REFS[7]
+       
+       DDXM = TensorDerivativeOperatorXZ(DIMS, DDX_1D, 'x')
+       DDZM = TensorDerivativeOperatorXZ(DIMS, DDZ_1D, 'z', sigma)
+       
+       return DDXM, DDZM
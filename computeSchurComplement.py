@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:31:44 2026
+
+Out of core Schur complement solution of the static system
+
+       [AS BS] [sol1] = [f1]
+       [CS DS] [sol2]   [f2]
+
+DS_SC = AS - BS * DS^-1 * CS is built in column chunks by a process pool
+and written in place into a memory mapped .npy file (Fortran order) shared
+by the workers. BS and CS stay sparse: DS^-1 * CS is only computed for the
+CS columns with nonzeros and BS * (DS^-1 * CS) is a sparse-dense product.
+The LU factors of DS, BS and the list of finished chunks are checkpointed
+next to it so that a failed run resumes where it stopped for the same
+operator blocks. Optionally DS is factored as a HODLR matrix (computeHODLR)
+whose compressed factors the workers share by memory maps like the LU of DS,
+or DS and DS_SC as dense LU in single precision (DS_SC also stored in
+float32), and the solution is refined with the sparse blocks in double
+precision (computeMixedPrecision). DS_SC is badly conditioned and of high
+off diagonal rank, so it keeps a dense LU of the complement built with the
+compressed DS solves. HODLR only reduces the DS part of the cost: DS
+storage and each DS solve are O(ND r log ND) for off diagonal ranks r,
+while DS_SC stays O(NA^2) in storage, O(NA^3) to factor and O(NA^2) per
+solve, and the update BS * DS^-1 * CS is still written to all NA^2
+entries of DS_SC.
+
+@author: TempestGuerra
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import scipy.sparse as sps
+import scipy.linalg as dsl
+import computeHODLR as hodlr
+import computeMixedPrecision as mpr
+from threadpoolctl import threadpool_limits
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Fraction of available memory used by the chunks in flight
+SCHUR_MEM_FRACTION = 0.5
+
+def computeAvailableMemory():
+       try:
+              return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+       except (ValueError, OSError, AttributeError):
+              return 4.0E9
+
+# Columns per chunk such that all workers fit in the memory budget (entries of itemsize bytes)
+def computeChunkSize(NA, ND, NC, nworkers, memBytes, itemsize=8):
+       # Dense CS chunk / DS^-1 CS chunk (ND) and BS product (NA) per column
+       bytesPerColumn = itemsize * (ND + NA)
+       NCC = int(memBytes / (nworkers * bytesPerColumn))
+
+       # At least one chunk per worker
+       NCC = min(NCC, int(np.ceil(NC / nworkers)))
+
+       return max(NCC, 1)
+
+# A priori work (flops) and storage (bytes) of the Schur complement solution
+def computeSchurCost(AS, BS, CS, DS):
+       NA = AS.shape[0]
+       ND = DS.shape[0]
+       BS = sps.csr_matrix(BS)
+       CS = sps.csc_matrix(CS)
+       NCZ = np.count_nonzero(np.diff(CS.indptr)) # CS columns with nonzeros
+
+       cost = {'NA' : NA, 'ND' : ND, 'NCZ' : NCZ}
+       cost['factorDS'] = 2.0 / 3.0 * ND**3
+       cost['solveDS'] = 2.0 * ND**2 * NCZ
+       cost['productBS'] = 2.0 * BS.nnz * NCZ
+       cost['factorSC'] = 2.0 / 3.0 * NA**3
+       cost['flops'] = cost['factorDS'] + cost['solveDS'] + cost['productBS'] + cost['factorSC']
+       # Dense products with all the columns of CS
+       cost['flopsDense'] = cost['factorDS'] + 2.0 * ND**2 * NA + 2.0 * NA * ND * NA + cost['factorSC']
+
+       # LU of DS in memory, DS_SC on disk (mapped), sparse blocks
+       cost['bytesDS'] = 8.0 * ND**2
+       cost['bytesSC'] = 8.0 * NA**2
+       cost['bytesSparse'] = 12.0 * (sps.csr_matrix(AS).nnz + BS.nnz + CS.nnz)
+
+       return cost
+
+def printSchurCost(cost):
+       print('Schur complement NA: %d, ND: %d, CS columns with nonzeros: %d' % \
+             (cost['NA'], cost['ND'], cost['NCZ']))
+       print('Estimated work: %.4E (GFLOP), dense products: %.4E (GFLOP)' % \
+             (cost['flops'] * 1.0E-9, cost['flopsDense'] * 1.0E-9))
+       print('Estimated storage: LU of DS %.4E (GB), DS_SC on disk %.4E (GB), sparse blocks %.4E (GB)' % \
+             (cost['bytesDS'] * 1.0E-9, cost['bytesSC'] * 1.0E-9, cost['bytesSparse'] * 1.0E-9))
+
+# Signature of the sparse blocks (checkpoints only valid for the same system)
+def computeBlockSignature(blocks, options=''):
+       sig = hashlib.sha1(options.encode())
+       for MM in blocks:
+              MM = sps.csr_matrix(MM)
+              sig.update(np.array(MM.shape).tobytes())
+              sig.update(MM.indptr.tobytes())
+              sig.update(MM.indices.tobytes())
+              sig.update(MM.data.tobytes())
+
+       return sig.hexdigest()
+
+class SchurCheckpoint:
+
+       def __init__(self, workDir, signature):
+              self.workDir = workDir
+              self.stateName = os.path.join(workDir, 'schurState.json')
+              self.signature = signature
+              os.makedirs(workDir, exist_ok=True)
+
+       def fileName(self, name):
+              return os.path.join(self.workDir, name + '.npy')
+
+       def read(self):
+              try:
+                     with open(self.stateName, 'r') as sf:
+                            state = json.load(sf)
+              except (OSError, ValueError):
+                     return None
+
+              if state.get('signature') != self.signature:
+                     return None
+
+              return state
+
+       def write(self, state):
+              state['signature'] = self.signature
+              tempName = self.stateName + '.tmp'
+              with open(tempName, 'w') as sf:
+                     json.dump(state, sf)
+              os.replace(tempName, self.stateName)
+
+# Memory maps of the operator files in each worker process
+schurWorker = {}
+
+def loadFactorDS(workDir, compressed):
+       if compressed:
+              return hodlr.loadHODLR(os.path.join(workDir, 'hodlrDS'))
+       else:
+              return (np.load(os.path.join(workDir, 'luDS.npy'), mmap_mode='r'), \
+                      np.load(os.path.join(workDir, 'pivDS.npy')))
+
+# Solve with dense LU factors (double or single precision) or a factored HODLR matrix
+def solveFactor(factor, b, overwrite=False):
+       if isinstance(factor, hodlr.HODLRMatrix):
+              return factor.solve(b)
+       elif factor[0].dtype != b.dtype:
+              # Right side in the precision of the factors (not the factors promoted)
+              sol = dsl.lu_solve(factor, b.astype(factor[0].dtype), overwrite_b=True, check_finite=False)
+              return sol.astype(np.float64)
+       else:
+              return dsl.lu_solve(factor, b, overwrite_b=overwrite, check_finite=False)
+
+def printHODLRStats(name, HM):
+       stats = HM.getStats()
+       print('HODLR factors of ' + name + ', max rank: %d, storage: %.4E (GB), dense: %.4E (GB)' % \
+             (stats['maxRank'], stats['bytes'] * 1.0E-9, 8.0E-9 * HM.N**2))
+
+# blasThreads caps the BLAS threads of a worker (the pool shares the cores),
+# factorDS is the factor already in memory (single process) or mapped from workDir
+def initSchurWorker(workDir, compressed, blasThreads=None, factorDS=None):
+       if blasThreads is not None:
+              schurWorker['blasLimits'] = threadpool_limits(limits=blasThreads, user_api='blas')
+       if factorDS is None:
+              factorDS = loadFactorDS(workDir, compressed)
+       schurWorker['factorDS'] = factorDS
+       schurWorker['DS_SC'] = np.lib.format.open_memmap(os.path.join(workDir, 'DS_SC.npy'), mode='r+')
+       # Chunk products in the precision of DS_SC
+       schurWorker['BS'] = sps.load_npz(os.path.join(workDir, 'BS.npz')).astype(schurWorker['DS_SC'].dtype)
+
+# Set DS_SC[:,cbegin:cend] = AS_chunk - BS * DS^-1 * CS_chunk (repeatable on restart)
+def computeSchurChunk(cbegin, cend, AS_chunk, CS_chunk):
+       DS_SC = schurWorker['DS_SC']
+       DS_SC[:,cbegin:cend] = AS_chunk.toarray()
+
+       # Only the columns of CS with nonzeros contribute
+       nzc = np.nonzero(np.diff(CS_chunk.indptr))[0]
+       if len(nzc) > 0:
+              CS_chunk = CS_chunk[:,nzc].astype(DS_SC.dtype).toarray()
+              DS_chunk = solveFactor(schurWorker['factorDS'], CS_chunk, overwrite=True) # LONG EXECUTION
+              del(CS_chunk)
+
+              # Sparse BS times dense DS^-1 * CS
+              DS_SC[:,cbegin + nzc] -= schurWorker['BS'].dot(DS_chunk) # LONG EXECUTION
+              del(DS_chunk)
+
+       DS_SC.flush()
+
+       return cbegin
+
+# DS_SC = AS - BS * DS^-1 * CS into a memory mapped array (resumable)
+def computeSchurComplementChunks(AS, BS, CS, check, state, nworkers, compressed, factorDS, dtype=np.float64):
+       NA = AS.shape[0]
+       NC = AS.shape[1]
+       NCC = state['chunkSize']
+       cranges = [range(cc, min(cc + NCC, NC)) for cc in range(0, NC, NCC)]
+
+       if state['stage'] == 'start':
+              # Create the file (the workers fill it in place)
+              np.lib.format.open_memmap(check.fileName('DS_SC'), mode='w+', \
+                                        dtype=dtype, shape=(NA, NC), fortran_order=True)
+              sps.save_npz(os.path.join(check.workDir, 'BS.npz'), BS)
+
+              state['stage'] = 'chunks'
+              state['done'] = [False] * len(cranges)
+              check.write(state)
+
+       todo = [cc for cc in range(len(cranges)) if not state['done'][cc]]
+       if len(todo) < len(cranges):
+              print('Resuming Schur complement from checkpoint, chunks left: ', len(todo))
+       print('Computing DS^-1 * CS in chunks: ', len(cranges), ' with processes: ', nworkers)
+
+       ASC = sps.csc_matrix(AS)
+       CSC = sps.csc_matrix(CS)
+       # Checkpoint each chunk as it finishes
+       def finishChunk(cc):
+              state['done'][cc] = True
+              check.write(state)
+              print('Computed chunk: ', cc+1, ' of ', len(cranges))
+
+       if nworkers > 1 and len(todo) > 1:
+              # Worker processes (LAPACK solves are not safe to share between threads)
+              # with the BLAS threads split among them
+              blasThreads = max(1, os.cpu_count() // nworkers)
+              with ProcessPoolExecutor(max_workers=nworkers, initializer=initSchurWorker, \
+                                       initargs=(check.workDir, compressed, blasThreads)) as pool:
+                     futures = {}
+                     for cc in todo:
+                            crange = cranges[cc]
+                            futures[pool.submit(computeSchurChunk, crange.start, crange.stop, \
+                                                ASC[:,crange.start:crange.stop], \
+                                                CSC[:,crange.start:crange.stop])] = cc
+                     for future in as_completed(futures):
+                            future.result()
+                            finishChunk(futures[future])
+       else:
+              initSchurWorker(check.workDir, compressed, factorDS=factorDS)
+              for cc in todo:
+                     crange = cranges[cc]
+                     computeSchurChunk(crange.start, crange.stop, ASC[:,crange.start:crange.stop], \
+                                       CSC[:,crange.start:crange.stop])
+                     finishChunk(cc)
+              schurWorker.clear()
+
+       return np.lib.format.open_memmap(check.fileName('DS_SC'), mode='r+')
+
+# Block solution with the factors of DS and DS_SC
+def applySchurSolve(factorDS, factorDS_SC, BS, CS, f1, f2):
+       f2_hat = solveFactor(factorDS, f2)
+       f1_hat = f1 - BS.dot(f2_hat)
+       sol1 = solveFactor(factorDS_SC, f1_hat, overwrite=True)
+       del(f1_hat)
+       f2_hat = f2 - CS.dot(sol1)
+       sol2 = solveFactor(factorDS, f2_hat, overwrite=True)
+
+       return sol1, sol2
+
+# HODLR of a block ordered by group (unknowns in a group never split) or
+# in a bandwidth reducing order of its pattern
+def computeHODLRFactor(MM, tol, groups):
+       if groups is None:
+              perm = hodlr.computeLocalityOrder(MM)
+       else:
+              perm = np.argsort(groups, kind='stable')
+              groups = groups[perm]
+
+       return hodlr.HODLRMatrix(hodlr.makeBlockSource(MM), MM.shape[0], tol, perm=perm, groups=groups).factor()
+
+# Solution of the block system by the Schur complement of DS (HODLR compressed
+# factors of DS at relative tolerance hodlrTol, dense LU if None, DS_SC is dense).
+# hodlrGroups labels the unknowns of the system for the HODLR ordering (optional).
+# lowPrec ('ir' or 'gmres') factors the dense LU in single precision with that refinement
+def solveSchurComplement(AS, BS, CS, DS, f1, f2, workDir, nworkers=None, hodlrTol=None, hodlrGroups=None, \
+                         lowPrec=None):
+       if nworkers is None:
+              nworkers = os.cpu_count()
+
+       NA = AS.shape[0]
+       ND = DS.shape[0]
+       compressed = hodlrTol is not None
+       if compressed:
+              lowPrec = None
+       fdtype = np.float64 if lowPrec is None else np.float32
+       BS = sps.csr_matrix(BS)
+       CS = sps.csr_matrix(CS)
+       printSchurCost(computeSchurCost(AS, BS, CS, DS))
+       check = SchurCheckpoint(workDir, computeBlockSignature([AS, BS, CS, DS], \
+                                                        str(hodlrTol) + ('' if lowPrec is None else ' float32')))
+       state = check.read()
+
+       if state is None or state['stage'] == 'factor':
+              # New system (or interrupted factorization of DS_SC)
+              memBytes = SCHUR_MEM_FRACTION * computeAvailableMemory()
+              state = {'stage' : 'start', \
+                       'chunkSize' : computeChunkSize(NA, ND, AS.shape[1], nworkers, memBytes, \
+                                                      np.dtype(fdtype).itemsize)}
+
+       # Factor DS (or get the factors from the checkpoint)
+       if state['stage'] == 'start':
+              if compressed:
+                     factorDS = computeHODLRFactor(DS, hodlrTol, \
+                                                   None if hodlrGroups is None else hodlrGroups[NA:])
+                     hodlr.saveHODLR(factorDS, os.path.join(check.workDir, 'hodlrDS'))
+                     printHODLRStats('DS', factorDS)
+              else:
+                     factorDS = dsl.lu_factor(DS.astype(fdtype).toarray(), overwrite_a=True, check_finite=False)
+                     np.save(check.fileName('luDS'), factorDS[0])
+                     np.save(check.fileName('pivDS'), factorDS[1])
+              print('Factor D... DONE!')
+       else:
+              factorDS = loadFactorDS(check.workDir, compressed)
+              print('Factor D from checkpoint... DONE!')
+
+       DS_SC = computeSchurComplementChunks(AS, BS, CS, check, state, nworkers, compressed, factorDS, \
+                                            dtype=fdtype)
+       print('Solve DS^-1 * CS... DONE!')
+       print('Compute Schur Complement of D... DONE!')
+
+       # Factor in place on the memory map (a restart must rebuild DS_SC)
+       state['stage'] = 'factor'
+       check.write(state)
+       factorDS_SC = dsl.lu_factor(DS_SC, overwrite_a=True, check_finite=False)
+       del(DS_SC)
+       print('Factor Schur Complement of D... DONE!')
+
+       if compressed or lowPrec is not None:
+              # Refinement of the approximate factor solution with the sparse blocks
+              AOP = sps.bmat([[AS, BS], [CS, DS]], format='csr')
+              def approxSolve(r):
+                     return np.concatenate(applySchurSolve(factorDS, factorDS_SC, BS, CS, r[0:NA], r[NA:]))
+
+              if compressed:
+                     sol = mpr.solveRefined(AOP, np.concatenate((f1, f2)), approxSolve, method='ir', \
+                                            label='HODLR')
+              else:
+                     sol = mpr.solveRefined(AOP, np.concatenate((f1, f2)), approxSolve, method=lowPrec)
+              sol1 = sol[0:NA]
+              sol2 = sol[NA:]
+       else:
+              sol1, sol2 = applySchurSolve(factorDS, factorDS_SC, BS, CS, f1, f2)
+       print('Solve for u and w, ln(p) and ln(theta)... DONE!')
+
+       return np.concatenate((sol1, sol2))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 10:27:44 2026
+
+Spectral p-multigrid for the BC reduced static system [LMS, q[sysDex]]. The
+levels are the same problem on coarser (NX, NZ) grids (degrees divided by
+MG_COARSEN) set up by computeModelSetup as the static path of runModel.
+Prolongation evaluates the coarse grid expansions (HF_TRANS, CH_TRANS) at the
+fine nodes, in the computational (x, reference z) coordinates shared by all
+the terrain following grids. Residuals are restricted by the matching L2
+projection in the quadrature of the fine grid, R = (P^T * Wf * P)^-1 * P^T * Wf
+along x and z (the spectral counterpart of full weighting, R * P = I also for
+the Hermite function levels that are not nested). States (Newton coarse
+operators) are restricted by evaluating the fine expansions at the coarse
+nodes.
+
+Coarse operators are the classical linearization or the Newton Jacobian at
+the restricted state (same blocks as computeJacobianMatrixLogPLogT) on the
+coarse assembly patterns and only the coarsest one is factored. Smoothing is
+damped Richardson with the fast diagonalization preconditioner of each level
+(column block smoothing diverges on the indefinite static operator unless
+heavily shifted). The V-cycle is a fixed linear operator and serves as a
+right preconditioner for GMRES: fine level storage is the operator, the
+batched column systems of the smoother and a few vectors (no fine factors).
+
+The V-cycle cuts the GMRES operator products relative to the fast
+diagonalization preconditioner alone (ClassicalScharIter: 86 vs 180 at 31x24,
+221 vs 501 at 63x48) but NOT the solve time (1.0 vs 0.6 s, 20 vs 10 s): the
+fine level smoothing applies the fast diagonalization MG_PRE_SMOOTH +
+MG_POST_SMOOTH times per cycle. One sweep each (weight 0.7) is faster at 31x24
+(0.76 s) and slower at 63x48 (597 products, 35 s). 'fastdiag' stays the default.
+
+@author: TempestGuerra
+"""
+
+import numpy as np
+import scipy.sparse.linalg as spl
+import HerfunChebNodesWeights as hcnw
+from computeGrid import computeGrid
+from computeHorizontalInterp import computeHorizontalInterpMatrix
+import computeDerivativeMatrix as derv
+import computeEulerEquationsLogPLogT as eqs
+import computeJacobianAssembly as jasm
+import computeColumnPreconditioner as cpc
+import computeIterativeSolveNL as nks
+import computeFourierModeSolve as fms
+import computeFastDiagonalization as fdg
+from computeModelSetup import computeModelSetup
+
+# Number of levels (fine included), degree reduction per level and smallest NX, NZ
+MG_LEVELS = 3
+MG_COARSEN = 2
+MG_MIN_POINTS = 8
+# Damped (Richardson) smoothing sweeps before and after the coarse correction
+MG_PRE_SMOOTH = 2
+MG_POST_SMOOTH = 2
+MG_SMOOTH_WEIGHT = 0.5
+# Smoother of the levels: 'fastdiag' or 'column' blocks (with the lumped coupling shift)
+MG_SMOOTHER = 'fastdiag'
+MG_SMOOTH_SHIFT = 1.0
+
+# Grid dimensions of the levels from the fine grid down
+def computeLevelDims(DIMS, levels=MG_LEVELS):
+       LDIMS = [tuple(DIMS)]
+       NX = DIMS[3]
+       NZ = DIMS[4]
+       for ll in range(1, levels):
+              # Horizontal grid sizes stay odd
+              NX = (NX // MG_COARSEN) | 1
+              NZ //= MG_COARSEN
+              if NX < MG_MIN_POINTS or NZ < MG_MIN_POINTS:
+                     break
+              LDIMS.append((DIMS[0], DIMS[1], DIMS[2], NX, NZ, (NX + 1) * NZ))
+
+       return LDIMS
+
+# Static problem of the test case on the grid DIMS (the setup of runModel)
+def computeStaticLevel(thisTest, DIMS, opCache=None):
+       RLOPT = thisTest.RLOPT
+       HOPT = thisTest.HOPT
+       NX = DIMS[3]
+       OPS = DIMS[5]
+       print('Multigrid level setup: NX = %d, NZ = %d' % (NX, DIMS[4]))
+
+       # Grid, background state and operators (shared with runModel through the cache)
+       SETUP = computeModelSetup(thisTest, DIMS, True, opCache)
+       REFS = SETUP['REFS']
+       DDXMS, DDZMS = REFS[10], REFS[11]
+       sysDex, ubdex = SETUP['sysDex'], SETUP['ubdex']
+
+       INIT = np.concatenate((np.reshape(SETUP['UZ'], (OPS,), order='F'), np.zeros(OPS), \
+                              np.reshape(SETUP['LOGP'], (OPS,), order='F'), \
+                              np.reshape(SETUP['LOGT'], (OPS,), order='F')))
+
+       # Terrain constraint and the assembly pattern
+       dHdXB = SETUP['dHdX'][0:NX+1]
+       ExactBC = thisTest.solType['ExactBC']
+       if ExactBC:
+              LCU = -1.0 * dHdXB
+       else:
+              LCU = np.zeros(len(ubdex))
+       if opCache is not None:
+              jacKey = opCache.makeKey('jacobian', SETUP['gridKey'], HOPT, RLOPT[0], SETUP['bcType'])
+              JAC = jasm.getJacobianAssembler(DDXMS, DDZMS, sysDex, ubdex, jacKey, opCache)
+       else:
+              JAC = jasm.getJacobianAssembler(DDXMS, DDZMS, sysDex, ubdex)
+
+       return {'DIMS' : DIMS, 'PHYS' : thisTest.PHYS, 'REFS' : REFS, 'REFG' : SETUP['REFG'], \
+               'ROPS' : SETUP['ROPS'], 'INIT' : INIT, 'HF_TRANS' : SETUP['HF_TRANS'], \
+               'CH_TRANS' : SETUP['CH_TRANS'], 'sysDex' : sysDex, 'ubdex' : ubdex, 'dHdXB' : dHdXB, \
+               'LCU' : LCU, 'JAC' : JAC, 'ExactBC' : ExactBC, 'HermCheb' : thisTest.solType['HermChebGrid']}
+
+# Grid and spectral transforms of a resolution (the data of a level used by the transfers)
+def computeGridTransforms(DIMS, HermCheb, opCache=None):
+       if opCache is not None:
+              gridKey = opCache.makeKey('grid1D', DIMS, HermCheb, not HermCheb, True)
+              if opCache.contains(gridKey):
+                     OP1D = opCache.load(gridKey)
+                     return {'DIMS' : DIMS, 'REFS' : [OP1D['x'], OP1D['z']], 'HF_TRANS' : OP1D['HF_TRANS'], \
+                             'CH_TRANS' : OP1D['CH_TRANS'], 'HermCheb' : HermCheb}
+
+       REFS = computeGrid(DIMS, HermCheb, not HermCheb, True)
+       if HermCheb:
+              DDX_1D, HF_TRANS = derv.computeHermiteFunctionDerivativeMatrix(DIMS)
+       else:
+              DDX_1D, HF_TRANS = derv.computeFourierDerivativeMatrix(DIMS)
+       DDZ_1D, CH_TRANS = derv.computeChebyshevDerivativeMatrix(DIMS)
+
+       return {'DIMS' : DIMS, 'REFS' : REFS, 'HF_TRANS' : HF_TRANS, 'CH_TRANS' : CH_TRANS, 'HermCheb' : HermCheb}
+
+# Evaluation matrices of the LF grid expansions at the LT grid nodes (x and reference z)
+def computeTransferMatrices(LF, LT):
+       IX = computeHorizontalInterpMatrix(LF['DIMS'], LT['REFS'][0], LF['HF_TRANS'], LF['HermCheb'])
+       xi = 2.0 / LF['DIMS'][2] * LT['REFS'][1] - 1.0
+       IZ = hcnw.chebpolym(LF['DIMS'][4] - 1, -xi).dot(LF['CH_TRANS'])
+
+       return IX, IZ
+
+# Quadrature weights of a level along x (physical) and along the reference z
+def computeQuadratureWeights(LEV):
+       DIMS = LEV['DIMS']
+       NX = DIMS[3] + 1
+       NZ = DIMS[4]
+       if LEV['HermCheb']:
+              alpha, whf = hcnw.hefunclb(NX-1)
+              WX = whf * 0.5 * abs(DIMS[1] - DIMS[0]) / np.amax(alpha)
+       else:
+              WX = abs(DIMS[1] - DIMS[0]) / NX * np.ones(NX)
+
+       # Chebyshev-Gauss-Lobatto weights
+       WZ = np.pi / (NZ - 1) * np.ones(NZ)
+       WZ[0] *= 0.5
+       WZ[-1] *= 0.5
+
+       return WX, WZ
+
+# Restriction matrices of residuals from the LF grid: L2 projections (fine quadrature)
+# onto the range of the prolongation matrices (IX, IZ) to the LF grid
+def computeRestrictionMatrices(LF, IX, IZ):
+       WXF, WZF = computeQuadratureWeights(LF)
+       PWX = IX.T * WXF
+       PWZ = IZ.T * WZF
+
+       return np.linalg.solve(PWX.dot(IX), PWX), np.linalg.solve(PWZ.dot(IZ), PWZ)
+
+# Full state vectors (variable, column, level) from the LF grid to the LT grid
+def transferState(q, IX, IZ):
+       Q = np.reshape(q, (4, IX.shape[1], IZ.shape[1]))
+       QT = np.matmul(np.matmul(IX, Q), IZ.T)
+
+       return np.reshape(QT, (4 * IX.shape[0] * IZ.shape[0],))
+
+# Static solution (state columns of SOLT) and Lagrange multipliers from the LF grid to the LT grid
+def transferSolution(SOLT, LMS, LF, LT):
+       IX, IZ = computeTransferMatrices(LF, LT)
+       SOLTI = np.column_stack([transferState(SOLT[:,cc], IX, IZ) for cc in range(SOLT.shape[1])])
+
+       # Removed boundary DOF keep their zero perturbation
+       if 'sysDex' in LT:
+              bcDex = np.ones(SOLTI.shape[0], dtype=bool)
+              bcDex[LT['sysDex']] = False
+              SOLTI[bcDex,:] = 0.0
+
+       return SOLTI, IX.dot(LMS)
+
+# Reduced vectors [LMS, q[sysDex]] from the LF grid to the LT grid (zero on the removed DOF)
+def transferReduced(x, LF, LT, IX, IZ):
+       lmsDOF = len(LF['ubdex'])
+       q = np.zeros(4 * LF['DIMS'][5])
+       q[LF['sysDex']] = x[lmsDOF:]
+       qt = transferState(q, IX, IZ)
+
+       return np.concatenate((IX.dot(x[0:lmsDOF]), qt[LT['sysDex']]))
+
+# Static operator of a level: classical or Newton Jacobian at the perturbation state
+def computeLevelOperator(LEV, state=None):
+       PHYS = LEV['PHYS']
+       REFS = LEV['REFS']
+       if state is None:
+              DOPS = eqs.computeEulerEquationsLogPLogT_Classical(LEV['DIMS'], PHYS, REFS, LEV['REFG'])
+              return LEV['JAC'].assembleBlocks(DOPS, LEV['ROPS'], LEV['LCU'])
+
+       OPS = LEV['DIMS'][5]
+       vdex = [np.arange(vv * OPS, (vv + 1) * OPS) for vv in range(4)]
+       fields, U, W = eqs.computePrepareFields(REFS, state, LEV['INIT'], *vdex)
+       JOP = eqs.JacobianOperatorLogPLogT(PHYS, REFS, LEV['REFG'], LEV['ROPS'], np.array(fields), U, \
+                                          LEV['sysDex'], LEV['ubdex'], LEV['dHdXB'], LEV['ExactBC'])
+
+       return LEV['JAC'].assembleNewton(JOP.JCF, JOP.RDG, PHYS[6], LEV['LCU'])
+
+# Approximate inverse of a level operator used for smoothing
+def computeLevelSmoother(LEV, AOP, opCache=None):
+       DIMS = LEV['DIMS']
+       if MG_SMOOTHER == 'fastdiag':
+              if opCache is not None:
+                     gridKey = opCache.makeKey('grid1D', DIMS, LEV['HermCheb'], not LEV['HermCheb'], True)
+                     EIGX = fdg.computeEigenDecomposition1D(LEV['REFS'][2], opCache.makeKey('eigen1D', gridKey), opCache)
+              else:
+                     EIGX = fdg.computeEigenDecomposition1D(LEV['REFS'][2])
+              COEFS = fms.computeFourierModeCoefficients(DIMS, LEV['REFS'], LEV['REFG'], LEV['ROPS'], layerMean=True)
+
+              return fdg.FastDiagPreconditioner(EIGX, COEFS, LEV['REFS'][3], LEV['PHYS'], \
+                                                LEV['sysDex'], LEV['ubdex'], DIMS[5])
+
+       colDex = cpc.computeColumnIndex(LEV['sysDex'], LEV['ubdex'], DIMS[5], DIMS[4])
+       return cpc.ColumnBlockPreconditioner(AOP, colDex, shift=MG_SMOOTH_SHIFT)
+
+class SpectralMultigridPreconditioner(spl.LinearOperator):
+
+       # FINE: level data of the fine grid (DIMS, PHYS, REFS, REFG, ROPS, HF_TRANS, CH_TRANS, sysDex, ubdex)
+       # AN: fine operator, state: fine perturbation state of a Newton operator (None: classical)
+       def __init__(self, thisTest, FINE, AN, state=None, opCache=None, levels=MG_LEVELS):
+              LEVS = [dict(FINE, HermCheb=thisTest.solType['HermChebGrid'])]
+              for DIMS in computeLevelDims(FINE['DIMS'], levels)[1:]:
+                     LEVS.append(computeStaticLevel(thisTest, DIMS, opCache))
+
+              self.LEVS = LEVS
+              self.AOP = [AN.tocsr()]
+              self.RTR = []
+              self.PTR = []
+              for ll in range(1, len(LEVS)):
+                     self.PTR.append(computeTransferMatrices(LEVS[ll], LEVS[ll-1]))
+                     self.RTR.append(computeRestrictionMatrices(LEVS[ll-1], *self.PTR[-1]))
+                     if state is not None:
+                            state = transferState(state, *computeTransferMatrices(LEVS[ll-1], LEVS[ll]))
+                     self.AOP.append(computeLevelOperator(LEVS[ll], state).tocsr())
+
+              # Smoothers and the coarsest factors
+              self.SMO = [computeLevelSmoother(LEVS[ll], self.AOP[ll], opCache) for ll in range(len(LEVS) - 1)]
+              self.coarse = nks.computeSparseFactor(self.AOP[-1])
+              print('Spectral multigrid levels (NX, NZ): ', [(LEV['DIMS'][3], LEV['DIMS'][4]) for LEV in LEVS])
+
+              super().__init__(dtype=np.dtype(np.float64), shape=AN.shape)
+
+       def smooth(self, ll, b, x, sweeps):
+              for ss in range(sweeps):
+                     x += MG_SMOOTH_WEIGHT * self.SMO[ll].dot(b - self.AOP[ll].dot(x))
+              return x
+
+       def vcycle(self, ll, b):
+              if ll == len(self.LEVS) - 1:
+                     return self.coarse.solve(b)
+
+              x = self.smooth(ll, b, np.zeros(len(b)), MG_PRE_SMOOTH)
+
+              # Coarse grid correction of the residual
+              r = b - self.AOP[ll].dot(x)
+              rc = transferReduced(r, self.LEVS[ll], self.LEVS[ll+1], *self.RTR[ll])
+              xc = self.vcycle(ll + 1, rc)
+              x += transferReduced(xc, self.LEVS[ll+1], self.LEVS[ll], *self.PTR[ll])
+
+              return self.smooth(ll, b, x, MG_POST_SMOOTH)
+
+       def _matvec(self, r):
+              return self.vcycle(0, np.ravel(r))
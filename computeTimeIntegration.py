@@ -50,7 +50,7 @@ def computeTimeIntegrationNL2(PHYS, REFS, REFG, DX2, DZ2, DXZ, TOPT, \
                               sol0, init0, zeroDex, ebcDex, \
                               DynSGS, DCF, thisTime, isFirstStep):
        
-       DT = TOPT[0]
+       DT = float(TOPT[0])
        rampTimeBound = TOPT[2]
        order = TOPT[3]
        RdT_bar = REFS[9][0]
@@ -115,7 +115,7 @@ def computeTimeIntegrationNL2(PHYS, REFS, REFG, DX2, DZ2, DXZ, TOPT, \
               #''' TURNED ON IN ORIGINAL RUN
               # Apply Rayleigh layer implicitly
               propagator = np.reciprocal(1.0 + (mu * coeff * DT) * RLM.data)
-              solB = propagator.T * solB
+              solB = propagator.T.astype(solB.dtype, copy=False) * solB
               #'''
               
               return solB
@@ -130,11 +130,11 @@ def computeTimeIntegrationNL2(PHYS, REFS, REFG, DX2, DZ2, DXZ, TOPT, \
        
        def computeRHSUpdate_diffusion(fields, PqPx, PqPz, P2qPx2, P2qPz2, P2qPzx, P2qPxz):
               
-              # Compute sound speed
-              T_ratio = np.expm1(PHYS[4] * fields[:,2] + fields[:,3])
+              # Compute sound speed (double precision with the background)
+              T_ratio = np.expm1(PHYS[4] * fields[:,2].astype(np.float64) + fields[:,3])
               RdT = RdT_bar * (1.0 + T_ratio)
               PZ = np.exp(fields[:,2] + init0[:,2])
-              RHOI = np.expand_dims(RdT * np.reciprocal(PZ), axis=1)
+              RHOI = np.expand_dims(RdT * np.reciprocal(PZ), axis=1).astype(fields.dtype, copy=False)
               
               rhs = tendency.computeDiffusionTendency(PHYS, PqPx, PqPz, P2qPx2, P2qPz2, P2qPzx, P2qPxz, \
                                                       DZDX, ebcDex, DX2, DZ2, DXZ, RHOI, DCF, DynSGS)
@@ -15,6 +15,7 @@ from matplotlib import cm
 import matplotlib.pyplot as plt
 from netCDF4 import Dataset  # http://code.google.com/p/netcdf4-python/
 import computeDerivativeMatrix as derv
+from computeInterpolatedFields import getSpectralRegridder
 
 def computeHorizontalInterpHermite(NX, xint, FLD, HF_TRANS):
        import HerfunChebNodesWeights as hcnw
@@ -157,10 +158,13 @@ for rr in hresl:
        NXI = len(x)
        NZI = len(z)
 
-       WREFint = computeColumnInterp(NX, NZ, NZI, ZTL, WREF, CH_TRANS)
        if HermCheb:
-              WREFint = computeHorizontalInterpHermite(NX, np.array(x), WREFint, HF_TRANS)
+              # Target x mapped onto the native span (as the Hermite scaling did)
+              xint = 0.5 * abs(DIMS[1] - DIMS[0]) / max(x) * np.array(x)
+              REGRID = getSpectralRegridder(DIMS, CH_TRANS, HF_TRANS, xint, NZI)
+              WREFint = REGRID.regrid(WREF)
        else:
+              WREFint = computeColumnInterp(NX, NZ, NZI, ZTL, WREF, CH_TRANS)
               WREFint = computeHorizontalInterpFourier(np.array(REFS[0]), np.array(x), WREFint, HF_TRANS)
        
        # Sample the interior flow